@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ScormAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'scorm_app'
+
+    def ready(self):
+        # Connects the authentication cache invalidation handlers
+        from . import signals  # noqa: F401
@@ -0,0 +1,71 @@
+import hashlib
+import logging
+import time
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from .models import ScormPackage
+
+logger = logging.getLogger(__name__)
+
+# A grant is minted by launch_scorm once the attempt has been checked, and is
+# embedded in the asset URLs of the launch (/assets/<grant>/<path>). It names
+# the learner and the package, and its expiry is rounded up to a window of half
+# SCORM_ASSET_GRANT_MAX_AGE, so launches of a package within a window share
+# their asset URLs and the browser cache. Asset requests only verify the
+# signature; what they need to locate the files is cached under the grant, so
+# serving an asset does not touch the database.
+
+GRANT_SALT = 'scorm_app.asset_grant'
+
+def grant_cache_key(grant):
+    return f"scorm:grant:{hashlib.sha256(grant.encode()).hexdigest()}"
+
+def get_asset_target(package):
+    """Everything needed to serve a package's assets without loading the package again."""
+    return {
+        'package_id': package.id,
+        'is_extracted': package.is_extracted,
+        'extract_path': package.get_extract_path(),
+        'archive_path': package.file.path if package.file else '',
+    }
+
+def grant_expiry(now):
+    """Expiry of a grant minted at now: the end of the window after the current one."""
+    window = max(settings.SCORM_ASSET_GRANT_MAX_AGE // 2, 1)
+    return (int(now) // window + 2) * window
+
+def create_asset_grant(attempt):
+    """Sign a grant giving the attempt's learner access to its package assets."""
+    now = time.time()
+    expires = grant_expiry(now)
+    # No timestamp in the signature: the same learner, package and window give the same grant
+    grant = signing.Signer(salt=GRANT_SALT).sign_object(
+        {'u': attempt.user_id, 'p': attempt.scorm_package_id, 'e': expires}, compress=True,
+    )
+    target = dict(get_asset_target(attempt.scorm_package), user_id=attempt.user_id)
+    cache.set(grant_cache_key(grant), target, timeout=int(expires - now))
+    return grant
+
+def resolve_asset_grant(grant):
+    """Return the asset target of a grant, or None if it is invalid or expired."""
+    target = cache.get(grant_cache_key(grant))
+    if target is not None:
+        return target
+    try:
+        payload = signing.Signer(salt=GRANT_SALT).unsign_object(grant)
+    except signing.BadSignature:
+        logger.warning("Rejected invalid asset grant")
+        return None
+    remaining = int(payload['e'] - time.time())
+    if remaining <= 0:
+        logger.warning("Rejected expired asset grant")
+        return None
+    try:
+        package = ScormPackage.objects.get(id=payload['p'])
+    except ScormPackage.DoesNotExist:
+        return None
+    # Re-populate the cache after an eviction, for no longer than the grant remains valid
+    target = dict(get_asset_target(package), user_id=payload['u'])
+    cache.set(grant_cache_key(grant), target, timeout=remaining)
+    return target
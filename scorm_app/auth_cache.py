@@ -0,0 +1,106 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.utils.functional import SimpleLazyObject
+from rest_framework.authtoken.models import Token
+
+logger = logging.getLogger(__name__)
+
+# Token -> user id cache for CustomTokenAuthentication. A small per-process
+# LRU sits in front of the shared cache (Redis), so steady API traffic
+# authenticates without any database or network round trip. Only the user id
+# is cached, never the Token or User rows (which carry the password hash); the
+# user is loaded lazily by TokenUser when a view needs more than its id.
+#
+# Invalidation (signals.py) deletes the shared entry and the local one of the
+# process that made the change; other processes drop theirs within
+# SCORM_AUTH_LOCAL_CACHE_TTL seconds. A cache hit does not check is_active, so
+# code deactivating users without saving them (QuerySet.update()) should call
+# invalidate_user_tokens; otherwise the entries live SCORM_AUTH_CACHE_TTL seconds.
+
+_local_cache = OrderedDict()
+_local_lock = threading.Lock()
+
+def token_cache_key(key):
+    # Raw tokens are credentials; keep them out of cache key names
+    return f"scorm:auth:{hashlib.sha256(key.encode()).hexdigest()}"
+
+class TokenUser(SimpleLazyObject):
+    """The user of a cached token; its id is known, the row is only loaded on first other use."""
+
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, user_id):
+        self.__dict__['_user_id'] = user_id
+        super().__init__(lambda: User.objects.get(pk=user_id))
+
+    @property
+    def id(self):
+        return self._user_id
+
+    pk = id
+
+    def __bool__(self):
+        return True
+
+def get_cached_user_id(key):
+    """Return the cached user id for a token key, or None."""
+    cache_key = token_cache_key(key)
+    now = time.monotonic()
+    with _local_lock:
+        entry = _local_cache.get(cache_key)
+        if entry is not None:
+            expires_at, user_id = entry
+            if expires_at > now:
+                _local_cache.move_to_end(cache_key)
+                return user_id
+            del _local_cache[cache_key]
+
+    try:
+        user_id = cache.get(cache_key)
+    except Exception as e:
+        logger.error(f"Error reading the authentication cache: {str(e)}")
+        return None
+    if not isinstance(user_id, int):
+        # Missing, or an entry in an older format
+        return None
+    _remember_locally(cache_key, user_id)
+    return user_id
+
+def cache_user_id(key, user_id):
+    cache_key = token_cache_key(key)
+    try:
+        cache.set(cache_key, user_id, timeout=settings.SCORM_AUTH_CACHE_TTL)
+    except Exception as e:
+        logger.error(f"Error writing the authentication cache: {str(e)}")
+    _remember_locally(cache_key, user_id)
+
+def _remember_locally(cache_key, user_id):
+    with _local_lock:
+        _local_cache[cache_key] = (time.monotonic() + settings.SCORM_AUTH_LOCAL_CACHE_TTL, user_id)
+        _local_cache.move_to_end(cache_key)
+        while len(_local_cache) > settings.SCORM_AUTH_LOCAL_CACHE_SIZE:
+            _local_cache.popitem(last=False)
+
+def invalidate_tokens(keys):
+    """Drop cached authentication for the given token keys."""
+    cache_keys = [token_cache_key(key) for key in keys]
+    if not cache_keys:
+        return
+    with _local_lock:
+        for cache_key in cache_keys:
+            _local_cache.pop(cache_key, None)
+    try:
+        cache.delete_many(cache_keys)
+    except Exception as e:
+        logger.error(f"Error invalidating the authentication cache: {str(e)}")
+
+def invalidate_user_tokens(user_ids):
+    """Drop cached authentication for every token of the given users."""
+    invalidate_tokens(Token.objects.filter(user_id__in=user_ids).values_list('key', flat=True))
@@ -0,0 +1,70 @@
+import logging
+import posixpath
+import re
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Detects the authoring tool that exported a package from the head of its
+# launch/index files and from the archive member names. Only the first
+# SCORM_SNIFF_MAX_BYTES of a file are ever read.
+
+GENERATOR_RE = re.compile(rb'<meta[^>]+name=["\']generator["\'][^>]+content=["\']([^"\']+)["\']', re.IGNORECASE)
+
+# (tool, pattern identifying the tool, pattern capturing its version)
+TOOL_SIGNATURES = [
+    ('Articulate Storyline', re.compile(rb'Storyline', re.IGNORECASE), re.compile(rb'version:\s*([\d.]+)')),
+    ('Adobe Captivate', re.compile(rb'Captivate', re.IGNORECASE), re.compile(rb'Captivate\s*(?:Version\s*)?([\d.]+)', re.IGNORECASE)),
+    ('iSpring', re.compile(rb'iSpring', re.IGNORECASE), re.compile(rb'iSpring[A-Za-z ]*?\s([\d][\d.]*)', re.IGNORECASE)),
+    ('Articulate Rise', re.compile(rb'Rise 360|articulate rise', re.IGNORECASE), re.compile(rb'version:\s*([\d.]+)')),
+]
+
+# Files worth sniffing, relative to the package root, after the launch file
+INDEX_FILES = ['index_lms.html', 'story.html', 'index_scorm.html', 'index.html', 'scormcontent/index.html', 'res/index.html']
+
+def read_head(zip_ref, name):
+    with zip_ref.open(name) as f:
+        return f.read(settings.SCORM_SNIFF_MAX_BYTES)
+
+def detect_from_names(names):
+    """Guess the tool from the archive layout alone."""
+    if any(name.startswith('scormcontent/') for name in names) and any(name.startswith('scormdriver/') for name in names):
+        return 'Articulate Rise'
+    if any(posixpath.basename(name) in ('story.html', 'story_html5.html') for name in names):
+        return 'Articulate Storyline'
+    if any(posixpath.basename(name) == 'CPM.js' for name in names):
+        return 'Adobe Captivate'
+    return None
+
+def detect_from_head(head):
+    """Return (tool, version) found in the head of an HTML file."""
+    generator = GENERATOR_RE.search(head)
+    for tool, tool_re, version_re in TOOL_SIGNATURES:
+        if tool_re.search(head):
+            version = version_re.search(head)
+            return tool, version.group(1).decode('ascii').strip('.') if version else ''
+    if generator:
+        # An unknown exporter that still names itself
+        text = generator.group(1).decode('latin-1').strip()
+        match = re.match(r'(.*?)\s*v?([\d][\d.]*)$', text)
+        return (match.group(1), match.group(2)) if match else (text, '')
+    version = re.search(rb'version:\s*([\d.]+)', head)
+    return None, version.group(1).decode('ascii') if version else ''
+
+def sniff_authoring_tool(zip_ref, names, launch_member):
+    """Return {'tool': ..., 'version': ...} for a package, reading only file heads."""
+    candidates = [launch_member] + INDEX_FILES
+    tool = detect_from_names(names)
+    version = ''
+    seen = set()
+    for name in candidates:
+        if name in seen or name not in names:
+            continue
+        seen.add(name)
+        head_tool, head_version = detect_from_head(read_head(zip_ref, name))
+        logger.info(f"Sniffed {name}: tool={head_tool} version={head_version}")
+        tool = tool or head_tool
+        version = version or head_version
+        if tool and version:
+            break
+    return {'tool': tool or '', 'version': version}
@@ -0,0 +1,68 @@
+import logging
+import time
+from django.conf import settings
+from django_redis import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+# Sorted sets of "user_id:attempt_id" members scored by the time the attempt
+# first became dirty. Keeping the first time (ZADD NX) debounces chatty
+# attempts: they are picked up at most once per SCORM_DIRTY_DEBOUNCE_SECONDS.
+DIRTY_KEY = 'scorm:dirty'
+# Attempts whose status or score changed skip the debounce window
+PRIORITY_DIRTY_KEY = 'scorm:dirty:priority'
+
+PRIORITY_ELEMENTS = {
+    'cmi.core.lesson_status',
+    'cmi.core.score.raw',
+    'cmi.completion_status',
+    'cmi.success_status',
+    'cmi.score.raw',
+}
+
+# Claims due members from both sets atomically, so concurrent consumers never
+# process the same attempt twice for one marker.
+POP_DIRTY_SCRIPT = """
+local claimed = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1], 'LIMIT', 0, ARGV[3])
+local remaining = tonumber(ARGV[3]) - #claimed
+if remaining > 0 then
+    for _, member in ipairs(redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[2], 'LIMIT', 0, remaining)) do
+        table.insert(claimed, member)
+    end
+end
+if #claimed > 0 then
+    redis.call('ZREM', KEYS[1], unpack(claimed))
+    redis.call('ZREM', KEYS[2], unpack(claimed))
+end
+return claimed
+"""
+
+def mark_attempt_dirty(user_id, attempt_id, element_ids=()):
+    """Flag an attempt as having unprocessed log entries.
+
+    Failures are logged and swallowed: the periodic directory scan reconciles
+    any attempt whose marker was lost.
+    """
+    try:
+        pipe = get_redis_connection('default').pipeline(transaction=False)
+        queue_dirty_marker(pipe, user_id, attempt_id, element_ids)
+        pipe.execute()
+    except Exception as e:
+        logger.error(f"Error marking attempt {user_id}:{attempt_id} dirty: {str(e)}")
+
+def queue_dirty_marker(pipe, user_id, attempt_id, element_ids=()):
+    """Add the dirty marker commands for an attempt to a Redis pipeline."""
+    member = f'{user_id}:{attempt_id}'
+    now = time.time()
+    pipe.zadd(DIRTY_KEY, {member: now}, nx=True)
+    if PRIORITY_ELEMENTS.intersection(element_ids):
+        pipe.zadd(PRIORITY_DIRTY_KEY, {member: now}, nx=True)
+
+def pop_dirty_attempts(limit):
+    """Claim up to limit due attempts, priority ones first, as [user_id, attempt_id] pairs."""
+    now = time.time()
+    members = get_redis_connection('default').eval(
+        POP_DIRTY_SCRIPT, 2, DIRTY_KEY, PRIORITY_DIRTY_KEY,
+        now, now - settings.SCORM_DIRTY_DEBOUNCE_SECONDS, limit,
+    )
+    return [member.decode().split(':') for member in members]
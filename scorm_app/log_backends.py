@@ -0,0 +1,523 @@
+import os
+import json
+import shutil
+import logging
+import tempfile
+from contextlib import contextmanager
+from functools import lru_cache
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from django_redis import get_redis_connection
+from redis.exceptions import ResponseError, WatchError
+
+logger = logging.getLogger(__name__)
+
+# Progress logs are stored as line-delimited JSON segments
+# (progress-000001.jsonl, progress-000002.jsonl, ...). The legacy single
+# JSON-array file is still read so logs written before the switch are not lost.
+LEGACY_LOG_FILENAME = 'progress.json'
+LOG_SEGMENT_PREFIX = 'progress-'
+LOG_SEGMENT_SUFFIX = '.jsonl'
+# Checkpoint of the element_id -> latest value map kept next to the segments,
+# {"cursor": ..., "values": {...}}; entries after its cursor are replayed on read
+SNAPSHOT_FILENAME = 'state.json'
+# Appends hold it shared and archiving exclusively
+LOCK_FILENAME = '.lock'
+
+
+@lru_cache(maxsize=None)
+def get_progress_log_backend():
+    """Return the backend configured by SCORM_PROGRESS_LOG_BACKEND."""
+    backend_class = import_string(settings.SCORM_PROGRESS_LOG_BACKEND)
+    return backend_class(**settings.SCORM_PROGRESS_LOG_BACKEND_OPTIONS)
+
+
+class BaseProgressLogBackend:
+    """Storage for the per-attempt progress log and its compacted snapshot.
+
+    Entries are dicts of the form {'timestamp': ..., 'data': {'element_id': ..., 'value': ...}}.
+    Cursors are opaque strings; '' points at the start of the log.
+    """
+
+    def append(self, user_id, attempt_id, entries):
+        """Append entries to the attempt log in order."""
+        raise NotImplementedError
+
+    def read(self, user_id, attempt_id):
+        """Lazily yield every entry of the attempt log in write order."""
+        raise NotImplementedError
+
+    def read_since(self, user_id, attempt_id, cursor):
+        """Lazily yield (entry, cursor) pairs for the entries written after cursor."""
+        raise NotImplementedError
+
+    def acknowledge(self, user_id, attempt_id, cursor):
+        """Called once the entries up to cursor have been persisted."""
+
+    def end_cursor(self, user_id, attempt_id):
+        """Return the cursor of the last entry written, or '' for an empty log."""
+        raise NotImplementedError
+
+    def list_attempts(self):
+        """Yield (user_id, attempt_id) string pairs for every attempt with a log."""
+        raise NotImplementedError
+
+    def archive(self, user_id, attempt_id, cursor):
+        """Move the log of a finalized attempt out of the active set.
+
+        Nothing is archived if entries were written after cursor, the last one
+        applied; returns whether the log was archived.
+        """
+        raise NotImplementedError
+
+    def read_snapshot(self, user_id, attempt_id):
+        """Return the latest value of every element written for an attempt, as strings."""
+        raise NotImplementedError
+
+    def compact_snapshot(self, user_id, attempt_id):
+        """Fold the log into the snapshot so later reads replay less of it.
+
+        Called by the log processor, never on the write path.
+        """
+
+
+def get_segment_path(log_dir, index):
+    """Return the path of the segment with the given index."""
+    return os.path.join(log_dir, f'{LOG_SEGMENT_PREFIX}{index:06d}{LOG_SEGMENT_SUFFIX}')
+
+def get_segment_index(segment_path):
+    """Return the numeric index encoded in a segment file name."""
+    name = os.path.basename(segment_path)
+    return int(name[len(LOG_SEGMENT_PREFIX):-len(LOG_SEGMENT_SUFFIX)])
+
+def is_log_segment(name):
+    return name.startswith(LOG_SEGMENT_PREFIX) and name.endswith(LOG_SEGMENT_SUFFIX)
+
+def list_log_segments(log_dir):
+    """Return the log files of an attempt in write order, legacy JSON array first."""
+    try:
+        names = os.listdir(log_dir)
+    except FileNotFoundError:
+        return []
+    paths = [os.path.join(log_dir, name) for name in sorted(names) if is_log_segment(name)]
+    if LEGACY_LOG_FILENAME in names:
+        paths.insert(0, os.path.join(log_dir, LEGACY_LOG_FILENAME))
+    return paths
+
+def has_log(log_dir):
+    """Return True if the directory contains any progress log."""
+    return bool(list_log_segments(log_dir))
+
+def get_current_segment_path(log_dir):
+    """Return the path of the segment new entries should be appended to.
+
+    A new segment is started once the current one reaches
+    SCORM_LOG_SEGMENT_MAX_BYTES.
+    """
+    segments = [path for path in list_log_segments(log_dir) if path.endswith(LOG_SEGMENT_SUFFIX)]
+    if not segments:
+        return get_segment_path(log_dir, 1)
+    current = segments[-1]
+    try:
+        if os.path.getsize(current) >= settings.SCORM_LOG_SEGMENT_MAX_BYTES:
+            return get_segment_path(log_dir, get_segment_index(current) + 1)
+    except FileNotFoundError:
+        pass
+    return current
+
+def iter_log_file(log_file_path):
+    """Lazily yield the entries of a single segment or legacy JSON log file."""
+    try:
+        with open(log_file_path, 'r', encoding='utf-8') as f:
+            if not log_file_path.endswith(LOG_SEGMENT_SUFFIX):
+                try:
+                    yield from json.load(f)
+                except json.JSONDecodeError:
+                    logger.error(f"Corrupted JSON in {log_file_path}. Skipping file.")
+                return
+            for line in f:
+                if not line.endswith('\n'):
+                    # Entry still being written by another process
+                    break
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    logger.error(f"Corrupted entry in {log_file_path}. Skipping line.")
+    except FileNotFoundError:
+        logger.warning(f"Log file not found: {log_file_path}")
+    except Exception as e:
+        logger.error(f"Error reading log file {log_file_path}: {str(e)}")
+
+def iter_log_dir(log_dir):
+    """Lazily yield every entry of an attempt log, segment by segment."""
+    for log_file_path in list_log_segments(log_dir):
+        yield from iter_log_file(log_file_path)
+
+def parse_log_cursor(cursor):
+    """Split a "segment:offset" cursor; an empty cursor points at the start of the log."""
+    if not cursor:
+        return 0, 0
+    segment, offset = cursor.split(':')
+    return int(segment), int(offset)
+
+def format_log_cursor(segment, offset):
+    return f'{segment}:{offset}'
+
+def _segment_number(log_file_path):
+    # The legacy JSON array is always read before the first segment
+    if log_file_path.endswith(LOG_SEGMENT_SUFFIX):
+        return get_segment_index(log_file_path)
+    return 0
+
+def get_log_end_cursor(log_dir):
+    """Return the cursor pointing at the current end of the log, or '' if there is none."""
+    segments = list_log_segments(log_dir)
+    if not segments:
+        return ''
+    try:
+        return format_log_cursor(_segment_number(segments[-1]), os.path.getsize(segments[-1]))
+    except FileNotFoundError:
+        return ''
+
+def iter_log_since(log_dir, cursor=''):
+    """Yield (entry, cursor) pairs for every complete entry written after cursor.
+
+    The cursor that comes with an entry points just past it, so a caller can
+    persist the last one it applied. Lines still being appended by another
+    process are left for the next read.
+    """
+    start_segment, start_offset = parse_log_cursor(cursor)
+    for log_file_path in list_log_segments(log_dir):
+        segment = _segment_number(log_file_path)
+        if segment < start_segment:
+            continue
+        offset = start_offset if segment == start_segment else 0
+        try:
+            if segment == 0:
+                # Legacy files are no longer appended to and are consumed as a whole
+                if offset:
+                    continue
+                end = format_log_cursor(0, os.path.getsize(log_file_path))
+                for entry in iter_log_file(log_file_path):
+                    yield entry, end
+                continue
+            with open(log_file_path, 'rb') as f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break
+                    offset += len(line)
+                    if not line.strip():
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        logger.error(f"Corrupted entry in {log_file_path}. Skipping line.")
+                        continue
+                    yield entry, format_log_cursor(segment, offset)
+        except FileNotFoundError:
+            logger.warning(f"Log file not found: {log_file_path}")
+
+def _load_snapshot_file(snapshot_path):
+    """Return the (cursor, values) checkpoint of an attempt; ('', {}) replays the whole log."""
+    try:
+        with open(snapshot_path, 'r', encoding='utf-8') as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        return '', {}
+    except (json.JSONDecodeError, ValueError):
+        logger.error(f"Corrupted snapshot {snapshot_path}. Rebuilding from log.")
+        return '', {}
+    if not isinstance(snapshot, dict) or set(snapshot) != {'cursor', 'values'}:
+        # Snapshots written before checkpoints held the values only
+        return '', {}
+    # Checkpoints written before values were normalised may hold raw JSON values
+    return snapshot['cursor'], {element_id: str(value) for element_id, value in snapshot['values'].items()}
+
+def _replay_log_since(log_dir, cursor, state):
+    """Apply the entries written after cursor to state and return the cursor of the last one."""
+    for entry, cursor in iter_log_since(log_dir, cursor):
+        # Values are kept in the string form the runtime API returns, as in the Redis snapshot hash
+        state[entry['data']['element_id']] = str(entry['data']['value'])
+    return cursor
+
+
+class FileSystemProgressLogBackend(BaseProgressLogBackend):
+    """Logs as JSONL segments under SCORM_LOGS_DIR/{user_id}/{attempt_id}/.
+
+    Only usable when the web nodes and the log processor share a filesystem.
+    """
+
+    def __init__(self, logs_dir=None):
+        self._logs_dir = logs_dir
+
+    @property
+    def logs_dir(self):
+        return self._logs_dir or settings.SCORM_LOGS_DIR
+
+    @property
+    def archive_dir(self):
+        return os.path.join(self.logs_dir, 'archive')
+
+    def get_log_dir(self, user_id, attempt_id):
+        """Return the directory holding the log segments for a user and attempt."""
+        return os.path.join(self.logs_dir, str(user_id), str(attempt_id))
+
+    def get_snapshot_path(self, user_id, attempt_id):
+        return os.path.join(self.get_log_dir(user_id, attempt_id), SNAPSHOT_FILENAME)
+
+    @contextmanager
+    def _log_lock(self, log_dir, operation):
+        with open(os.path.join(log_dir, LOCK_FILENAME), 'a') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, operation)
+            yield
+
+    def append(self, user_id, attempt_id, entries):
+        # One O_APPEND write per call: the cost does not grow with the size of
+        # the log and concurrent writers never interleave partial entries
+        log_dir = self.get_log_dir(user_id, attempt_id)
+        os.makedirs(log_dir, exist_ok=True)
+        lines = ''.join(json.dumps(entry, separators=(',', ':')) + '\n' for entry in entries)
+        # Choosing the segment and writing to it happen under one exclusive lock,
+        # so no entry can land in a segment after the next one has been started
+        # and the processor's cursor has moved past it
+        with self._log_lock(log_dir, fcntl.LOCK_EX if fcntl else None):
+            log_file_path = get_current_segment_path(log_dir)
+            fd = os.open(log_file_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, lines.encode('utf-8'))
+            finally:
+                os.close(fd)
+
+    def read(self, user_id, attempt_id):
+        log_dir = self.get_log_dir(user_id, attempt_id)
+        if not has_log(log_dir):
+            logger.warning(f"Log not found: {log_dir}")
+            return iter(())
+        return iter_log_dir(log_dir)
+
+    def read_since(self, user_id, attempt_id, cursor):
+        return iter_log_since(self.get_log_dir(user_id, attempt_id), cursor)
+
+    def end_cursor(self, user_id, attempt_id):
+        return get_log_end_cursor(self.get_log_dir(user_id, attempt_id))
+
+    def list_attempts(self):
+        try:
+            user_dirs = os.listdir(self.logs_dir)
+        except FileNotFoundError:
+            # Nothing has been logged yet
+            return
+        for user_dir in user_dirs:
+            user_path = os.path.join(self.logs_dir, user_dir)
+            if not user_dir.isdigit() or not os.path.isdir(user_path):
+                continue
+            for attempt_dir in os.listdir(user_path):
+                attempt_path = os.path.join(user_path, attempt_dir)
+                if attempt_dir.isdigit() and os.path.isdir(attempt_path) and has_log(attempt_path):
+                    yield user_dir, attempt_dir
+
+    def archive(self, user_id, attempt_id, cursor):
+        log_dir = self.get_log_dir(user_id, attempt_id)
+        if not os.path.isdir(log_dir):
+            return cursor == ''
+        with self._log_lock(log_dir, fcntl.LOCK_EX if fcntl else None):
+            if get_log_end_cursor(log_dir) != cursor:
+                logger.info(f"Not archiving log with unprocessed entries: {log_dir}")
+                return False
+            archive_attempt_dir = os.path.join(self.archive_dir, str(user_id), str(attempt_id))
+            os.makedirs(archive_attempt_dir, exist_ok=True)
+            for log_file in list_log_segments(log_dir):
+                archive_file = os.path.join(archive_attempt_dir, os.path.basename(log_file))
+                if os.path.exists(archive_file):
+                    # Segment numbering restarts after an archive, keep earlier copies
+                    root, ext = os.path.splitext(archive_file)
+                    archive_file = f"{root}.{timezone.now().strftime('%Y%m%d%H%M%S%f')}{ext}"
+                shutil.move(log_file, archive_file)
+                logger.info(f"Archived log file: {log_file} to {archive_file}")
+            # Its cursor points into the archived segments; the values are persisted
+            try:
+                os.remove(self.get_snapshot_path(user_id, attempt_id))
+            except FileNotFoundError:
+                pass
+        return True
+
+    def read_snapshot(self, user_id, attempt_id):
+        # The checkpoint plus a single pass over the entries written after it
+        log_dir = self.get_log_dir(user_id, attempt_id)
+        cursor, state = _load_snapshot_file(self.get_snapshot_path(user_id, attempt_id))
+        _replay_log_since(log_dir, cursor, state)
+        return state
+
+    def compact_snapshot(self, user_id, attempt_id):
+        # Rewritten atomically; concurrent compactions each leave a consistent
+        # checkpoint, so the last one to finish simply wins
+        log_dir = self.get_log_dir(user_id, attempt_id)
+        snapshot_path = self.get_snapshot_path(user_id, attempt_id)
+        cursor, state = _load_snapshot_file(snapshot_path)
+        end = _replay_log_since(log_dir, cursor, state)
+        if end == cursor:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=log_dir, prefix='.state-')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'cursor': end, 'values': state}, f, separators=(',', ':'))
+        os.replace(tmp_path, snapshot_path)
+
+
+def _parse_stream_id(stream_id):
+    milliseconds, sequence = stream_id.split('-')
+    return int(milliseconds), int(sequence)
+
+
+class RedisStreamProgressLogBackend(BaseProgressLogBackend):
+    """Logs as one Redis stream per attempt, shared by every web node.
+
+    Each entry is an XADD. The processor reads new entries through a consumer
+    group and acknowledges them once they are persisted; entries claimed by a
+    run that failed are redelivered to the next one. The snapshot is a hash.
+    Acknowledged entries are trimmed from the stream, and archived streams
+    expire after archive_ttl seconds (None keeps them).
+    A client can be passed in for tests (e.g. a fakeredis instance); otherwise
+    the default django-redis connection is used.
+    """
+
+    def __init__(self, client=None, prefix='scorm:log', group='scorm-log-processor',
+                 consumer='processor', read_count=1000, archive_ttl=60 * 60 * 24 * 30):
+        self._client = client
+        self.prefix = prefix
+        self.group = group
+        self.consumer = consumer
+        self.read_count = read_count
+        self.archive_ttl = archive_ttl
+
+    @property
+    def client(self):
+        return self._client if self._client is not None else get_redis_connection('default')
+
+    def _stream_key(self, user_id, attempt_id):
+        return f'{self.prefix}:{user_id}:{attempt_id}'
+
+    def _snapshot_key(self, user_id, attempt_id):
+        return f'{self.prefix}:state:{user_id}:{attempt_id}'
+
+    @property
+    def _index_key(self):
+        return f'{self.prefix}:attempts'
+
+    def append(self, user_id, attempt_id, entries):
+        stream_key = self._stream_key(user_id, attempt_id)
+        pipe = self.client.pipeline(transaction=False)
+        for entry in entries:
+            pipe.xadd(stream_key, {'entry': json.dumps(entry, separators=(',', ':'))})
+        # The snapshot hash is kept current with the same round trip
+        pipe.hset(self._snapshot_key(user_id, attempt_id), mapping={
+            entry['data']['element_id']: str(entry['data']['value']) for entry in entries
+        })
+        pipe.sadd(self._index_key, f'{user_id}:{attempt_id}')
+        pipe.execute()
+
+    def read(self, user_id, attempt_id):
+        client = self.client
+        stream_key = self._stream_key(user_id, attempt_id)
+        start = '-'
+        while True:
+            batch = client.xrange(stream_key, min=start, max='+', count=self.read_count)
+            if not batch:
+                return
+            for entry_id, fields in batch:
+                yield json.loads(fields[b'entry'])
+            start = '(' + batch[-1][0].decode()
+
+    def _ensure_group(self, stream_key, cursor):
+        try:
+            self.client.xgroup_create(stream_key, self.group, id=cursor or '0', mkstream=True)
+        except ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    def read_since(self, user_id, attempt_id, cursor):
+        client = self.client
+        stream_key = self._stream_key(user_id, attempt_id)
+        self._ensure_group(stream_key, cursor)
+        applied = _parse_stream_id(cursor) if cursor else None
+        # Entries delivered to an earlier run but never acknowledged come first
+        start = '0'
+        while True:
+            response = client.xreadgroup(self.group, self.consumer, {stream_key: start}, count=self.read_count)
+            messages = response[0][1] if response else []
+            if not messages:
+                if start == '>':
+                    return
+                start = '>'
+                continue
+            for entry_id, fields in messages:
+                entry_id = entry_id.decode()
+                if start != '>':
+                    start = entry_id
+                # Trimmed entries come back without fields; the cursor may also be
+                # ahead of the group if an acknowledgement was lost
+                if not fields or (applied and _parse_stream_id(entry_id) <= applied):
+                    continue
+                yield json.loads(fields[b'entry']), entry_id
+
+    def acknowledge(self, user_id, attempt_id, cursor):
+        client = self.client
+        stream_key = self._stream_key(user_id, attempt_id)
+        while True:
+            pending = client.xpending_range(stream_key, self.group, min='-', max=cursor, count=self.read_count)
+            if not pending:
+                break
+            client.xack(stream_key, self.group, *[message['message_id'] for message in pending])
+        # Persisted entries are dropped; the one at cursor stays so end_cursor still matches it.
+        # Exact, since approximate trimming only frees whole nodes small streams never fill
+        client.xtrim(stream_key, minid=cursor, approximate=False)
+
+    def end_cursor(self, user_id, attempt_id):
+        last = self.client.xrevrange(self._stream_key(user_id, attempt_id), count=1)
+        return last[0][0].decode() if last else ''
+
+    def list_attempts(self):
+        for member in self.client.sscan_iter(self._index_key):
+            user_id, attempt_id = member.decode().split(':')
+            yield user_id, attempt_id
+
+    def archive(self, user_id, attempt_id, cursor):
+        stream_key = self._stream_key(user_id, attempt_id)
+        archive_key = f'{self.prefix}:archive:{user_id}:{attempt_id}'
+        with self.client.pipeline() as pipe:
+            try:
+                # An XADD after the check aborts the transaction
+                pipe.watch(stream_key)
+                last = pipe.xrevrange(stream_key, count=1)
+                if (last[0][0].decode() if last else '') != cursor:
+                    logger.info(f"Not archiving log stream with unprocessed entries: {stream_key}")
+                    return False
+                if pipe.exists(archive_key):
+                    # Keep streams archived earlier for the same attempt
+                    archive_key = f"{archive_key}:{timezone.now().strftime('%Y%m%d%H%M%S%f')}"
+                pipe.multi()
+                if last:
+                    pipe.rename(stream_key, archive_key)
+                    if self.archive_ttl:
+                        pipe.expire(archive_key, self.archive_ttl)
+                pipe.delete(self._snapshot_key(user_id, attempt_id))
+                pipe.srem(self._index_key, f'{user_id}:{attempt_id}')
+                pipe.execute()
+            except WatchError:
+                logger.info(f"Not archiving log stream written to during archive: {stream_key}")
+                return False
+        logger.info(f"Archived log stream: {stream_key}")
+        return True
+
+    def read_snapshot(self, user_id, attempt_id):
+        state = self.client.hgetall(self._snapshot_key(user_id, attempt_id))
+        return {key.decode(): value.decode() for key, value in state.items()}
@@ -0,0 +1,66 @@
+import tempfile
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import override_settings
+from scorm_app.models import Course, ScormPackage, SCORMAttempt, SCORMElement
+from scorm_app.tasks import process_log_file
+from scorm_app.utils import append_entries_to_log, read_log
+
+
+class Command(BaseCommand):
+    help = "Measure query count and wall time of process_log_file against the per-entry upsert it replaced."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--entries', type=int, default=10000, help='Number of log entries to generate')
+        parser.add_argument('--elements', type=int, default=50, help='Number of distinct element ids in the log')
+
+    def handle(self, *args, **options):
+        entries = [
+            {'element_id': f'cmi.interactions.{i % options["elements"]}.result', 'value': str(i)}
+            for i in range(options['entries'])
+        ]
+
+        # Everything is created inside a transaction that is rolled back at the end
+        with tempfile.TemporaryDirectory() as logs_dir, override_settings(SCORM_LOGS_DIR=logs_dir):
+            with transaction.atomic():
+                user = User.objects.create_user(username=f'benchmark-{time.time_ns()}')
+                course = Course.objects.create(title='Benchmark')
+                package = ScormPackage.objects.create(course=course, file='scorm_packages/benchmark.zip')
+
+                attempt = SCORMAttempt.objects.create(user=user, scorm_package=package)
+                append_entries_to_log(user.id, attempt.id, entries)
+                queries, seconds = self._measure(lambda: process_log_file(str(user.id), str(attempt.id)))
+                self.stdout.write(f"bulk upsert:      {queries:6d} queries  {seconds:8.3f}s")
+
+                attempt = SCORMAttempt.objects.create(user=user, scorm_package=package)
+                append_entries_to_log(user.id, attempt.id, entries)
+                queries, seconds = self._measure(lambda: self._process_per_entry(attempt))
+                self.stdout.write(f"per-entry upsert: {queries:6d} queries  {seconds:8.3f}s")
+
+                transaction.set_rollback(True)
+
+    def _measure(self, func):
+        # Counted with an execute wrapper: CaptureQueriesContext keeps only the last 9000 queries
+        queries = []
+
+        def count(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count):
+            start = time.perf_counter()
+            func()
+            seconds = time.perf_counter() - start
+        return len(queries), seconds
+
+    def _process_per_entry(self, attempt):
+        # The previous implementation: one update_or_create per log entry
+        for entry in read_log(attempt.user_id, attempt.id):
+            SCORMElement.objects.update_or_create(
+                scorm_attempt=attempt,
+                element_id=entry['data']['element_id'],
+                defaults={'value': entry['data']['value']}
+            )
+        attempt.save()
@@ -0,0 +1,184 @@
+import logging
+import posixpath
+import xml.etree.ElementTree as ET
+
+logger = logging.getLogger(__name__)
+
+# Parses imsmanifest.xml in a single iterparse pass into a compact structure
+# that is stored on ScormPackage.manifest_data:
+#
+#   {
+#       "schema_version": "2004 4th Edition",
+#       "scorm_version": "2004",
+#       "default_organization": "ORG-1",
+#       "organizations": [
+#           {"identifier": "ORG-1", "title": "...", "items": [
+#               {"identifier": "ITEM-1", "title": "...", "identifierref": "RES-1", "children": [...]},
+#           ]},
+#       ],
+#       "resources": {"RES-1": {"href": "sco1/index.html", "scorm_type": "sco"}},
+#   }
+#
+# Elements are matched by local name, so SCORM 1.2 (imscp_rootv1p1p2 /
+# adlcp_rootv1p2) and SCORM 2004 (imscp_v1p1 / adlcp_v1p3) manifests are
+# handled by the same code.
+
+XML_BASE = '{http://www.w3.org/XML/1998/namespace}base'
+SCORM_12_NAMESPACE = 'http://www.adlnet.org/xsd/adlcp_rootv1p2'
+SCORM_2004_NAMESPACE = 'http://www.adlnet.org/xsd/adlcp_v1p3'
+
+def local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+def namespace(tag):
+    return tag[1:].split('}', 1)[0] if tag.startswith('{') else ''
+
+def get_attribute(element, name):
+    """Return an attribute by local name, case-insensitively (scormtype vs scormType)."""
+    name = name.lower()
+    for key, value in element.attrib.items():
+        if local_name(key).lower() == name:
+            return value
+    return None
+
+def compact(data):
+    return {key: value for key, value in data.items() if value not in (None, '', [], {})}
+
+def normalize_scorm_version(schema_version, namespaces):
+    """Map the schemaversion text (or, failing that, the namespaces) to '1.2' or '2004'."""
+    if schema_version == '1.2':
+        return '1.2'
+    if schema_version and ('2004' in schema_version or 'CAM 1.3' in schema_version):
+        return '2004'
+    if SCORM_2004_NAMESPACE in namespaces:
+        return '2004'
+    if SCORM_12_NAMESPACE in namespaces:
+        return '1.2'
+    return schema_version
+
+def parse_manifest(manifest_file):
+    """Parse a manifest file object into the compact manifest structure."""
+    organizations = []
+    resources = {}
+    namespaces = set()
+    schema_version = None
+    default_organization = None
+    manifest_base = ''
+    resources_base = ''
+    # Stack of the open organization/item dicts; titles are attached on 'end'
+    stack = []
+    resource = None
+    depth = 0
+
+    for event, element in ET.iterparse(manifest_file, events=('start', 'end')):
+        name = local_name(element.tag)
+        if event == 'start':
+            depth += 1
+            namespaces.add(namespace(element.tag))
+            if name == 'manifest' and depth == 1:
+                manifest_base = element.get(XML_BASE, '')
+            elif name == 'resources':
+                resources_base = element.get(XML_BASE, '')
+            elif name == 'organizations':
+                default_organization = element.get('default')
+            elif name == 'organization':
+                organization = {'identifier': element.get('identifier'), 'items': []}
+                organizations.append(organization)
+                stack = [organization]
+            elif name == 'item' and stack:
+                item = {
+                    'identifier': element.get('identifier'),
+                    'identifierref': element.get('identifierref'),
+                    'parameters': element.get('parameters'),
+                    'is_visible': element.get('isvisible', 'true') != 'false',
+                    'children': [],
+                }
+                parent = stack[-1]
+                parent['children' if 'children' in parent else 'items'].append(item)
+                stack.append(item)
+            elif name == 'resource':
+                resource = {
+                    'href': element.get('href'),
+                    'base': element.get(XML_BASE),
+                    'scorm_type': (get_attribute(element, 'scormtype') or '').lower() or None,
+                    'dependencies': [],
+                }
+                resources[element.get('identifier')] = resource
+            elif name == 'dependency' and resource is not None:
+                resource['dependencies'].append(element.get('identifierref'))
+            continue
+
+        depth -= 1
+        if name == 'schemaversion':
+            schema_version = (element.text or '').strip() or None
+        elif name == 'title' and stack and 'title' not in stack[-1]:
+            stack[-1]['title'] = (element.text or '').strip()
+        elif name == 'item' and stack:
+            stack.pop()
+        elif name == 'organization':
+            stack = []
+        elif name == 'resource':
+            resource = None
+            element.clear()
+        elif name in ('metadata', 'sequencing'):
+            element.clear()
+
+    return compact({
+        'schema_version': schema_version,
+        'scorm_version': normalize_scorm_version(schema_version, namespaces),
+        'base': manifest_base,
+        'resources_base': resources_base,
+        'default_organization': default_organization,
+        'organizations': [compact_organization(organization) for organization in organizations],
+        'resources': {identifier: compact(resource) for identifier, resource in resources.items()},
+    })
+
+def compact_organization(node):
+    children_key = 'children' if 'children' in node else 'items'
+    node[children_key] = [compact_organization(child) for child in node[children_key]]
+    if children_key == 'children' and node.get('is_visible'):
+        # Visible is the default; only hidden items keep the flag
+        node.pop('is_visible')
+    return compact(node)
+
+def get_default_organization(manifest):
+    organizations = manifest.get('organizations', [])
+    for organization in organizations:
+        if organization.get('identifier') == manifest.get('default_organization'):
+            return organization
+    return organizations[0] if organizations else None
+
+def iter_items(items):
+    """Yield items depth-first in document order."""
+    for item in items:
+        yield item
+        yield from iter_items(item.get('children', []))
+
+def get_item_href(manifest, item):
+    """Return the archive-relative launch href of an item, or None if it is not launchable."""
+    resource = manifest.get('resources', {}).get(item.get('identifierref'))
+    if not resource or not resource.get('href'):
+        return None
+    href = posixpath.join(
+        manifest.get('base', ''), manifest.get('resources_base', ''), resource.get('base', ''), resource['href'],
+    )
+    parameters = item.get('parameters')
+    if parameters:
+        if parameters[0] not in '?#':
+            parameters = ('&' if '?' in href else '?') + parameters
+        elif parameters[0] == '?' and '?' in href:
+            parameters = '&' + parameters[1:]
+        href += parameters
+    return href
+
+def get_launch_href(manifest):
+    """Return the href of the first launchable item of the default organization."""
+    organization = get_default_organization(manifest)
+    if organization is None:
+        logger.warning("Organization element not found in manifest")
+        raise ValueError("No organization found in manifest")
+    for item in iter_items(organization.get('items', [])):
+        href = get_item_href(manifest, item)
+        if href:
+            return href
+    raise ValueError("No launchable item found in organization")
@@ -1,4 +1,5 @@
 import os
+import uuid
 import logging
 from django.db import models
 from django.contrib.auth.models import User
@@ -27,18 +28,41 @@ class SCORMStandard(models.Model):
     def __str__(self):
         return f"{self.name} - {self.version}"
 
+class PackageContent(models.Model):
+    """A package archive stored once per SHA-256 digest and shared by every ScormPackage uploaded with it."""
+    digest = models.CharField(max_length=64, unique=True)
+    file = models.FileField(upload_to='scorm_packages/')
+    size = models.BigIntegerField(default=0)
+    # Number of ScormPackage rows using this archive; it is deleted when this drops to zero
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.digest
+
+    def get_extract_path(self):
+        return f'media/scorm_extracted/{self.digest}/'
+
 class ScormPackage(models.Model):
     course = models.ForeignKey(Course, on_delete=models.SET_NULL, null=True)
     scorm_standard = models.ForeignKey(SCORMStandard, on_delete=models.SET_NULL, null=True)
     file = models.FileField(upload_to='scorm_packages/')
+    content = models.ForeignKey(PackageContent, on_delete=models.SET_NULL, null=True, blank=True, related_name='packages')
     version = models.CharField(max_length=50)
+    # Exporting tool detected at ingest, e.g. "Articulate Storyline" / "3.72.30590.0"
+    authoring_tool = models.CharField(max_length=100, blank=True)
+    authoring_tool_version = models.CharField(max_length=50, blank=True)
     manifest_path = models.CharField(max_length=255)
     launch_path = models.CharField(max_length=255, blank=True)
+    # Organization tree and resource index parsed from imsmanifest.xml (see manifest.py)
+    manifest_data = models.JSONField(default=dict, blank=True)
     status = models.CharField(max_length=20, choices=[
         ('processing', 'Processing'),
         ('ready', 'Ready'),
         ('error', 'Error')
     ], default='processing')
+    # False when assets are served from the archive by the package_content view
+    is_extracted = models.BooleanField(default=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
     created_at = models.DateTimeField(auto_now_add=True)
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, blank=True, null=True)
@@ -50,13 +74,22 @@ class ScormPackage(models.Model):
     def get_absolute_url(self):
         return reverse('launch_scorm', args=[str(self.id)])
 
-    def get_launch_url(self):
+    def get_extract_path(self):
+        # Packages uploaded before content-addressed storage keep their per-id directory
+        if self.content_id:
+            return self.content.get_extract_path()
+        return f'media/scorm_extracted/{self.id}/'
+
+    def get_launch_url(self, grant=None):
+        """URL of the launch file, through the asset view of a launch grant when one is given."""
         if self.launch_path:
-            # Remove 'media/' from the beginning if it exists
-            clean_path = self.launch_path.lstrip('media/')
-            
-            # Construct the correct URL using the MEDIA_URL setting
-            return f"{settings.MEDIA_URL}{clean_path}"
+            # Assets are served by the package views, from the extraction or the archive
+            member = os.path.relpath(self.launch_path, self.get_extract_path()).replace(os.sep, '/')
+            # Launch hrefs may carry item parameters from the manifest
+            member, separator, query = member.partition('?')
+            if grant:
+                return reverse('package_asset', args=[grant, member]) + separator + query
+            return reverse('package_content', args=[self.id, member]) + separator + query
         return None
 
     def get_full_launch_url(self):
@@ -65,6 +98,30 @@ class ScormPackage(models.Model):
             return f"{settings.BASE_URL.rstrip('/')}{launch_url}"
         return None
 
+class PackageUpload(models.Model):
+    """A resumable, chunked package upload that is assembled in a temporary file."""
+    upload_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    course = models.ForeignKey(Course, on_delete=models.CASCADE)
+    created_by = models.ForeignKey(User, on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    # Bytes received so far and their running CRC-32
+    offset = models.BigIntegerField(default=0)
+    crc32 = models.BigIntegerField(default=0)
+    # Flipped to 'finalizing' by the single finalize request allowed to assemble the package
+    status = models.CharField(max_length=20, choices=[
+        ('uploading', 'Uploading'),
+        ('finalizing', 'Finalizing'),
+    ], default='uploading')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.filename} ({self.offset}/{self.size})"
+
+    def get_temp_path(self):
+        return os.path.join(settings.SCORM_UPLOAD_TEMP_DIR, f'{self.upload_id}.part')
+
 class UserCourseRegistration(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     course = models.ForeignKey(Course, on_delete=models.CASCADE)
@@ -83,6 +140,8 @@ class SCORMAttempt(models.Model):
     score = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
     is_complete = models.BooleanField(default=False)
     last_processed = models.DateTimeField(null=True, blank=True)
+    # Position in the progress log up to which entries have been applied ("segment:offset")
+    log_cursor = models.CharField(max_length=64, blank=True, default='')
 
     def save(self, *args, **kwargs):
         if self.score is not None:
@@ -0,0 +1,270 @@
+import gzip
+import logging
+import mmap
+import os
+import re
+import shutil
+import struct
+import threading
+import zipfile
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Serves package members straight from the uploaded archive. The central
+# directory is parsed once per archive and kept in a small per-process LRU
+# together with a read-only memory map, so a request only pays for the bytes
+# it actually sends.
+
+STREAM_CHUNK_SIZE = 64 * 1024
+LOCAL_HEADER_SIZE = 30
+LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+class ZipMember:
+    __slots__ = ('name', 'header_offset', 'compress_type', 'compress_size', 'file_size', 'crc', 'date_time', 'data_offset')
+
+    def __init__(self, info):
+        self.name = info.filename
+        self.header_offset = info.header_offset
+        self.compress_type = info.compress_type
+        self.compress_size = info.compress_size
+        self.file_size = info.file_size
+        self.crc = info.CRC
+        self.date_time = info.date_time
+        self.data_offset = None
+
+class ZipArchiveIndex:
+    """Central-directory index and memory map of one package archive."""
+
+    def __init__(self, path):
+        self.path = path
+        with zipfile.ZipFile(path, 'r') as zip_ref:
+            self.members = {
+                info.filename: ZipMember(info)
+                for info in zip_ref.infolist()
+                # Encrypted members cannot be streamed
+                if not info.is_dir() and not info.flag_bits & 0x1
+            }
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def get(self, name):
+        return self.members.get(name)
+
+    def _data_offset(self, member):
+        if member.data_offset is None:
+            header = self._mmap[member.header_offset:member.header_offset + LOCAL_HEADER_SIZE]
+            if header[:4] != LOCAL_HEADER_SIGNATURE:
+                raise zipfile.BadZipFile(f"Bad local header for {member.name}")
+            name_length, extra_length = struct.unpack('<HH', header[26:30])
+            member.data_offset = member.header_offset + LOCAL_HEADER_SIZE + name_length + extra_length
+        return member.data_offset
+
+    def iter_member(self, member, start=0, end=None):
+        """Yield the bytes start..end (inclusive) of a member's uncompressed content."""
+        if end is None:
+            end = member.file_size - 1
+        if end < start:
+            return
+        if member.compress_type == zipfile.ZIP_STORED:
+            yield from self._iter_stored(member, start, end)
+        elif member.compress_type == zipfile.ZIP_DEFLATED:
+            yield from self._iter_deflated(member, start, end)
+        else:
+            yield from self._iter_fallback(member, start, end)
+
+    def _iter_stored(self, member, start, end):
+        offset = self._data_offset(member) + start
+        stop = offset + end - start + 1
+        while offset < stop:
+            chunk_end = min(offset + STREAM_CHUNK_SIZE, stop)
+            yield self._mmap[offset:chunk_end]
+            offset = chunk_end
+
+    def _iter_deflated(self, member, start, end):
+        # Deflate streams cannot be seeked, so a range request decompresses
+        # and discards everything before start.
+        offset = self._data_offset(member)
+        stop = offset + member.compress_size
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        position = 0
+        while offset < stop and position <= end:
+            chunk_end = min(offset + STREAM_CHUNK_SIZE, stop)
+            data = decompressor.decompress(self._mmap[offset:chunk_end])
+            offset = chunk_end
+            if offset >= stop:
+                data += decompressor.flush()
+            if not data:
+                continue
+            chunk_start = position
+            position += len(data)
+            if position <= start:
+                continue
+            yield data[max(start - chunk_start, 0):end - chunk_start + 1]
+
+    def _iter_fallback(self, member, start, end):
+        # bzip2/lzma members are rare in SCORM packages; let zipfile decode them
+        with zipfile.ZipFile(self.path, 'r') as zip_ref, zip_ref.open(member.name) as f:
+            position = 0
+            while position <= end:
+                data = f.read(STREAM_CHUNK_SIZE)
+                if not data:
+                    break
+                chunk_start = position
+                position += len(data)
+                if position <= start:
+                    continue
+                yield data[max(start - chunk_start, 0):end - chunk_start + 1]
+
+    def close(self):
+        self._mmap.close()
+
+_index_cache = OrderedDict()
+_index_cache_lock = threading.Lock()
+
+def get_archive_index(path):
+    """Return the cached index for an archive, rebuilding it if the file changed."""
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    with _index_cache_lock:
+        index = _index_cache.get(key)
+        if index is not None:
+            _index_cache.move_to_end(key)
+            return index
+    index = ZipArchiveIndex(path)
+    with _index_cache_lock:
+        _index_cache[key] = index
+        while len(_index_cache) > settings.SCORM_ARCHIVE_INDEX_CACHE_SIZE:
+            # Open responses keep their own reference to the index, so the map
+            # is left to be closed by garbage collection.
+            _index_cache.popitem(last=False)
+    return index
+
+def iter_file_range(path, start, end):
+    """Yield the bytes start..end (inclusive) of a file."""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            data = f.read(min(STREAM_CHUNK_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+def parse_range_header(header, size):
+    """Parse a single "bytes=" range into inclusive (start, end) offsets.
+
+    Returns None when the header should be ignored and raises ValueError when
+    the range cannot be satisfied.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        # Suffix range: the last N bytes
+        start = max(size - int(last), 0)
+        end = size - 1
+    if start >= size or end < start:
+        raise ValueError(f"Unsatisfiable range {header}")
+    return start, end
+
+# Precompressed siblings (index.js.br, index.js.gz) are written next to the
+# extracted assets at ingest time and picked by the package_content view
+# according to Accept-Encoding.
+COMPRESSIBLE_EXTENSIONS = {
+    '.html', '.htm', '.js', '.mjs', '.css', '.json', '.xml', '.xsd', '.svg',
+    '.txt', '.vtt', '.srt', '.map', '.csv', '.ttf', '.otf', '.eot', '.wasm',
+}
+PRECOMPRESSED_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+MIN_COMPRESS_SIZE = 1024
+
+def get_supported_encodings():
+    """Encodings with a precompressed variant, in order of preference."""
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+def is_compressible(path):
+    return os.path.splitext(path)[1].lower() in COMPRESSIBLE_EXTENSIONS
+
+def compress_file(path):
+    """Write gzip (and brotli) siblings of path, keeping only those smaller than the original."""
+    size = os.path.getsize(path)
+    written = 0
+    gzip_path = path + PRECOMPRESSED_SUFFIXES['gzip']
+    if not os.path.exists(gzip_path):
+        tmp_path = f'{gzip_path}.tmp'
+        with open(path, 'rb') as src, open(tmp_path, 'wb') as raw:
+            # mtime=0 keeps the output, and so its ETag, stable across runs
+            with gzip.GzipFile(filename='', mode='wb', fileobj=raw, compresslevel=9, mtime=0) as dst:
+                shutil.copyfileobj(src, dst, STREAM_CHUNK_SIZE)
+        written += keep_if_smaller(tmp_path, gzip_path, size)
+    brotli_path = path + PRECOMPRESSED_SUFFIXES['br']
+    if brotli is not None and not os.path.exists(brotli_path):
+        tmp_path = f'{brotli_path}.tmp'
+        compressor = brotli.Compressor(quality=11)
+        with open(path, 'rb') as src, open(tmp_path, 'wb') as dst:
+            for chunk in iter(lambda: src.read(STREAM_CHUNK_SIZE), b''):
+                dst.write(compressor.process(chunk))
+            dst.write(compressor.finish())
+        written += keep_if_smaller(tmp_path, brotli_path, size)
+    return written
+
+def keep_if_smaller(tmp_path, path, original_size):
+    if os.path.getsize(tmp_path) < original_size:
+        os.replace(tmp_path, path)
+        return 1
+    os.remove(tmp_path)
+    return 0
+
+def precompress_package(extract_path):
+    """Compress every compressible asset under extract_path in a thread pool.
+
+    zlib and brotli release the GIL, so the pool scales with cores.
+    """
+    paths = []
+    for root, dirs, files in os.walk(extract_path):
+        for name in files:
+            path = os.path.join(root, name)
+            if is_compressible(name) and os.path.getsize(path) >= MIN_COMPRESS_SIZE:
+                paths.append(path)
+    if not paths:
+        return 0
+    with ThreadPoolExecutor(max_workers=settings.SCORM_PRECOMPRESS_WORKERS) as executor:
+        written = sum(executor.map(compress_file, paths))
+    logger.info(f"Wrote {written} precompressed variants for {len(paths)} assets under {extract_path}")
+    return written
+
+def parse_accept_encoding(header):
+    """Return the content codings accepted by a client (q > 0)."""
+    accepted = set()
+    rejected = set()
+    for part in (header or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        (accepted if q > 0 else rejected).add(coding)
+    if '*' in accepted:
+        accepted.update(coding for coding in PRECOMPRESSED_SUFFIXES if coding not in rejected)
+    return accepted
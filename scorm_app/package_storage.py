@@ -0,0 +1,204 @@
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from django.conf import settings
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.db import transaction
+from django.db.models import F
+from .models import PackageContent, ScormPackage
+
+logger = logging.getLogger(__name__)
+
+# Package archives are stored once per SHA-256 digest (PackageContent) and
+# their extraction under media/scorm_extracted/{digest}/ is shared by every
+# ScormPackage uploaded with the same bytes.
+
+# Fields filled in by process_scorm_package that a re-upload can copy as is
+PROCESSED_FIELDS = (
+    'scorm_standard', 'version', 'authoring_tool', 'authoring_tool_version',
+    'manifest_path', 'manifest_data', 'launch_path', 'is_extracted',
+)
+
+class HashingUploadHandler(TemporaryFileUploadHandler):
+    """Spool uploads to a temporary file and hash them as the chunks arrive.
+
+    The digest is exposed as the sha256 attribute of the uploaded file.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.hasher = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.hasher.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        file.sha256 = self.hasher.hexdigest()
+        return file
+
+def hash_file(file):
+    """Return the SHA-256 digest of an uploaded file, reusing the one computed during upload."""
+    digest = getattr(file, 'sha256', None)
+    if digest:
+        return digest
+    hasher = hashlib.sha256()
+    for chunk in file.chunks():
+        hasher.update(chunk)
+    file.seek(0)
+    return hasher.hexdigest()
+
+def acquire_package_content(file, digest):
+    """Return the PackageContent for digest, storing file if it is new, and take a reference."""
+    with transaction.atomic():
+        content, created = PackageContent.objects.select_for_update().get_or_create(
+            digest=digest, defaults={'size': file.size},
+        )
+        if created or not content.file:
+            content.file.save(f'{digest}.zip', file, save=False)
+            content.save(update_fields=['file'])
+            logger.info(f"Stored new package content {digest}")
+        else:
+            logger.info(f"Reusing stored package content {digest}")
+        PackageContent.objects.filter(pk=content.pk).update(ref_count=F('ref_count') + 1)
+    return content
+
+def release_package_content(content):
+    """Drop a reference to a PackageContent, deleting its archive and extraction with the last one."""
+    with transaction.atomic():
+        content = PackageContent.objects.select_for_update().get(pk=content.pk)
+        content.ref_count = max(content.ref_count - 1, 0)
+        if content.ref_count:
+            content.save(update_fields=['ref_count'])
+            return False
+        file_path = content.file.path if content.file else None
+        extract_path = content.get_extract_path()
+        content.delete()
+    if file_path and os.path.isfile(file_path):
+        os.remove(file_path)
+    shutil.rmtree(extract_path, ignore_errors=True)
+    logger.info(f"Deleted package content {content.digest}")
+    return True
+
+def find_processed_package(content, exclude_id=None):
+    """Return a ready package sharing content whose processing results can be reused."""
+    return (ScormPackage.objects.filter(content=content, status='ready')
+            .exclude(id=exclude_id).order_by('id').first())
+
+def copy_processed_package(source, package):
+    for field in PROCESSED_FIELDS:
+        setattr(package, field, getattr(source, field))
+    package.status = 'ready'
+    package.save()
+
+class PackageLimitError(ValueError):
+    """Raised when an archive exceeds the extraction limits (zip bomb guard)."""
+
+def check_archive_limits(zip_ref):
+    """Check member count, total size and compression ratios from the central directory.
+
+    zipfile stops reading a member at its declared size, so the declared sizes
+    checked here bound what extraction can actually write.
+    """
+    infos = zip_ref.infolist()
+    if len(infos) > settings.SCORM_EXTRACT_MAX_MEMBERS:
+        raise PackageLimitError(f"Package has {len(infos)} members, more than {settings.SCORM_EXTRACT_MAX_MEMBERS}")
+    total_size = sum(info.file_size for info in infos)
+    if total_size > settings.SCORM_EXTRACT_MAX_TOTAL_SIZE:
+        raise PackageLimitError(f"Package expands to {total_size} bytes, more than {settings.SCORM_EXTRACT_MAX_TOTAL_SIZE}")
+    max_ratio = settings.SCORM_EXTRACT_MAX_COMPRESSION_RATIO
+    for info in infos:
+        # Tiny members (empty files, padding) legitimately have huge ratios
+        if info.file_size > 1024 * 1024 and info.file_size > max_ratio * max(info.compress_size, 1):
+            raise PackageLimitError(f"Member {info.filename} has a compression ratio above {max_ratio}")
+    compressed_size = sum(info.compress_size for info in infos)
+    if total_size > 1024 * 1024 and total_size > max_ratio * max(compressed_size, 1):
+        raise PackageLimitError(f"Package has a compression ratio above {max_ratio}")
+    return total_size
+
+def get_member_target(root, name):
+    """Return where a member is written under root, dropping absolute and parent path parts."""
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.', '..')]
+    if not parts:
+        return None
+    target = os.path.join(root, *parts)
+    if not os.path.realpath(target).startswith(os.path.realpath(root) + os.sep):
+        return None
+    return target
+
+def extract_members(zip_ref, root, progress=None):
+    """Extract every member under root with a thread pool, reporting (files, total_files, bytes)."""
+    files = []
+    for info in zip_ref.infolist():
+        target = get_member_target(root, info.filename)
+        if target is None:
+            logger.warning(f"Skipping unsafe member {info.filename}")
+        elif info.is_dir():
+            os.makedirs(target, exist_ok=True)
+        else:
+            files.append((info, target))
+    for directory in {os.path.dirname(target) for _, target in files}:
+        os.makedirs(directory, exist_ok=True)
+
+    # Each worker reads through its own ZipFile handle; decompression and
+    # writing release the GIL, so members are extracted in parallel.
+    local = threading.local()
+    handles = []
+    handles_lock = threading.Lock()
+
+    def extract_member(info, target):
+        handle = getattr(local, 'zip_ref', None)
+        if handle is None:
+            handle = local.zip_ref = zipfile.ZipFile(zip_ref.filename, 'r')
+            with handles_lock:
+                handles.append(handle)
+        with handle.open(info) as src, open(target, 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        return info.file_size
+
+    done = written = 0
+    last_report = time.monotonic()
+    try:
+        with ThreadPoolExecutor(max_workers=settings.SCORM_EXTRACT_WORKERS) as executor:
+            futures = [executor.submit(extract_member, info, target) for info, target in files]
+            for future in as_completed(futures):
+                written += future.result()
+                done += 1
+                if progress and (done == len(files) or time.monotonic() - last_report >= 1):
+                    progress(done, len(files), written)
+                    last_report = time.monotonic()
+    finally:
+        for handle in handles:
+            handle.close()
+    return done
+
+def extract_package(zip_ref, extract_path, progress=None):
+    """Extract an archive into extract_path unless another package already did.
+
+    Extraction goes to a temporary sibling directory that is renamed into
+    place, so a crashed or concurrent run never leaves a partial shared tree.
+    Callers check the archive with check_archive_limits first.
+    """
+    extract_path = extract_path.rstrip('/')
+    if os.path.isdir(extract_path):
+        logger.info(f"Reusing extracted package at {extract_path}")
+        return
+    tmp_path = f'{extract_path}.tmp-{uuid.uuid4().hex}'
+    try:
+        os.makedirs(tmp_path)
+        extract_members(zip_ref, tmp_path, progress)
+        os.rename(tmp_path, extract_path)
+    except OSError:
+        if not os.path.isdir(extract_path):
+            raise
+        # Another worker extracted the same content first
+        logger.info(f"Package at {extract_path} was extracted concurrently")
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
@@ -0,0 +1,148 @@
+import logging
+from django.conf import settings
+from django_redis import get_redis_connection
+from .models import SCORMElement
+from .utils import read_snapshot
+
+logger = logging.getLogger(__name__)
+
+# The runtime API caches an attempt's CMI values in one Redis hash,
+# scorm:runtime:{user_id}:{attempt_id}, with one field per element. Every
+# access refreshes an idle TTL, so abandoned attempts expire as a whole, and
+# completed attempts are evicted once their log has been processed.
+#
+# A hash may hold only the elements read or written so far. One loaded with
+# the attempt's full state (load_runtime_state) carries the LOADED_FIELD marker,
+# and an element missing from it is known to be empty.
+#
+# In write-behind mode (write_behind.py) writes are also queued in a pending
+# hash, scorm:pending:{user_id}:{attempt_id}, until they reach SCORMElement.
+
+LOADED_FIELD = '__loaded__'
+
+def runtime_key(user_id, attempt_id):
+    return f'scorm:runtime:{user_id}:{attempt_id}'
+
+def pending_key(user_id, attempt_id):
+    return f'scorm:pending:{user_id}:{attempt_id}'
+
+def flushing_key(user_id, attempt_id):
+    return f'{pending_key(user_id, attempt_id)}:flushing'
+
+def get_attempt_state(attempt):
+    """Return the latest value of every element of an attempt.
+
+    Values already processed into SCORMElement are overlaid with the
+    snapshot of writes that have not been processed yet.
+    """
+    state = dict(SCORMElement.objects.filter(scorm_attempt=attempt).values_list('element_id', 'value'))
+    state.update(read_snapshot(attempt.user_id, attempt.id))
+    state.update(read_pending_values(attempt.user_id, attempt.id))
+    return state
+
+def read_pending_values(user_id, attempt_id):
+    """Return the write-behind values of an attempt that have not reached SCORMElement yet."""
+    try:
+        pipe = get_redis_connection('default').pipeline(transaction=False)
+        pipe.hgetall(flushing_key(user_id, attempt_id))
+        pipe.hgetall(pending_key(user_id, attempt_id))
+        flushing, pending = pipe.execute()
+    except Exception as e:
+        # Without write-behind there is normally nothing queued; with it, reads must not miss values
+        if settings.SCORM_RUNTIME_WRITE_MODE == 'write-behind':
+            raise
+        logger.error(f"Error reading write-behind values for attempt {attempt_id}: {str(e)}")
+        return {}
+    # Values claimed by a flush in progress are older than those queued since
+    values = {_decode(field): _decode(value) for field, value in flushing.items()}
+    values.update({_decode(field): _decode(value) for field, value in pending.items()})
+    return values
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+def get_runtime_values(user_id, attempt_id, element_ids):
+    """Return (cached values, loaded) for element_ids; elements not in the hash are left out."""
+    element_ids = list(element_ids)
+    key = runtime_key(user_id, attempt_id)
+    try:
+        pipe = get_redis_connection('default').pipeline(transaction=False)
+        pipe.hmget(key, element_ids + [LOADED_FIELD])
+        pipe.expire(key, settings.SCORM_RUNTIME_CACHE_TTL)
+        *values, loaded = pipe.execute()[0]
+    except Exception as e:
+        logger.error(f"Error reading runtime cache for attempt {attempt_id}: {str(e)}")
+        return {}, False
+    return ({element_id: _decode(value) for element_id, value in zip(element_ids, values) if value is not None},
+            loaded is not None)
+
+def get_runtime_state(user_id, attempt_id):
+    """Return every cached value of an attempt (HGETALL), or None unless it was fully loaded."""
+    key = runtime_key(user_id, attempt_id)
+    try:
+        pipe = get_redis_connection('default').pipeline(transaction=False)
+        pipe.hgetall(key)
+        pipe.expire(key, settings.SCORM_RUNTIME_CACHE_TTL)
+        values = pipe.execute()[0]
+    except Exception as e:
+        logger.error(f"Error reading runtime cache for attempt {attempt_id}: {str(e)}")
+        return None
+    values = {_decode(field): _decode(value) for field, value in values.items()}
+    if values.pop(LOADED_FIELD, None) is None:
+        return None
+    return values
+
+def set_runtime_values(user_id, attempt_id, values):
+    """Write values into the attempt's hash with one pipelined HSET."""
+    if not values:
+        return
+    try:
+        pipe = get_redis_connection('default').pipeline(transaction=False)
+        queue_runtime_values(pipe, user_id, attempt_id, values)
+        pipe.execute()
+    except Exception as e:
+        logger.error(f"Error writing runtime cache for attempt {attempt_id}: {str(e)}")
+
+def queue_runtime_values(pipe, user_id, attempt_id, values):
+    """Add the commands writing values into the attempt's hash to a Redis pipeline."""
+    key = runtime_key(user_id, attempt_id)
+    pipe.hset(key, mapping={element_id: str(value) for element_id, value in values.items()})
+    pipe.expire(key, settings.SCORM_RUNTIME_CACHE_TTL)
+
+def load_runtime_state(user_id, attempt_id, values):
+    """Cache the full state of an attempt and mark its hash as loaded.
+
+    Values already in the hash are newer than the state read by the caller and
+    are kept (HSETNX), so a write racing the load is never overwritten.
+    """
+    key = runtime_key(user_id, attempt_id)
+    try:
+        pipe = get_redis_connection('default').pipeline(transaction=False)
+        for element_id, value in values.items():
+            pipe.hsetnx(key, element_id, str(value))
+        pipe.hset(key, LOADED_FIELD, '1')
+        pipe.expire(key, settings.SCORM_RUNTIME_CACHE_TTL)
+        pipe.execute()
+    except Exception as e:
+        logger.error(f"Error loading runtime cache for attempt {attempt_id}: {str(e)}")
+
+def is_runtime_state_loaded(user_id, attempt_id):
+    try:
+        return bool(get_redis_connection('default').hexists(runtime_key(user_id, attempt_id), LOADED_FIELD))
+    except Exception as e:
+        logger.error(f"Error reading runtime cache for attempt {attempt_id}: {str(e)}")
+        return False
+
+def warm_runtime_state(attempt):
+    """Load an attempt's state from SCORMElement and its unprocessed log into the cache, once."""
+    if is_runtime_state_loaded(attempt.user_id, attempt.id):
+        return False
+    load_runtime_state(attempt.user_id, attempt.id, get_attempt_state(attempt))
+    logger.info(f"Warmed runtime cache for attempt {attempt.id}")
+    return True
+
+def evict_runtime_state(user_id, attempt_id):
+    try:
+        get_redis_connection('default').delete(runtime_key(user_id, attempt_id))
+    except Exception as e:
+        logger.error(f"Error evicting runtime cache for attempt {attempt_id}: {str(e)}")
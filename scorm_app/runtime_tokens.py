@@ -0,0 +1,55 @@
+import logging
+import time
+import jwt
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# launch_scorm mints a short-lived HS256 token scoped to one attempt for the
+# player. The runtime endpoints trust its claims after checking the
+# signature, so they authenticate the learner and the attempt ownership
+# without a database round trip. The player renews it before it expires.
+
+RUNTIME_TOKEN_AUDIENCE = 'scorm-runtime'
+RUNTIME_TOKEN_ALGORITHM = 'HS256'
+
+class RuntimeUser:
+    """The learner of a runtime token, built from its claims instead of loaded from the database."""
+
+    is_authenticated = True
+    is_anonymous = False
+    is_active = True
+    is_staff = False
+    is_superuser = False
+
+    def __init__(self, user_id, attempt_id):
+        self.id = self.pk = user_id
+        self.attempt_id = attempt_id
+
+    def __str__(self):
+        return f'RuntimeUser({self.id}, attempt {self.attempt_id})'
+
+def looks_like_runtime_token(token):
+    # DRF tokens are 40 hex characters; a JWT has three dot-separated segments
+    return token.count('.') == 2
+
+def create_runtime_token(attempt):
+    now = int(time.time())
+    return jwt.encode({
+        'sub': str(attempt.user_id),
+        'attempt': attempt.id,
+        'aud': RUNTIME_TOKEN_AUDIENCE,
+        'iat': now,
+        'exp': now + settings.SCORM_RUNTIME_TOKEN_MAX_AGE,
+    }, settings.SECRET_KEY, algorithm=RUNTIME_TOKEN_ALGORITHM)
+
+def decode_runtime_token(token):
+    """Return the RuntimeUser of a token; raises jwt.InvalidTokenError if it is invalid or expired."""
+    payload = jwt.decode(
+        token, settings.SECRET_KEY, algorithms=[RUNTIME_TOKEN_ALGORITHM],
+        audience=RUNTIME_TOKEN_AUDIENCE, options={'require': ['sub', 'attempt', 'exp']},
+    )
+    try:
+        return RuntimeUser(int(payload['sub']), int(payload['attempt']))
+    except (TypeError, ValueError):
+        raise jwt.InvalidTokenError('Malformed runtime token claims')
@@ -27,7 +27,7 @@ class ScormPackageSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = ScormPackage
-        fields = ['id', 'course', 'scorm_standard', 'file', 'version', 'manifest_path', 'launch_path', 'status', 'uploaded_at', 'created_at']
+        fields = ['id', 'course', 'scorm_standard', 'file', 'version', 'authoring_tool', 'authoring_tool_version', 'manifest_path', 'manifest_data', 'launch_path', 'is_extracted', 'status', 'uploaded_at', 'created_at']
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
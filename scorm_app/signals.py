@@ -0,0 +1,18 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+from .auth_cache import invalidate_tokens, invalidate_user_tokens
+
+@receiver([post_save, post_delete], sender=Token)
+def invalidate_token_cache(sender, instance, **kwargs):
+    # Tokens are rotated by deleting and recreating them
+    invalidate_tokens([instance.key])
+
+@receiver(post_save, sender=User)
+def invalidate_user_token_cache(sender, instance, update_fields=None, **kwargs):
+    # Deactivation, deletion or a new password; login() only touches last_login,
+    # which the cache does not hold
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    invalidate_user_tokens([instance.pk])
@@ -0,0 +1,45 @@
+import json
+import logging
+import time
+from contextlib import contextmanager
+from django_redis import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+# process_scorm_package publishes its stages and final state on a Redis
+# pub/sub channel per task, so status requests can wait for a change instead
+# of polling TaskResult.
+
+def task_channel(task_id):
+    return f'scorm:task:{task_id}'
+
+def publish_task_event(task_id, data):
+    """Publish a task event; failures are logged and swallowed, TaskResult stays authoritative."""
+    try:
+        get_redis_connection('default').publish(task_channel(task_id), json.dumps(data))
+    except Exception as e:
+        logger.error(f"Error publishing event for task {task_id}: {str(e)}")
+
+@contextmanager
+def subscribe_task_events(task_id):
+    """Subscribe to a task's events, yielding a wait(timeout) function that returns the next event or None.
+
+    Subscribe before reading TaskResult so that no event is missed in between.
+    """
+    pubsub = get_redis_connection('default').pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(task_channel(task_id))
+
+    def wait(timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            message = pubsub.get_message(timeout=remaining)
+            if message and message['type'] == 'message':
+                return json.loads(message['data'])
+
+    try:
+        yield wait
+    finally:
+        pubsub.close()
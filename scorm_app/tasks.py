@@ -1,18 +1,33 @@
 # tasks.py
-from celery import shared_task
+from celery import chord, shared_task
 import zipfile
 import os
+import posixpath
 import re
-import json
-import shutil
-import pytz
-from datetime import datetime
+import time
+import uuid
+import zlib
+from datetime import timedelta
+from urllib.parse import unquote
 import logging
-import xml.etree.ElementTree as ET
 from .models import ScormPackage, SCORMStandard, TaskResult
 from django.utils import timezone
 from django.conf import settings
-from .models import SCORMAttempt, SCORMElement
+from django.core.cache import cache
+from django.db import transaction
+from .models import PackageUpload, SCORMAttempt, SCORMElement
+from .dirty_attempts import mark_attempt_dirty, pop_dirty_attempts
+from .log_backends import get_progress_log_backend
+from .authoring import sniff_authoring_tool
+from .manifest import get_launch_href, parse_manifest
+from .package_files import precompress_package
+from .package_storage import check_archive_limits, extract_package
+from .runtime_cache import evict_runtime_state, warm_runtime_state
+from .task_events import publish_task_event
+from .write_behind import (
+    acknowledge_pending_writes, claim_pending_writes, discard_pending_writes, has_pending_writes,
+    list_pending_attempts,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -24,37 +39,56 @@ def process_scorm_package(self, package_id, task_id):
 
     task_result = TaskResult.objects.get(task_id=task_id)
     try:
+        extract_path = package.get_extract_path()
         with zipfile.ZipFile(package.file.path, 'r') as zip_ref:
-            extract_path = f'media/scorm_extracted/{package.id}/'
-            zip_ref.extractall(extract_path)
-
-        # Find imsmanifest.xml and parse it
-        manifest_path = find_manifest(extract_path)
-        logger.info(f"Manifest path: {manifest_path}")
-        if not manifest_path:
-            raise Exception("imsmanifest.xml not found")
-
-        # Parse manifest and update package info
-        scorm_version, launch_path = parse_manifest(manifest_path)
-        package.manifest_path = os.path.relpath(manifest_path, extract_path)
-        package.launch_path = launch_path
-
-        # Insert the new code here
-        # Try to find an index file, but don't require it
-        index_files = ['index_lms.html', 'index.html', launch_path]
-        index_path = next((os.path.join(extract_path, f) for f in index_files if os.path.exists(os.path.join(extract_path, f))), None)
-
-        logger.info(f"Index path: {index_path}")
-        if index_path and os.path.exists(index_path):
-            with open(index_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-                version_match = re.search(r'version: ([\d\.]+)', content)
-                logger.info(f"Version match: {version_match}")
-                if version_match:
-                    package.version = version_match.group(1)
-        else:
-            logger.warning("No suitable index file found. Using version from manifest.")
-            package.version = scorm_version  # Fall back to the version from the manifest
+            # Check the limits and locate and parse the manifest from the central
+            # directory first, so invalid packages are rejected before anything is extracted.
+            check_archive_limits(zip_ref)
+            report_progress(task_result, 'parsing')
+            manifest_name = find_manifest(zip_ref)
+            logger.info(f"Manifest path: {manifest_name}")
+            if not manifest_name:
+                raise Exception("imsmanifest.xml not found")
+
+            with zip_ref.open(manifest_name) as manifest_file:
+                logger.info(f"Parsing manifest: {manifest_name}")
+                manifest_data = parse_manifest(manifest_file)
+            scorm_version = manifest_data.get('scorm_version')
+            logger.info(f"Found schema version in manifest: {scorm_version}")
+            launch_member = posixpath.normpath(posixpath.join(
+                posixpath.dirname(manifest_name), get_launch_href(manifest_data),
+            ))
+            names = set(zip_ref.namelist())
+            launch_file = re.split(r'[?#]', launch_member)[0]
+            if launch_file not in names:
+                if unquote(launch_file) not in names:
+                    raise ValueError(f"Launch file {launch_member} not found in package")
+                # Manifest hrefs may be URL-encoded; keep the member name, launch URLs quote it again
+                launch_member = unquote(launch_file) + launch_member[len(launch_file):]
+                launch_file = unquote(launch_file)
+            package.manifest_path = manifest_name
+            package.manifest_data = manifest_data
+            package.launch_path = os.path.join(extract_path, launch_member)
+
+            # Identify the exporter from the head of the launch and index files
+            authoring = sniff_authoring_tool(zip_ref, names, launch_file)
+            logger.info(f"Authoring tool: {authoring}")
+            # Sniffed from package files, so clipped to what the columns hold
+            package.authoring_tool = truncate_to_field(package, 'authoring_tool', authoring['tool'])
+            package.authoring_tool_version = truncate_to_field(package, 'authoring_tool_version', authoring['version'])
+            # Fall back to the version from the manifest
+            package.version = truncate_to_field(package, 'version', authoring['version'] or scorm_version or '')
+
+            # Without extraction, assets are streamed from the archive by package_content
+            if settings.SCORM_EXTRACT_PACKAGES:
+                report_progress(task_result, 'extracting')
+                extract_package(zip_ref, extract_path, progress=lambda files, total, size: report_progress(
+                    task_result, 'extracting', files=files, total_files=total, bytes=size,
+                ))
+                if settings.SCORM_PRECOMPRESS_ASSETS:
+                    report_progress(task_result, 'compressing')
+                    precompress_package(extract_path)
+            package.is_extracted = settings.SCORM_EXTRACT_PACKAGES
 
         # Set SCORM standard
         scorm_standard = get_scorm_standard(scorm_version)
@@ -68,6 +102,7 @@ def process_scorm_package(self, package_id, task_id):
         task_result.result = {'package_id': package.id}
         task_result.date_done = timezone.now()
         task_result.save()
+        publish_task_event(task_id, {'status': task_result.status, **task_result.result})
         
         return package.id
     except Exception as e:
@@ -77,75 +112,41 @@ def process_scorm_package(self, package_id, task_id):
         task_result.save()
         package.status = 'error'
         package.save()
+        publish_task_event(task_id, {'status': task_result.status, **task_result.result})
         raise
 
-def find_manifest(path):
-    for root, dirs, files in os.walk(path):
-        if 'imsmanifest.xml' in files:
-            logger.info("Found imsmanifest.xml")
-            return os.path.join(root, 'imsmanifest.xml')
-        elif 'tincan.xml' in files:
-            logger.info("Found tincan.xml (xAPI package)")
-            return os.path.join(root, 'tincan.xml')
-    logger.warning("No manifest file found")
-    return None
-
-def parse_manifest(manifest_path):
-    logger.info(f"Parsing manifest: {manifest_path}")
-    tree = ET.parse(manifest_path)
-    logger.info(f"Manifest parsed: {manifest_path}")
-    root = tree.getroot()
-    logger.info(f"Root element: {root}")
-
-    # Define namespaces
-    namespaces = {
-        'imscp': 'http://www.imsproject.org/xsd/imscp_rootv1p1p2',
-        'adlcp': 'http://www.adlnet.org/xsd/adlcp_rootv1p2',
-        'xsi': 'http://www.w3.org/2001/XMLSchema-instance'
-    }
-
-    # Find the schemaversion
-    logger.info("Finding schema version in manifest")
-    schema_version = root.find('.//imscp:schemaversion', namespaces)
-    logger.info(f"Schema version element: {schema_version}")
-    scorm_version = schema_version.text if schema_version is not None else None
-    logger.info(f"Found schema version in manifest: {scorm_version}")
-
-    # Find the organization element
-    organization = root.find('.//imscp:organizations/imscp:organization', namespaces)
-    
-    if organization is None:
-        logger.warning("Organization element not found in manifest")
-        raise ValueError("No organization found in manifest")
-
-    # Find the first item in the organization
-    item = organization.find('.//imscp:item', namespaces)
-    
-    if item is None:
-        raise ValueError("No item found in organization")
-
-    # Get the identifierref attribute
-    identifierref = item.get('identifierref')
-
-    if identifierref is None:
-        raise ValueError("No identifierref found in item")
-
-    # Find the resource with matching identifier
-    resource = root.find(f'.//imscp:resources/imscp:resource[@identifier="{identifierref}"]', namespaces)
-    
-    if resource is None:
-        raise ValueError(f"No resource found with identifier {identifierref}")
-
-    # Get the href attribute
-    href = resource.get('href')
-
-    if href is None:
-        raise ValueError("No href found in resource")
-
-    # Construct the full path
-    launch_path = os.path.join(os.path.dirname(manifest_path), href)
-
-    return scorm_version, launch_path
+MANIFEST_NAMES = ('imsmanifest.xml', 'tincan.xml')
+
+def truncate_to_field(instance, field_name, value):
+    return (value or '')[:instance._meta.get_field(field_name).max_length]
+
+def report_progress(task_result, stage, **data):
+    """Record the current processing stage in TaskResult.result while the task is running."""
+    task_result.result = dict(data, stage=stage)
+    TaskResult.objects.filter(pk=task_result.pk).update(result=task_result.result)
+    publish_task_event(task_result.task_id, {'status': task_result.status, **task_result.result})
+
+def find_manifest(zip_ref):
+    """Return the archive member name of the package manifest, or None.
+
+    The shallowest manifest wins; at equal depth imsmanifest.xml is preferred
+    over tincan.xml and ties are broken by name, so the choice is deterministic.
+    """
+    candidates = [
+        name for name in zip_ref.namelist()
+        if posixpath.basename(name) in MANIFEST_NAMES and not name.startswith('__MACOSX/')
+    ]
+    if not candidates:
+        logger.warning("No manifest file found")
+        return None
+    manifest_name = min(candidates, key=lambda name: (
+        name.count('/'), MANIFEST_NAMES.index(posixpath.basename(name)), name,
+    ))
+    if manifest_name.endswith('tincan.xml'):
+        logger.info("Found tincan.xml (xAPI package)")
+    else:
+        logger.info("Found imsmanifest.xml")
+    return manifest_name
 
 def get_scorm_standard(version):
     logger.info(f"Determining SCORM standard for version: {version}")
@@ -161,49 +162,242 @@ def get_scorm_standard(version):
         standard = None
     return standard
 
+@shared_task
+def cleanup_stale_uploads():
+    """Delete resumable uploads that received nothing for SCORM_UPLOAD_EXPIRY, and their temp files."""
+    cutoff = timezone.now() - timedelta(seconds=settings.SCORM_UPLOAD_EXPIRY)
+    stale = list(PackageUpload.objects.filter(updated_at__lt=cutoff))
+    for upload in stale:
+        # Only remove the file if the row was still there, a finalize may just have taken it
+        if PackageUpload.objects.filter(pk=upload.pk, updated_at__lt=cutoff).delete()[0]:
+            remove_upload_file(upload.get_temp_path())
+
+    # Files left behind by uploads whose row is already gone
+    try:
+        names = os.listdir(settings.SCORM_UPLOAD_TEMP_DIR)
+    except FileNotFoundError:
+        names = []
+    live = {str(upload_id) for upload_id in PackageUpload.objects.values_list('upload_id', flat=True)}
+    orphans = 0
+    for name in names:
+        path = os.path.join(settings.SCORM_UPLOAD_TEMP_DIR, name)
+        if name.endswith('.part') and name[:-len('.part')] not in live and os.path.getmtime(path) < cutoff.timestamp():
+            remove_upload_file(path)
+            orphans += 1
+    logger.info(f"Removed {len(stale)} stale uploads and {orphans} orphaned upload files")
+    return len(stale) + orphans
+
+def remove_upload_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+LOG_PROCESSING_LOCK_KEY = 'scorm:process_scorm_logs:lock'
 
 @shared_task
 def process_scorm_logs():
+    """List the attempts with a progress log or queued write-behind values and fan them out to shard tasks as a chord.
+
+    Attempts are grouped by a hash of the user id. A cache lock keeps overlapping
+    beat runs from dispatching the same logs twice; it is released by the chord
+    callback once every shard has finished.
+    """
     logger.info("Starting SCORM log processing task")
-    log_dir = settings.SCORM_LOGS_DIR
-    archive_dir = os.path.join(settings.SCORM_LOGS_DIR, 'archive')
-    os.makedirs(archive_dir, exist_ok=True)
-    
+    lock_token = uuid.uuid4().hex
+    if not cache.add(LOG_PROCESSING_LOCK_KEY, lock_token, timeout=settings.SCORM_LOG_PROCESSING_LOCK_TIMEOUT):
+        logger.info("SCORM log processing is already running. Skipping this run.")
+        return None
+
+    try:
+        shards = [[] for _ in range(settings.SCORM_LOG_PROCESSING_SHARDS)]
+        candidates = dict.fromkeys(get_progress_log_backend().list_attempts())
+        # The pending index covers write-behind values whose dirty marker was lost
+        try:
+            candidates.update(dict.fromkeys(list_pending_attempts()))
+        except Exception as e:
+            logger.error(f"Error listing attempts with write-behind values: {str(e)}")
+        for user_id, attempt_id in candidates:
+            shards[zlib.crc32(user_id.encode()) % len(shards)].append([user_id, attempt_id])
+        shards = [shard for shard in shards if shard]
+
+        if not shards:
+            logger.info("SCORM log processing completed. No logs to process.")
+            release_log_processing_lock(lock_token)
+            return None
+
+        chord(process_scorm_log_shard.s(shard) for shard in shards)(finish_scorm_log_processing.s(lock_token))
+        logger.info(f"Dispatched {sum(len(shard) for shard in shards)} attempt logs in {len(shards)} shards")
+        return len(shards)
+    except Exception:
+        release_log_processing_lock(lock_token)
+        raise
+
+@shared_task
+def drain_dirty_attempts():
+    """Process the attempts the runtime API marked dirty until none are due.
+
+    Runs every few seconds from beat; the periodic process_scorm_logs scan only
+    reconciles attempts whose marker was lost.
+    """
+    totals = {'processed': 0, 'skipped': 0, 'errors': 0}
+    while True:
+        candidates = pop_dirty_attempts(settings.SCORM_DIRTY_DRAIN_BATCH_SIZE)
+        if not candidates:
+            break
+        result = process_scorm_log_shard(candidates)
+        for key in totals:
+            totals[key] += result[key]
+    if any(totals.values()):
+        logger.info(f"Dirty SCORM attempts drained. Processed: {totals['processed']}, Skipped: {totals['skipped']}, Errors: {totals['errors']}")
+    return totals
+
+@shared_task
+def process_scorm_log_shard(candidates):
+    """Process the logs of one shard of [user_id, attempt_id] pairs and return its counters."""
+    backend = get_progress_log_backend()
+    attempts = SCORMAttempt.objects.in_bulk([int(attempt_id) for _, attempt_id in candidates])
+
     processed_count = 0
     skipped_count = 0
     error_count = 0
 
-    for user_dir in os.listdir(log_dir):
-        user_path = os.path.join(log_dir, user_dir)
-        if os.path.isdir(user_path):
-            for attempt_dir in os.listdir(user_path):
-                attempt_path = os.path.join(user_path, attempt_dir)
-                if os.path.isdir(attempt_path):
-                    log_file = os.path.join(attempt_path, 'progress.json')
-                    if os.path.exists(log_file):
-                        try:
-                            if should_process_file(log_file, user_dir, attempt_dir):
-                                process_log_file(log_file, user_dir, attempt_dir)
-                                processed_count += 1
-                                archive_log_file(log_file, archive_dir, user_dir, attempt_dir)
-                            else:
-                                skipped_count += 1
-                        except Exception as e:
-                            logger.error(f"Error processing log file {log_file}: {str(e)}")
-                            error_count += 1
-
-    logger.info(f"SCORM log processing completed. Processed: {processed_count}, Skipped: {skipped_count}, Errors: {error_count}")
-
-def should_process_file(log_file, user_id, attempt_id):
+    for user_id, attempt_id in candidates:
+        attempt = attempts.get(int(attempt_id))
+        if attempt is None or str(attempt.user_id) != user_id:
+            logger.warning(f"SCORMAttempt not found: user_id={user_id}, attempt_id={attempt_id}")
+            if attempt is None:
+                try:
+                    discard_pending_writes(user_id, attempt_id)
+                except Exception as e:
+                    logger.error(f"Error discarding write-behind values for attempt_id={attempt_id}: {str(e)}")
+            error_count += 1
+            continue
+        lock_token = acquire_attempt_lock(attempt_id)
+        if lock_token is None:
+            # Another run or a committing request holds the attempt; look at it again on the next drain
+            mark_attempt_dirty(user_id, attempt_id)
+            skipped_count += 1
+            continue
+        try:
+            processed = False
+            if should_process_file(user_id, attempt_id, attempt=attempt):
+                attempt = process_log_file(user_id, attempt_id, attempt=attempt)
+                if attempt is None:
+                    # Write-behind values must not overtake log entries that failed to apply
+                    mark_attempt_dirty(user_id, attempt_id)
+                    error_count += 1
+                    continue
+                processed = True
+                # Logs stay in place until the attempt is finalized
+                # Entries appended after the ones just applied keep the log active
+                if attempt.is_complete and backend.archive(user_id, attempt_id, attempt.log_cursor):
+                    # A new log for the attempt starts from scratch
+                    SCORMAttempt.objects.filter(id=attempt.id, log_cursor=attempt.log_cursor).update(log_cursor='')
+                    attempt.log_cursor = ''
+            # Write-behind values are newer than anything in the log, so they go last
+            if has_pending_writes(user_id, attempt_id):
+                apply_pending_writes(attempt)
+                processed = True
+            if processed:
+                processed_count += 1
+            else:
+                skipped_count += 1
+        except Exception as e:
+            logger.error(f"Error processing log for user_id={user_id}, attempt_id={attempt_id}: {str(e)}")
+            error_count += 1
+        finally:
+            release_attempt_lock(attempt_id, lock_token)
+
+    logger.info(f"SCORM log shard completed. Processed: {processed_count}, Skipped: {skipped_count}, Errors: {error_count}")
+    return {'processed': processed_count, 'skipped': skipped_count, 'errors': error_count}
+
+@shared_task
+def finish_scorm_log_processing(shard_results, lock_token):
+    """Chord callback: aggregate the shard counters and release the processing lock."""
+    totals = {'processed': 0, 'skipped': 0, 'errors': 0, 'shards': len(shard_results)}
+    for result in shard_results:
+        for key in ('processed', 'skipped', 'errors'):
+            totals[key] += result.get(key, 0)
+    release_log_processing_lock(lock_token)
+    logger.info(f"SCORM log processing completed. Processed: {totals['processed']}, Skipped: {totals['skipped']}, Errors: {totals['errors']}")
+    return totals
+
+def release_log_processing_lock(lock_token):
+    # Only the run that took the lock may release it
+    if cache.get(LOG_PROCESSING_LOCK_KEY) == lock_token:
+        cache.delete(LOG_PROCESSING_LOCK_KEY)
+
+def attempt_lock_key(attempt_id):
+    return f'scorm:attempt:{attempt_id}:lock'
+
+def acquire_attempt_lock(attempt_id, wait=0):
+    """Take the lock serializing log processing, archiving and write-behind flushes of an attempt.
+
+    Waits up to wait seconds; returns a token to release it with, or None.
+    """
+    lock_token = uuid.uuid4().hex
+    deadline = time.monotonic() + wait
+    while not cache.add(attempt_lock_key(attempt_id), lock_token, timeout=settings.SCORM_ATTEMPT_LOCK_TIMEOUT):
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(0.05)
+    return lock_token
+
+def release_attempt_lock(attempt_id, lock_token):
+    # Only the holder may release it
+    if cache.get(attempt_lock_key(attempt_id)) == lock_token:
+        cache.delete(attempt_lock_key(attempt_id))
+
+def flush_pending_writes(attempt, wait=0):
+    """Persist the write-behind values queued for an attempt to SCORMElement.
+
+    Returns the number of elements written, or None if the attempt's lock was
+    held for longer than wait seconds.
+    """
+    lock_token = acquire_attempt_lock(attempt.id, wait=wait)
+    if lock_token is None:
+        return None
     try:
-        attempt = SCORMAttempt.objects.get(id=attempt_id, user_id=user_id)
-        if attempt.is_complete:
-            logger.info(f"Skipping completed attempt: user_id={user_id}, attempt_id={attempt_id}")
-            return False
-        
-        file_mtime = datetime.fromtimestamp(os.path.getmtime(log_file), tz=pytz.UTC)
-        if attempt.last_processed and file_mtime <= attempt.last_processed:
-            logger.info(f"Skipping unmodified log: user_id={user_id}, attempt_id={attempt_id}")
+        return apply_pending_writes(attempt)
+    finally:
+        release_attempt_lock(attempt.id, lock_token)
+
+def apply_pending_writes(attempt):
+    """Claim and apply an attempt's write-behind values; the caller holds the attempt's lock."""
+    user_id, attempt_id = attempt.user_id, attempt.id
+    values = claim_pending_writes(user_id, attempt_id)
+    if not values:
+        return 0
+    try:
+        apply_element_values(attempt, values)
+    except Exception:
+        # The values stay claimed and are retried with the next drain
+        mark_attempt_dirty(user_id, attempt_id)
+        raise
+    acknowledge_pending_writes(user_id, attempt_id)
+    if attempt.is_complete:
+        evict_runtime_state(user_id, attempt_id)
+    logger.info(f"Flushed {len(values)} write-behind values for attempt_id={attempt_id}")
+    return len(values)
+
+@shared_task
+def warm_runtime_cache(attempt_id):
+    """Preload an attempt's state into the runtime cache ahead of its first runtime calls."""
+    try:
+        attempt = SCORMAttempt.objects.get(id=attempt_id)
+    except SCORMAttempt.DoesNotExist:
+        logger.warning(f"SCORMAttempt not found for runtime cache warm-up: attempt_id={attempt_id}")
+        return False
+    return warm_runtime_state(attempt)
+
+def should_process_file(user_id, attempt_id, attempt=None):
+    try:
+        if attempt is None:
+            attempt = SCORMAttempt.objects.get(id=attempt_id, user_id=user_id)
+        if attempt.log_cursor == get_progress_log_backend().end_cursor(user_id, attempt_id):
+            logger.info(f"Skipping log without new entries: user_id={user_id}, attempt_id={attempt_id}")
             return False
         
         return True
@@ -212,76 +406,86 @@ def should_process_file(log_file, user_id, attempt_id):
         return True
 
 
-def process_log_file(log_file, user_id, attempt_id):
-    logger.info(f"Processing log file: {log_file}")
-    try:
-        with open(log_file, 'r') as f:
-            log_data = json.load(f)
-    except json.JSONDecodeError:
-        logger.error(f"Invalid JSON in log file: {log_file}")
-        return
-    except Exception as e:
-        logger.error(f"Error reading log file {log_file}: {str(e)}")
-        return
-
+def process_log_file(user_id, attempt_id, attempt=None):
+    """Apply the entries written since the attempt's log cursor and return the attempt."""
+    logger.info(f"Processing log for user_id={user_id}, attempt_id={attempt_id}")
     try:
-        attempt = SCORMAttempt.objects.get(id=attempt_id, user_id=user_id)
+        if attempt is None:
+            attempt = SCORMAttempt.objects.get(id=attempt_id, user_id=user_id)
     except SCORMAttempt.DoesNotExist:
         logger.error(f"SCORMAttempt not found for user_id: {user_id}, attempt_id: {attempt_id}")
-        return
+        return None
 
-    # Process and aggregate data
-    latest_status = None
-    latest_score = None
-    elements_updated = 0
+    backend = get_progress_log_backend()
 
-    for entry in log_data:
-        element_id = entry['data']['element_id']
-        value = entry['data']['value']
-        
-        if element_id == 'cmi.core.lesson_status':
-            latest_status = value
-        elif element_id == 'cmi.core.score.raw':
-            try:
-                latest_score = float(value)
-            except ValueError:
-                logger.warning(f"Invalid score value in log file {log_file}: {value}")
-
-        # Update or create SCORMElement
-        try:
-            SCORMElement.objects.update_or_create(
-                scorm_attempt=attempt,
-                element_id=element_id,
-                defaults={'value': value}
-            )
-            elements_updated += 1
-        except Exception as e:
-            logger.error(f"Error updating SCORMElement for {element_id}: {str(e)}")
+    # Collapse the new entries to the last value written for each element
+    latest_values = {}
+    cursor = attempt.log_cursor
+    for entry, cursor in backend.read_since(user_id, attempt_id, attempt.log_cursor):
+        latest_values[entry['data']['element_id']] = entry['data']['value']
+
+    if cursor == attempt.log_cursor:
+        logger.info(f"No new entries in log for attempt_id={attempt_id}")
+        return attempt
 
-    # Update SCORMAttempt
     try:
+        apply_element_values(attempt, latest_values, log_cursor=cursor)
+    except Exception as e:
+        logger.error(f"Error applying log to SCORMAttempt id: {attempt_id}: {str(e)}")
+        return None
+    backend.acknowledge(user_id, attempt_id, cursor)
+    try:
+        backend.compact_snapshot(user_id, attempt_id)
+    except Exception as e:
+        logger.error(f"Error compacting snapshot for attempt_id={attempt_id}: {str(e)}")
+    if attempt.is_complete:
+        # Everything is persisted; the runtime cache is rebuilt if the learner comes back
+        evict_runtime_state(user_id, attempt_id)
+
+    logger.info(f"Processed log for attempt_id={attempt_id} up to {cursor}. Updated {len(latest_values)} elements.")
+    return attempt
+
+def apply_element_values(attempt, latest_values, log_cursor=None):
+    """Upsert the latest value of each element and update the attempt, in one transaction.
+
+    All elements are written with a single bulk INSERT ... ON CONFLICT on the
+    (scorm_attempt, element_id) unique key. The log cursor is moved in the same
+    transaction, and only if it is still where this run read from, so entries
+    are never applied twice or skipped.
+    """
+    latest_status = latest_values.get('cmi.core.lesson_status')
+    latest_score = None
+    if 'cmi.core.score.raw' in latest_values:
+        try:
+            latest_score = float(latest_values['cmi.core.score.raw'])
+        except ValueError:
+            logger.warning(f"Invalid score value for SCORMAttempt id {attempt.id}: {latest_values['cmi.core.score.raw']}")
+
+    with transaction.atomic():
+        SCORMElement.objects.bulk_create(
+            [SCORMElement(scorm_attempt=attempt, element_id=element_id, value=value)
+             for element_id, value in latest_values.items()],
+            batch_size=settings.SCORM_ELEMENT_BULK_BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=['scorm_attempt', 'element_id'],
+            update_fields=['value', 'timestamp'],
+        )
+        if log_cursor is not None:
+            moved = SCORMAttempt.objects.filter(id=attempt.id, log_cursor=attempt.log_cursor).update(log_cursor=log_cursor)
+            if not moved:
+                raise Exception(f"Log cursor of SCORMAttempt id {attempt.id} moved while its log was being processed")
+            attempt.log_cursor = log_cursor
+        # Only the fields this update changes are written, so it never reverts another run's
+        update_fields = ['last_processed']
         if latest_status:
             attempt.completion_status = latest_status
+            update_fields.append('completion_status')
             if latest_status in ['completed', 'passed']:
                 attempt.is_complete = True
+                update_fields.append('is_complete')
         if latest_score is not None:
             attempt.score = latest_score
+            update_fields.append('score')
         attempt.last_processed = timezone.now()
-        attempt.save()
-        logger.info(f"Updated SCORMAttempt id: {attempt_id}, status: {latest_status}, score: {latest_score}")
-    except Exception as e:
-        logger.error(f"Error updating SCORMAttempt id: {attempt_id}: {str(e)}")
-
-    logger.info(f"Processed log file {log_file}. Updated {elements_updated} elements.")
-
-    # Optionally, delete the processed log file
-    # os.remove(log_file)
-    # logger.info(f"Deleted processed log file: {log_file}")
-
-def archive_log_file(log_file, archive_dir, user_id, attempt_id):
-    archive_user_dir = os.path.join(archive_dir, user_id)
-    archive_attempt_dir = os.path.join(archive_user_dir, attempt_id)
-    os.makedirs(archive_attempt_dir, exist_ok=True)
-    archive_file = os.path.join(archive_attempt_dir, 'progress.json')
-    shutil.move(log_file, archive_file)
-    logger.info(f"Archived log file: {log_file} to {archive_file}")
\ No newline at end of file
+        attempt.save(update_fields=update_fields)
+    logger.info(f"Updated SCORMAttempt id: {attempt.id}, status: {latest_status}, score: {latest_score}")
@@ -1,3 +1,1238 @@
-from django.test import TestCase
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import zipfile
+from contextlib import contextmanager
+from datetime import timedelta
+from unittest import mock
+import jwt
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIClient
+from . import asset_grants, dirty_attempts, log_backends, runtime_cache, task_events, tasks, views, write_behind
+from .asset_grants import create_asset_grant, resolve_asset_grant
+from .auth_cache import _local_cache, invalidate_user_tokens, token_cache_key
+from .log_backends import (
+    FileSystemProgressLogBackend, RedisStreamProgressLogBackend, SNAPSHOT_FILENAME, get_progress_log_backend,
+    iter_log_since,
+)
+from .manifest import get_launch_href, parse_manifest
+from .models import Course, PackageContent, PackageUpload, SCORMAttempt, SCORMElement, ScormPackage, TaskResult
+from .package_files import parse_accept_encoding, parse_range_header, precompress_package
+from .package_storage import PackageLimitError, check_archive_limits, release_package_content
+from .runtime_tokens import create_runtime_token, decode_runtime_token
 
-# Create your tests here.
+
+def make_entry(element_id, value):
+    return {'timestamp': '2024-01-01T00:00:00+00:00', 'data': {'element_id': element_id, 'value': value}}
+
+
+def make_attempt(username='learner'):
+    user = User.objects.create_user(username, password='x')
+    course = Course.objects.create(title='Course')
+    package = ScormPackage.objects.create(course=course, file='scorm_packages/p.zip', version='1.2', manifest_path='imsmanifest.xml')
+    return SCORMAttempt.objects.create(user=user, scorm_package=package)
+
+def make_manifest(href):
+    return f"""<manifest identifier="M" xmlns="http://www.imsproject.org/xsd/imscp_rootv1p1p2">
+  <metadata><schemaversion>1.2</schemaversion></metadata>
+  <organizations default="ORG"><organization identifier="ORG">
+    <item identifier="I" identifierref="R"><title>Lesson</title></item>
+  </organization></organizations>
+  <resources><resource identifier="R" type="webcontent" href="{href}"/></resources>
+</manifest>"""
+
+
+@override_settings(SCORM_EXTRACT_PACKAGES=False)
+class PackageProcessingTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        os.makedirs(os.path.join(media_root, 'scorm_packages'))
+        self.media_root = media_root
+
+    def make_package(self, members, name='p.zip'):
+        with zipfile.ZipFile(os.path.join(self.media_root, 'scorm_packages', name), 'w') as zip_ref:
+            for member, data in members.items():
+                zip_ref.writestr(member, data)
+        return ScormPackage.objects.create(file=f'scorm_packages/{name}', version='', manifest_path='')
+
+    def process(self, package):
+        task_id = f'task-{package.id}'
+        TaskResult.objects.create(task_id=task_id)
+        tasks.process_scorm_package(package.id, task_id)
+        package.refresh_from_db()
+        return package
+
+    def test_encoded_launch_href(self):
+        package = self.process(self.make_package({
+            'imsmanifest.xml': make_manifest('my%20file.html?page=1'), 'my file.html': '<html></html>',
+        }))
+        self.assertEqual(package.status, 'ready')
+        self.assertEqual(package.get_launch_url(grant='g'), '/assets/g/my%20file.html?page=1')
+
+    def test_shallowest_manifest_wins(self):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as zip_ref:
+            for name in ('__MACOSX/imsmanifest.xml', 'a/b/imsmanifest.xml', 'z/imsmanifest.xml',
+                         'b/tincan.xml', 'b/imsmanifest.xml', 'c/imsmanifest.xml'):
+                zip_ref.writestr(name, '')
+            self.assertEqual(tasks.find_manifest(zip_ref), 'b/imsmanifest.xml')
+        with zipfile.ZipFile(io.BytesIO(), 'w') as zip_ref:
+            zip_ref.writestr('index.html', '')
+            self.assertIsNone(tasks.find_manifest(zip_ref))
+
+    def test_nested_manifest_resolves_launch_file(self):
+        package = self.process(self.make_package({
+            'course/imsmanifest.xml': make_manifest('index.html'), 'course/index.html': '<html></html>',
+            'course/extra/imsmanifest.xml': make_manifest('other.html'),
+        }))
+        self.assertEqual(package.status, 'ready')
+        self.assertEqual(package.manifest_path, 'course/imsmanifest.xml')
+        self.assertTrue(package.launch_path.endswith('/course/index.html'))
+
+    @override_settings(SCORM_EXTRACT_PACKAGES=True)
+    def test_missing_launch_file_rejected_before_extraction(self):
+        package = self.make_package({'imsmanifest.xml': make_manifest('missing.html'), 'index.html': ''})
+        with mock.patch.object(tasks, 'extract_package') as extract_package, self.assertRaises(ValueError):
+            self.process(package)
+        self.assertFalse(extract_package.called)
+        package.refresh_from_db()
+        self.assertEqual(package.status, 'error')
+        self.assertEqual(TaskResult.objects.get(task_id=f'task-{package.id}').status, 'FAILURE')
+
+    def upload(self, data):
+        user, _ = User.objects.get_or_create(username='author')
+        client = APIClient()
+        client.force_authenticate(user)
+        course = Course.objects.create(title='Course')
+        with mock.patch.object(views, 'process_scorm_package') as task, self.captureOnCommitCallbacks(execute=True):
+            response = client.post('/api/scorm-packages/upload_package/', {
+                'course_id': course.id, 'file': SimpleUploadedFile('p.zip', data),
+            }, format='multipart')
+        self.assertEqual(response.status_code, 202)
+        return ScormPackage.objects.get(id=response.data['package']['id']), task.apply_async
+
+    def test_identical_upload_reuses_processed_content(self):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as zip_ref:
+            zip_ref.writestr('imsmanifest.xml', make_manifest('index.html'))
+            zip_ref.writestr('index.html', '<html></html>')
+        first, apply_async = self.upload(buffer.getvalue())
+        self.assertTrue(apply_async.called)
+        first = self.process(first)
+        self.assertEqual(first.status, 'ready')
+
+        second, apply_async = self.upload(buffer.getvalue())
+        self.assertFalse(apply_async.called)
+        self.assertEqual(second.status, 'ready')
+        self.assertEqual(second.content_id, first.content_id)
+        self.assertEqual(second.launch_path, first.launch_path)
+        self.assertEqual(PackageContent.objects.get().ref_count, 2)
+
+    def test_release_deletes_content_with_last_reference(self):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as zip_ref:
+            zip_ref.writestr('index.html', '<html></html>')
+        package, _ = self.upload(buffer.getvalue())
+        self.upload(buffer.getvalue())
+        content = package.content
+        archive_path = content.file.path
+        extract_path = os.path.join(self.media_root, 'scorm_extracted', content.digest)
+        os.makedirs(extract_path)
+        with mock.patch.object(PackageContent, 'get_extract_path', return_value=extract_path):
+            self.assertFalse(release_package_content(content))
+            self.assertEqual(PackageContent.objects.get().ref_count, 1)
+            self.assertTrue(os.path.isfile(archive_path))
+            self.assertTrue(os.path.isdir(extract_path))
+            self.assertTrue(release_package_content(content))
+        self.assertFalse(PackageContent.objects.exists())
+        self.assertFalse(os.path.exists(archive_path))
+        self.assertFalse(os.path.exists(extract_path))
+
+
+class FileSystemLogTestCase(SimpleTestCase):
+    def setUp(self):
+        self.logs_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.logs_dir)
+        self.backend = FileSystemProgressLogBackend(logs_dir=self.logs_dir)
+        self.log_dir = self.backend.get_log_dir(1, 2)
+
+
+class SegmentCursorTests(FileSystemLogTestCase):
+    def test_cursor_points_past_each_entry(self):
+        self.backend.append(1, 2, [make_entry('a', '1'), make_entry('b', '2')])
+        read = list(iter_log_since(self.log_dir))
+        self.assertEqual([entry['data']['element_id'] for entry, _ in read], ['a', 'b'])
+        self.assertEqual(read[-1][1], self.backend.end_cursor(1, 2))
+        self.assertEqual([entry['data']['element_id'] for entry, _ in iter_log_since(self.log_dir, read[0][1])], ['b'])
+
+    def test_read_since_end_cursor_is_empty(self):
+        self.backend.append(1, 2, [make_entry('a', '1')])
+        self.assertEqual(list(self.backend.read_since(1, 2, self.backend.end_cursor(1, 2))), [])
+
+    def test_partial_line_is_left_for_next_read(self):
+        self.backend.append(1, 2, [make_entry('a', '1')])
+        end = self.backend.end_cursor(1, 2)
+        with open(os.path.join(self.log_dir, 'progress-000001.jsonl'), 'a') as f:
+            f.write('{"timestamp"')
+        self.assertEqual([cursor for _, cursor in iter_log_since(self.log_dir)], [end])
+
+    @override_settings(SCORM_LOG_SEGMENT_MAX_BYTES=1)
+    def test_cursor_spans_segments(self):
+        self.backend.append(1, 2, [make_entry('a', '1')])
+        cursor = self.backend.end_cursor(1, 2)
+        self.backend.append(1, 2, [make_entry('b', '2')])
+        self.assertTrue(self.backend.end_cursor(1, 2).startswith('2:'))
+        self.assertEqual([entry['data']['element_id'] for entry, _ in self.backend.read_since(1, 2, cursor)], ['b'])
+
+    @override_settings(SCORM_LOG_SEGMENT_MAX_BYTES=1)
+    def test_rollover_happens_under_exclusive_lock(self):
+        if log_backends.fcntl is None:
+            self.skipTest('fcntl is not available')
+        self.backend.append(1, 2, [make_entry('a', '1')])
+        with mock.patch.object(log_backends.fcntl, 'flock') as flock:
+            self.backend.append(1, 2, [make_entry('b', '2')])
+        self.assertEqual([call.args[1] for call in flock.call_args_list], [log_backends.fcntl.LOCK_EX])
+        self.assertTrue(self.backend.end_cursor(1, 2).startswith('2:'))
+
+    def test_legacy_log_is_read_first(self):
+        os.makedirs(self.log_dir)
+        with open(os.path.join(self.log_dir, 'progress.json'), 'w') as f:
+            json.dump([make_entry('a', 'old')], f)
+        self.backend.append(1, 2, [make_entry('a', 'new')])
+        self.assertEqual([entry['data']['value'] for entry, _ in iter_log_since(self.log_dir)], ['old', 'new'])
+
+
+class SnapshotTests(FileSystemLogTestCase):
+    def test_append_does_not_write_snapshot(self):
+        self.backend.append(1, 2, [make_entry('a', '1')])
+        self.assertFalse(os.path.exists(self.backend.get_snapshot_path(1, 2)))
+        self.assertEqual(self.backend.read_snapshot(1, 2), {'a': '1'})
+
+    def test_compact_then_replay_tail(self):
+        self.backend.append(1, 2, [make_entry('a', '1'), make_entry('b', '1')])
+        self.backend.compact_snapshot(1, 2)
+        with open(self.backend.get_snapshot_path(1, 2)) as f:
+            self.assertEqual(json.load(f), {'cursor': self.backend.end_cursor(1, 2), 'values': {'a': '1', 'b': '1'}})
+        self.backend.append(1, 2, [make_entry('b', '2')])
+        self.assertEqual(self.backend.read_snapshot(1, 2), {'a': '1', 'b': '2'})
+
+    def test_snapshot_miss_replays_log_once(self):
+        self.backend.append(1, 2, [make_entry('a', '1')])
+        with mock.patch.object(log_backends, 'iter_log_since', wraps=iter_log_since) as replay:
+            self.assertEqual(self.backend.read_snapshot(1, 2), {'a': '1'})
+        self.assertEqual(replay.call_count, 1)
+
+    def test_values_are_strings(self):
+        self.backend.append(1, 2, [make_entry('a', 80), make_entry('b', 0.5)])
+        self.assertEqual(self.backend.read_snapshot(1, 2), {'a': '80', 'b': '0.5'})
+        self.backend.compact_snapshot(1, 2)
+        with open(self.backend.get_snapshot_path(1, 2)) as f:
+            self.assertEqual(json.load(f)['values'], {'a': '80', 'b': '0.5'})
+        # Checkpoints written with raw values are normalised when read
+        with open(self.backend.get_snapshot_path(1, 2), 'w') as f:
+            json.dump({'cursor': self.backend.end_cursor(1, 2), 'values': {'a': 80}}, f)
+        self.assertEqual(self.backend.read_snapshot(1, 2), {'a': '80'})
+
+    def test_legacy_snapshot_is_rebuilt_from_log(self):
+        self.backend.append(1, 2, [make_entry('a', '1')])
+        with open(os.path.join(self.log_dir, SNAPSHOT_FILENAME), 'w') as f:
+            json.dump({'a': 'stale', 'b': '1'}, f)
+        self.assertEqual(self.backend.read_snapshot(1, 2), {'a': '1'})
+
+    def test_archive_drops_checkpoint(self):
+        self.backend.append(1, 2, [make_entry('a', '1')])
+        self.backend.compact_snapshot(1, 2)
+        self.backend.archive(1, 2, self.backend.end_cursor(1, 2))
+        self.assertFalse(os.path.exists(self.backend.get_snapshot_path(1, 2)))
+        self.backend.append(1, 2, [make_entry('b', '1')])
+        self.assertEqual(self.backend.read_snapshot(1, 2), {'b': '1'})
+
+
+class ArchiveTests(FileSystemLogTestCase):
+    def test_list_attempts_without_logs_dir(self):
+        backend = FileSystemProgressLogBackend(logs_dir=os.path.join(self.logs_dir, 'missing'))
+        self.assertEqual(list(backend.list_attempts()), [])
+
+    def test_archive_moves_processed_log(self):
+        self.backend.append(1, 2, [make_entry('a', '1')])
+        self.assertTrue(self.backend.archive(1, 2, self.backend.end_cursor(1, 2)))
+        self.assertEqual(self.backend.end_cursor(1, 2), '')
+        self.assertEqual(list(self.backend.list_attempts()), [])
+        archived = os.path.join(self.backend.archive_dir, '1', '2', 'progress-000001.jsonl')
+        self.assertTrue(os.path.exists(archived))
+
+    def test_archive_keeps_entries_appended_after_cursor(self):
+        self.backend.append(1, 2, [make_entry('a', '1')])
+        processed = self.backend.end_cursor(1, 2)
+        self.backend.append(1, 2, [make_entry('b', '1')])
+        self.assertFalse(self.backend.archive(1, 2, processed))
+        self.assertEqual([entry['data']['element_id'] for entry, _ in self.backend.read_since(1, 2, processed)], ['b'])
+        self.assertEqual(list(self.backend.list_attempts()), [('1', '2')])
+
+
+@unittest.skipUnless(fakeredis, 'fakeredis is not installed')
+class RedisStreamBackendTests(SimpleTestCase):
+    def setUp(self):
+        self.client = fakeredis.FakeRedis()
+        self.backend = RedisStreamProgressLogBackend(client=self.client, read_count=2)
+
+    def test_read_since_and_acknowledge(self):
+        self.backend.append(1, 2, [make_entry('a', '1'), make_entry('b', '1'), make_entry('a', '2')])
+        read = list(self.backend.read_since(1, 2, ''))
+        self.assertEqual([entry['data']['value'] for entry, _ in read], ['1', '1', '2'])
+        cursor = read[-1][1]
+        self.assertEqual(cursor, self.backend.end_cursor(1, 2))
+        self.backend.acknowledge(1, 2, cursor)
+        self.assertEqual(list(self.backend.read_since(1, 2, cursor)), [])
+        self.assertEqual(self.backend.read_snapshot(1, 2), {'a': '2', 'b': '1'})
+        self.assertEqual(list(self.backend.list_attempts()), [('1', '2')])
+
+    def test_snapshot_values_are_strings(self):
+        self.backend.append(1, 2, [make_entry('a', 80), make_entry('b', 0.5)])
+        self.assertEqual(self.backend.read_snapshot(1, 2), {'a': '80', 'b': '0.5'})
+
+    def test_unacknowledged_entries_are_redelivered(self):
+        self.backend.append(1, 2, [make_entry('a', '1')])
+        first = list(self.backend.read_since(1, 2, ''))
+        self.assertEqual([cursor for _, cursor in self.backend.read_since(1, 2, '')], [first[0][1]])
+
+    def test_acknowledge_trims_stream(self):
+        self.backend.append(1, 2, [make_entry('a', str(i)) for i in range(5)])
+        cursor = list(self.backend.read_since(1, 2, ''))[-1][1]
+        self.backend.acknowledge(1, 2, cursor)
+        self.assertEqual(self.client.xlen('scorm:log:1:2'), 1)
+        self.assertEqual(self.backend.end_cursor(1, 2), cursor)
+
+    def test_archive_expires_and_keeps_later_entries(self):
+        self.backend.append(1, 2, [make_entry('a', '1')])
+        processed = self.backend.end_cursor(1, 2)
+        self.backend.append(1, 2, [make_entry('b', '1')])
+        self.assertFalse(self.backend.archive(1, 2, processed))
+        self.assertTrue(self.backend.archive(1, 2, self.backend.end_cursor(1, 2)))
+        self.assertEqual(self.backend.end_cursor(1, 2), '')
+        self.assertEqual(list(self.backend.list_attempts()), [])
+        self.assertEqual(self.backend.read_snapshot(1, 2), {})
+        self.assertGreater(self.client.ttl('scorm:log:archive:1:2'), 0)
+
+
+class BootstrapTests(TestCase):
+    def setUp(self):
+        self.attempt = make_attempt()
+
+    def test_read_only_bootstrap_writes_nothing(self):
+        with mock.patch.object(views, 'record_runtime_values') as record, \
+                mock.patch.object(views, 'load_runtime_state') as load:
+            payload = views.bootstrap_attempt(self.attempt, initialize=False)
+        self.assertFalse(record.called)
+        self.assertFalse(load.called)
+        self.assertEqual(payload['cmi']['cmi.core.lesson_mode'], 'normal')
+
+    def test_bootstrap_records_defaults(self):
+        with mock.patch.object(views, 'record_runtime_values') as record:
+            views.bootstrap_attempt(self.attempt)
+        initialized = record.call_args[0][2]
+        self.assertEqual(initialized['cmi.core.entry'], 'ab-initio')
+        self.assertNotIn('cmi.core.exit', initialized)
+
+
+@override_settings(SCORM_PROGRESS_LOG_BACKEND='scorm_app.log_backends.FileSystemProgressLogBackend',
+                   SCORM_PROGRESS_LOG_BACKEND_OPTIONS={})
+class LogProcessingTests(TestCase):
+    def setUp(self):
+        logs_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, logs_dir)
+        settings_override = override_settings(SCORM_LOGS_DIR=logs_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        get_progress_log_backend.cache_clear()
+        self.addCleanup(get_progress_log_backend.cache_clear)
+        for name in ('has_pending_writes', 'mark_attempt_dirty', 'evict_runtime_state'):
+            patcher = mock.patch.object(tasks, name, return_value=False)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        cache.clear()
+        self.attempt = make_attempt()
+        self.backend = get_progress_log_backend()
+        self.candidate = [str(self.attempt.user_id), str(self.attempt.id)]
+
+    def append(self, element_id, value):
+        self.backend.append(self.attempt.user_id, self.attempt.id, [make_entry(element_id, value)])
+
+    def test_completed_attempt_is_archived(self):
+        self.append('cmi.core.lesson_status', 'completed')
+        result = tasks.process_scorm_log_shard([self.candidate])
+        self.assertEqual(result['processed'], 1)
+        self.attempt.refresh_from_db()
+        self.assertTrue(self.attempt.is_complete)
+        self.assertEqual(self.attempt.log_cursor, '')
+        self.assertEqual(list(self.backend.list_attempts()), [])
+
+    def test_entries_appended_during_processing_are_kept(self):
+        self.append('cmi.core.lesson_status', 'completed')
+        process_log_file = tasks.process_log_file
+
+        def process_then_append(*args, **kwargs):
+            attempt = process_log_file(*args, **kwargs)
+            self.append('cmi.suspend_data', 'late')
+            return attempt
+
+        with mock.patch.object(tasks, 'process_log_file', side_effect=process_then_append):
+            tasks.process_scorm_log_shard([self.candidate])
+        self.attempt.refresh_from_db()
+        self.assertNotEqual(self.attempt.log_cursor, '')
+        tasks.process_scorm_log_shard([self.candidate])
+        self.assertEqual(self.attempt.scormelement_set.get(element_id='cmi.suspend_data').value, 'late')
+        self.assertEqual(list(self.backend.list_attempts()), [])
+
+    def test_failed_log_is_counted_as_error(self):
+        self.append('cmi.core.lesson_status', 'incomplete')
+        tasks.has_pending_writes.return_value = True
+        with mock.patch.object(tasks, 'process_log_file', return_value=None), \
+                mock.patch.object(tasks, 'apply_pending_writes') as flush:
+            result = tasks.process_scorm_log_shard([self.candidate])
+        self.assertEqual(result, {'processed': 0, 'skipped': 0, 'errors': 1})
+        self.assertFalse(flush.called)
+        tasks.mark_attempt_dirty.assert_called_with(self.candidate[0], self.candidate[1])
+
+    def test_locked_attempt_is_skipped_and_marked_dirty(self):
+        self.append('cmi.core.lesson_status', 'incomplete')
+        lock_token = tasks.acquire_attempt_lock(self.attempt.id)
+        self.addCleanup(tasks.release_attempt_lock, self.attempt.id, lock_token)
+        result = tasks.process_scorm_log_shard([self.candidate])
+        self.assertEqual(result['skipped'], 1)
+        self.attempt.refresh_from_db()
+        self.assertEqual(self.attempt.log_cursor, '')
+        tasks.mark_attempt_dirty.assert_called_with(self.candidate[0], self.candidate[1])
+
+    def test_stale_cursor_is_not_overwritten(self):
+        self.append('cmi.core.lesson_status', 'incomplete')
+        stale = SCORMAttempt.objects.get(id=self.attempt.id)
+        tasks.process_log_file(self.candidate[0], self.candidate[1])
+        self.attempt.refresh_from_db()
+        applied = self.attempt.log_cursor
+        self.assertIsNone(tasks.process_log_file(self.candidate[0], self.candidate[1], attempt=stale))
+        self.attempt.refresh_from_db()
+        self.assertEqual(self.attempt.log_cursor, applied)
+
+    def test_upsert_takes_constant_queries(self):
+        for count in (3, 30):
+            values = {f'cmi.objectives.{n}.id': f'obj-{count}' for n in range(count)}
+            # Savepoint, upsert, cursor move, attempt update, release
+            with self.assertNumQueries(5):
+                tasks.apply_element_values(self.attempt, values, log_cursor=f'1:{count}')
+        self.assertEqual(self.attempt.scormelement_set.count(), 30)
+        self.assertEqual(self.attempt.scormelement_set.get(element_id='cmi.objectives.0.id').value, 'obj-30')
+        self.attempt.refresh_from_db()
+        self.assertEqual(self.attempt.log_cursor, '1:30')
+
+    def test_cursor_moves_only_from_where_it_was_read(self):
+        stale = SCORMAttempt.objects.get(id=self.attempt.id)
+        tasks.apply_element_values(self.attempt, {'cmi.core.lesson_status': 'incomplete'}, log_cursor='1:10')
+        with self.assertRaises(Exception):
+            tasks.apply_element_values(stale, {'cmi.core.lesson_status': 'failed'}, log_cursor='1:5')
+        self.attempt.refresh_from_db()
+        self.assertEqual(self.attempt.log_cursor, '1:10')
+        self.assertEqual(self.attempt.completion_status, 'incomplete')
+        self.assertEqual(self.attempt.scormelement_set.get().value, 'incomplete')
+
+    def test_write_behind_flush_keeps_cursor(self):
+        self.append('cmi.core.lesson_status', 'completed')
+        stale = SCORMAttempt.objects.get(id=self.attempt.id)
+        tasks.process_scorm_log_shard([self.candidate])
+        tasks.apply_element_values(stale, {'cmi.suspend_data': 'x'})
+        self.attempt.refresh_from_db()
+        self.assertEqual(self.attempt.log_cursor, '')
+        self.assertTrue(self.attempt.is_complete)
+
+
+@unittest.skipUnless(fakeredis, 'fakeredis is not installed')
+@override_settings(SCORM_PROGRESS_LOG_BACKEND='scorm_app.log_backends.FileSystemProgressLogBackend',
+                   SCORM_PROGRESS_LOG_BACKEND_OPTIONS={})
+class RuntimeCacheTests(TestCase):
+    def setUp(self):
+        logs_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, logs_dir)
+        settings_override = override_settings(SCORM_LOGS_DIR=logs_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        get_progress_log_backend.cache_clear()
+        self.addCleanup(get_progress_log_backend.cache_clear)
+        self.redis = fakeredis.FakeRedis()
+        patcher = mock.patch.object(runtime_cache, 'get_redis_connection', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.attempt = make_attempt()
+        self.key = f'scorm:runtime:{self.attempt.user_id}:{self.attempt.id}'
+
+    def test_one_hash_per_attempt(self):
+        runtime_cache.set_runtime_values(self.attempt.user_id, self.attempt.id, {'cmi.core.score.raw': 80})
+        self.assertEqual(self.redis.hgetall(self.key), {b'cmi.core.score.raw': b'80'})
+        self.assertEqual(self.redis.ttl(self.key), settings.SCORM_RUNTIME_CACHE_TTL)
+
+    def test_loaded_flag_marks_missing_elements_empty(self):
+        user_id, attempt_id = self.attempt.user_id, self.attempt.id
+        runtime_cache.set_runtime_values(user_id, attempt_id, {'cmi.core.lesson_status': 'incomplete'})
+        self.assertIsNone(runtime_cache.get_runtime_state(user_id, attempt_id))
+        self.assertEqual(runtime_cache.get_runtime_values(user_id, attempt_id, ['cmi.suspend_data']), ({}, False))
+        runtime_cache.load_runtime_state(user_id, attempt_id, {'cmi.core.score.raw': 80})
+        self.assertEqual(self.redis.hget(self.key, '__loaded__'), b'1')
+        self.assertEqual(runtime_cache.get_runtime_state(user_id, attempt_id),
+                         {'cmi.core.lesson_status': 'incomplete', 'cmi.core.score.raw': '80'})
+        self.assertEqual(runtime_cache.get_runtime_values(user_id, attempt_id, ['cmi.suspend_data']), ({}, True))
+
+    def test_access_refreshes_idle_ttl(self):
+        user_id, attempt_id = self.attempt.user_id, self.attempt.id
+        runtime_cache.load_runtime_state(user_id, attempt_id, {'cmi.core.score.raw': 80})
+        for read in (lambda: runtime_cache.get_runtime_values(user_id, attempt_id, ['cmi.core.score.raw']),
+                     lambda: runtime_cache.get_runtime_state(user_id, attempt_id)):
+            self.redis.expire(self.key, 10)
+            read()
+            self.assertEqual(self.redis.ttl(self.key), settings.SCORM_RUNTIME_CACHE_TTL)
+
+    def test_completed_attempt_is_evicted_after_processing(self):
+        user_id, attempt_id = self.attempt.user_id, self.attempt.id
+        runtime_cache.load_runtime_state(user_id, attempt_id, {})
+        backend = get_progress_log_backend()
+        backend.append(user_id, attempt_id, [make_entry('cmi.core.lesson_status', 'incomplete')])
+        tasks.process_log_file(user_id, attempt_id)
+        self.assertTrue(self.redis.exists(self.key))
+        backend.append(user_id, attempt_id, [make_entry('cmi.core.lesson_status', 'completed')])
+        tasks.process_log_file(user_id, attempt_id)
+        self.assertFalse(self.redis.exists(self.key))
+
+    def test_start_session_enqueues_warmup_once(self):
+        client = APIClient()
+        client.force_authenticate(self.attempt.user)
+        with mock.patch.object(views, 'warm_runtime_cache') as warm_runtime_cache:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(client.post(f'/api/attempts/{self.attempt.id}/start_session/').status_code, 200)
+            warm_runtime_cache.delay.assert_called_once_with(self.attempt.id)
+            runtime_cache.load_runtime_state(self.attempt.user_id, self.attempt.id, {})
+            with self.captureOnCommitCallbacks(execute=True):
+                client.post(f'/api/attempts/{self.attempt.id}/start_session/')
+            self.assertEqual(warm_runtime_cache.delay.call_count, 1)
+
+    def test_warmup_keeps_values_written_meanwhile(self):
+        user_id, attempt_id = self.attempt.user_id, self.attempt.id
+        SCORMElement.objects.create(scorm_attempt=self.attempt, element_id='cmi.suspend_data', value='old')
+        SCORMElement.objects.create(scorm_attempt=self.attempt, element_id='cmi.core.score.raw', value='80')
+        get_attempt_state = runtime_cache.get_attempt_state
+
+        def read_then_write(attempt):
+            state = get_attempt_state(attempt)
+            # The SCO writes before the warm load reaches Redis
+            runtime_cache.set_runtime_values(user_id, attempt_id, {'cmi.suspend_data': 'new'})
+            return state
+
+        with mock.patch.object(runtime_cache, 'get_attempt_state', side_effect=read_then_write):
+            self.assertTrue(tasks.warm_runtime_cache(attempt_id))
+        self.assertEqual(runtime_cache.get_runtime_state(user_id, attempt_id),
+                         {'cmi.suspend_data': 'new', 'cmi.core.score.raw': '80'})
+        self.assertFalse(tasks.warm_runtime_cache(attempt_id))
+
+
+@unittest.skipUnless(fakeredis, 'fakeredis is not installed')
+@override_settings(SCORM_PROGRESS_LOG_BACKEND='scorm_app.log_backends.FileSystemProgressLogBackend',
+                   SCORM_PROGRESS_LOG_BACKEND_OPTIONS={}, SCORM_RUNTIME_WRITE_MODE='write-behind')
+class WriteBehindTests(TestCase):
+    def setUp(self):
+        logs_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, logs_dir)
+        settings_override = override_settings(SCORM_LOGS_DIR=logs_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        get_progress_log_backend.cache_clear()
+        self.addCleanup(get_progress_log_backend.cache_clear)
+        self.redis = fakeredis.FakeRedis()
+        for module in (write_behind, runtime_cache, dirty_attempts):
+            patcher = mock.patch.object(module, 'get_redis_connection', return_value=self.redis)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        cache.clear()
+        self.attempt = make_attempt()
+        self.candidate = [str(self.attempt.user_id), str(self.attempt.id)]
+
+    def queue(self, values):
+        write_behind.queue_writes(self.attempt.user_id, self.attempt.id, values)
+
+    def element_values(self):
+        return dict(self.attempt.scormelement_set.values_list('element_id', 'value'))
+
+    def test_flush_merges_values_left_by_failed_flush(self):
+        self.queue({'cmi.suspend_data': 'a', 'cmi.core.lesson_location': '1'})
+        with mock.patch.object(tasks, 'apply_element_values', side_effect=Exception('database down')):
+            with self.assertRaises(Exception):
+                tasks.flush_pending_writes(self.attempt)
+        self.queue({'cmi.suspend_data': 'b'})
+        self.assertEqual(tasks.flush_pending_writes(self.attempt), 2)
+        self.assertEqual(self.element_values(), {'cmi.suspend_data': 'b', 'cmi.core.lesson_location': '1'})
+        self.assertFalse(write_behind.has_pending_writes(self.attempt.user_id, self.attempt.id))
+        self.assertEqual(list(write_behind.list_pending_attempts()), [])
+
+    def test_reconciliation_recovers_claimed_values_without_dirty_marker(self):
+        self.queue({'cmi.suspend_data': 'a'})
+        # A worker that died after popping the marker and claiming the values
+        dirty_attempts.pop_dirty_attempts(10)
+        write_behind.claim_pending_writes(self.attempt.user_id, self.attempt.id)
+        with mock.patch.object(tasks, 'chord') as chord:
+            self.assertEqual(tasks.process_scorm_logs(), 1)
+        self.assertEqual([list(shard.args[0]) for shard in chord.call_args[0][0]], [[self.candidate]])
+        self.assertEqual(tasks.process_scorm_log_shard([self.candidate])['processed'], 1)
+        self.assertEqual(self.element_values(), {'cmi.suspend_data': 'a'})
+        self.assertEqual(list(write_behind.list_pending_attempts()), [])
+
+    def test_index_member_without_values_is_pruned(self):
+        self.redis.sadd(write_behind.PENDING_INDEX_KEY, f'{self.attempt.user_id}:{self.attempt.id}')
+        self.assertEqual(tasks.process_scorm_log_shard([self.candidate])['skipped'], 1)
+        self.assertEqual(list(write_behind.list_pending_attempts()), [])
+
+
+class ResumableUploadTests(TestCase):
+    def setUp(self):
+        upload_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, upload_dir)
+        settings_override = override_settings(SCORM_UPLOAD_TEMP_DIR=upload_dir, SCORM_UPLOAD_MAX_SIZE=1024)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.upload_dir = upload_dir
+        self.user = User.objects.create_user('author', password='x')
+        self.course = Course.objects.create(title='Course')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def start(self, size):
+        return self.client.post('/api/scorm-packages/uploads/', {'course_id': self.course.id, 'size': size}, format='json')
+
+    def test_declared_size_is_capped(self):
+        self.assertEqual(self.start(1025).status_code, 413)
+        self.assertEqual(self.start(1024).status_code, 201)
+
+    def test_only_one_finalize_assembles_the_package(self):
+        upload_id = self.start(4).data['upload_id']
+        self.client.generic('PUT', f'/api/scorm-packages/uploads/{upload_id}/?offset=0', b'PK\x03\x04',
+                            content_type='application/octet-stream')
+        # Another request is already assembling it
+        PackageUpload.objects.filter(upload_id=upload_id).update(status='finalizing')
+        with mock.patch('scorm_app.views.ScormPackageViewSet._create_package') as create_package:
+            response = self.client.post(f'/api/scorm-packages/uploads/{upload_id}/finalize/', {}, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(create_package.called)
+        response = self.client.generic('PUT', f'/api/scorm-packages/uploads/{upload_id}/?offset=4', b'x',
+                                       content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 409)
+
+    def test_cleanup_removes_stale_uploads_and_orphans(self):
+        stale_id = self.start(10).data['upload_id']
+        fresh_id = self.start(10).data['upload_id']
+        PackageUpload.objects.filter(upload_id=stale_id).update(updated_at=timezone.now() - timedelta(days=2))
+        orphan = os.path.join(self.upload_dir, 'e4b1c0a4-0000-4000-8000-000000000000.part')
+        open(orphan, 'wb').close()
+        os.utime(orphan, (0, 0))
+        tasks.cleanup_stale_uploads()
+        self.assertEqual([str(upload_id) for upload_id in PackageUpload.objects.values_list('upload_id', flat=True)], [fresh_id])
+        self.assertEqual(os.listdir(self.upload_dir), [f'{fresh_id}.part'])
+
+
+class TaskStatusTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('author', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        self.package = ScormPackage.objects.create(file='scorm_packages/p.zip', version='1.2', manifest_path='imsmanifest.xml')
+        self.task = TaskResult.objects.create(task_id='task-1', status='PENDING')
+
+    def subscribe(self, *events):
+        """Replace the Redis subscription with one returning events in turn, recording the timeouts."""
+        events = list(events)
+        timeouts = []
+
+        @contextmanager
+        def subscribe_task_events(task_id):
+            def wait(timeout):
+                timeouts.append(timeout)
+                event = events.pop(0) if events else None
+                if event and event['status'] == 'SUCCESS':
+                    TaskResult.objects.filter(task_id=task_id).update(status='SUCCESS', result={'package_id': self.package.id})
+                return event
+            yield wait
+
+        patcher = mock.patch.object(views, 'subscribe_task_events', subscribe_task_events)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return timeouts
+
+    def test_long_poll_returns_on_event(self):
+        timeouts = self.subscribe({'status': 'SUCCESS'})
+        response = self.client.get('/api/scorm-packages/check_status/', {'task_id': 'task-1', 'wait': 60})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['id'], self.package.id)
+        self.assertEqual(timeouts, [settings.SCORM_STATUS_WAIT_MAX])
+
+    def test_long_poll_returns_pending_on_timeout(self):
+        timeouts = self.subscribe()
+        response = self.client.get('/api/scorm-packages/check_status/', {'task_id': 'task-1', 'wait': 2})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data, {'status': 'processing'})
+        self.assertEqual(timeouts, [2])
+
+    def test_finished_task_does_not_wait(self):
+        TaskResult.objects.filter(task_id='task-1').update(status='SUCCESS', result={'package_id': self.package.id})
+        timeouts = self.subscribe()
+        response = self.client.get('/api/scorm-packages/check_status/', {'task_id': 'task-1', 'wait': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(timeouts, [])
+
+    def test_stream_stops_after_terminal_event(self):
+        timeouts = self.subscribe({'status': 'PENDING', 'stage': 'extracting'}, None, {'status': 'SUCCESS'})
+        response = self.client.get('/api/scorm-packages/check_status/stream/', {'task_id': 'task-1'})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        messages = b''.join(response.streaming_content).decode().split('\n\n')[:-1]
+        self.assertEqual(messages[:3], [
+            'event: status\ndata: {"status": "processing"}',
+            'event: status\ndata: {"status": "processing", "progress": {"stage": "extracting"}}',
+            ': keep-alive',
+        ])
+        self.assertEqual(len(messages), 4)
+        self.assertEqual(json.loads(messages[3].split('data: ', 1)[1])['id'], self.package.id)
+        self.assertEqual(len(timeouts), 3)
+
+    @unittest.skipUnless(fakeredis, 'fakeredis is not installed')
+    def test_subscription_wait(self):
+        redis = fakeredis.FakeRedis()
+        with mock.patch.object(task_events, 'get_redis_connection', return_value=redis):
+            with task_events.subscribe_task_events('task-1') as next_event:
+                started = time.monotonic()
+                self.assertIsNone(next_event(0.2))
+                self.assertGreaterEqual(time.monotonic() - started, 0.2)
+                publisher = threading.Timer(0.1, task_events.publish_task_event, ['task-1', {'status': 'SUCCESS'}])
+                publisher.start()
+                started = time.monotonic()
+                self.assertEqual(next_event(10), {'status': 'SUCCESS'})
+                self.assertLess(time.monotonic() - started, 5)
+                publisher.join()
+
+
+class LaunchAccessTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.attempt = make_attempt()
+        package = self.attempt.scorm_package
+        package.launch_path = f'{package.get_extract_path()}index.html'
+        package.save()
+        self.url = f'/launch/{self.attempt.id}/'
+
+    def test_anonymous_launch_is_refused(self):
+        with mock.patch.object(views, 'create_runtime_token') as create_token:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(create_token.called)
+
+    def test_launch_of_another_learners_attempt_is_refused(self):
+        self.client.force_login(User.objects.create_user('other', password='x'))
+        with mock.patch.object(views, 'create_asset_grant') as create_grant:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(create_grant.called)
+
+    def test_learner_launch_uses_asset_grant(self):
+        self.client.force_login(self.attempt.user)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['launch_url'].startswith('/assets/'))
+
+    def test_package_content_requires_staff(self):
+        url = f'/content/{self.attempt.scorm_package_id}/index.html'
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.force_login(self.attempt.user)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+
+class AssetGrantTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.attempt = make_attempt()
+
+    def test_grant_is_scoped_to_the_learner_and_package(self):
+        target = resolve_asset_grant(create_asset_grant(self.attempt))
+        self.assertEqual(target['package_id'], self.attempt.scorm_package_id)
+        self.assertEqual(target['user_id'], self.attempt.user_id)
+
+    def test_launches_within_a_window_share_the_grant(self):
+        grant = create_asset_grant(self.attempt)
+        again = SCORMAttempt.objects.create(user=self.attempt.user, scorm_package=self.attempt.scorm_package)
+        self.assertEqual(create_asset_grant(again), grant)
+        other = SCORMAttempt.objects.create(user=User.objects.create_user('other', password='x'),
+                                            scorm_package=self.attempt.scorm_package)
+        self.assertNotEqual(create_asset_grant(other), grant)
+
+    def test_grant_is_rebuilt_from_its_signature(self):
+        grant = create_asset_grant(self.attempt)
+        cache.clear()
+        with mock.patch.object(asset_grants.cache, 'set') as cache_set:
+            self.assertEqual(resolve_asset_grant(grant)['package_id'], self.attempt.scorm_package_id)
+        # Cached for what remains of the grant's life, never beyond it
+        timeout = cache_set.call_args.kwargs['timeout']
+        self.assertLessEqual(timeout, settings.SCORM_ASSET_GRANT_MAX_AGE)
+        self.assertLessEqual(abs(time.time() + timeout - asset_grants.grant_expiry(time.time())), 1)
+
+    def test_expired_grant_is_rejected(self):
+        grant = create_asset_grant(self.attempt)
+        cache.clear()
+        later = time.time() + settings.SCORM_ASSET_GRANT_MAX_AGE
+        with mock.patch.object(asset_grants.time, 'time', return_value=later):
+            self.assertIsNone(resolve_asset_grant(grant))
+
+    def test_tampered_grant_is_rejected(self):
+        grant = create_asset_grant(self.attempt)
+        self.assertIsNone(resolve_asset_grant(grant[:-1] + ('A' if grant[-1] != 'A' else 'B')))
+        self.assertEqual(self.client.get(f'/assets/{grant}x/index.html').status_code, 403)
+
+
+class AuthoringFieldTests(SimpleTestCase):
+    def test_sniffed_values_fit_their_columns(self):
+        package = ScormPackage()
+        self.assertEqual(len(tasks.truncate_to_field(package, 'authoring_tool', 'x' * 500)), 100)
+        self.assertEqual(len(tasks.truncate_to_field(package, 'authoring_tool_version', '1.' * 100)), 50)
+        self.assertEqual(tasks.truncate_to_field(package, 'authoring_tool_version', None), '')
+
+
+class TokenAuthenticationCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        _local_cache.clear()
+        self.addCleanup(_local_cache.clear)
+        self.user = User.objects.create_user('learner', password='secret')
+        self.token = Token.objects.create(user=self.user)
+        self.authentication = views.CustomTokenAuthentication()
+
+    def test_only_the_user_id_is_cached(self):
+        user, _ = self.authentication.authenticate_credentials(self.token.key)
+        self.assertEqual(user, self.user)
+        self.assertEqual(cache.get(token_cache_key(self.token.key)), self.user.id)
+
+    def test_cached_authentication_needs_no_query(self):
+        self.authentication.authenticate_credentials(self.token.key)
+        with self.assertNumQueries(0):
+            user, token = self.authentication.authenticate_credentials(self.token.key)
+            self.assertTrue(user and user.is_authenticated)
+            self.assertEqual((user.id, token.key), (self.user.id, self.token.key))
+        self.assertEqual(user.username, 'learner')
+
+    def test_bulk_deactivation_is_invalidated_explicitly(self):
+        self.authentication.authenticate_credentials(self.token.key)
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        # No signal fires; the entry stands until it expires or is dropped
+        self.assertEqual(self.authentication.authenticate_credentials(self.token.key)[0].id, self.user.id)
+        invalidate_user_tokens([self.user.pk])
+        self.assertIsNone(cache.get(token_cache_key(self.token.key)))
+        with self.assertRaises(AuthenticationFailed):
+            self.authentication.authenticate_credentials(self.token.key)
+
+    def test_cached_user_id_expires(self):
+        with mock.patch('scorm_app.auth_cache.cache') as shared_cache:
+            self.authentication.authenticate_credentials(self.token.key)
+        shared_cache.set.assert_called_once_with(token_cache_key(self.token.key), self.user.id,
+                                                 timeout=settings.SCORM_AUTH_CACHE_TTL)
+
+    def test_last_login_does_not_invalidate(self):
+        self.authentication.authenticate_credentials(self.token.key)
+        self.user.save(update_fields=['last_login'])
+        self.assertEqual(cache.get(token_cache_key(self.token.key)), self.user.id)
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsNone(cache.get(token_cache_key(self.token.key)))
+
+    def test_session_login_with_cached_token(self):
+        attempt = SCORMAttempt.objects.create(user=self.user, scorm_package=make_attempt('other').scorm_package)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        for _ in range(2):
+            response = client.post(f'/api/attempts/{attempt.id}/start_session/')
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(cache.get(token_cache_key(self.token.key)), self.user.id)
+
+
+class BatchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        logs_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, logs_dir)
+        settings_override = override_settings(SCORM_LOGS_DIR=logs_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.attempt = make_attempt()
+        self.client = APIClient()
+        self.client.force_authenticate(self.attempt.user)
+        patcher = mock.patch.object(views, 'append_entries_to_log')
+        self.append_entries_to_log = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def send(self, operations):
+        return self.client.post('/api/scorm-api/batch/', {'attempt_id': self.attempt.id, 'operations': operations},
+                                format='json')
+
+    def test_operations_apply_in_order(self):
+        SCORMElement.objects.create(scorm_attempt=self.attempt, element_id='cmi.core.lesson_location', value='stored')
+        response = self.send([
+            {'op': 'get', 'element_id': 'cmi.core.lesson_location'},
+            {'op': 'set', 'element_id': 'cmi.core.lesson_location', 'value': 'page-2'},
+            {'op': 'get', 'element_id': 'cmi.core.lesson_location'},
+            {'op': 'get', 'element_id': 'cmi.suspend_data'},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], [
+            {'element_id': 'cmi.core.lesson_location', 'value': 'stored'},
+            {'element_id': 'cmi.core.lesson_location', 'success': True},
+            {'element_id': 'cmi.core.lesson_location', 'value': 'page-2'},
+            {'element_id': 'cmi.suspend_data', 'value': ''},
+        ])
+        self.append_entries_to_log.assert_called_once_with(
+            self.attempt.user_id, self.attempt.id, [{'element_id': 'cmi.core.lesson_location', 'value': 'page-2'}],
+        )
+
+    def test_invalid_operations_are_rejected(self):
+        for operations in ([], [{'op': 'delete', 'element_id': 'cmi.suspend_data'}],
+                           [{'op': 'set', 'element_id': 'cmi.suspend_data'}]):
+            self.assertEqual(self.send(operations).status_code, 400)
+        self.append_entries_to_log.assert_not_called()
+
+    @override_settings(SCORM_API_BATCH_MAX_OPERATIONS=2)
+    def test_batch_size_is_capped(self):
+        self.assertEqual(self.send([{'op': 'get', 'element_id': 'cmi.suspend_data'}] * 3).status_code, 400)
+
+
+class BatchSequenceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.attempt = make_attempt()
+        self.client = APIClient()
+        self.client.force_authenticate(self.attempt.user)
+        patcher = mock.patch.object(views, 'append_entries_to_log')
+        self.append_entries_to_log = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def send(self, sequence, client_session='session-1', value='1'):
+        return self.client.post('/api/scorm-api/batch/', {
+            'attempt_id': self.attempt.id, 'client_session': client_session, 'sequence': sequence,
+            'operations': [{'op': 'set', 'element_id': 'cmi.core.lesson_location', 'value': value}],
+        }, format='json')
+
+    def test_retried_batch_is_not_written_twice(self):
+        first = self.send(1)
+        self.assertEqual(first.data['duplicate'], False)
+        retry = self.send(1)
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.data['duplicate'], True)
+        self.assertEqual(retry.data['results'], [{'element_id': 'cmi.core.lesson_location', 'success': True}])
+        self.assertEqual(self.append_entries_to_log.call_count, 1)
+
+    def test_sequences_are_tracked_per_client_session(self):
+        self.send(1)
+        self.send(2, value='2')
+        self.assertTrue(self.send(1).data['duplicate'])
+        self.assertFalse(self.send(1, client_session='session-2').data['duplicate'])
+        self.assertEqual(self.append_entries_to_log.call_count, 3)
+
+    def test_sequence_requires_client_session(self):
+        response = self.send(1, client_session=None)
+        self.assertEqual(response.status_code, 400)
+        self.append_entries_to_log.assert_not_called()
+
+
+class RangeHeaderTests(SimpleTestCase):
+    def test_ranges(self):
+        self.assertEqual(parse_range_header('bytes=0-99', 1000), (0, 99))
+        self.assertEqual(parse_range_header('bytes=900-', 1000), (900, 999))
+        self.assertEqual(parse_range_header('bytes=990-2000', 1000), (990, 999))
+        self.assertEqual(parse_range_header('bytes=-100', 1000), (900, 999))
+        self.assertEqual(parse_range_header('bytes=-2000', 1000), (0, 999))
+
+    def test_ignored_headers(self):
+        self.assertIsNone(parse_range_header(None, 1000))
+        self.assertIsNone(parse_range_header('bytes=-', 1000))
+        self.assertIsNone(parse_range_header('items=0-1', 1000))
+        self.assertIsNone(parse_range_header('bytes=0-1,5-6', 1000))
+
+    def test_unsatisfiable_ranges(self):
+        with self.assertRaises(ValueError):
+            parse_range_header('bytes=1000-', 1000)
+        with self.assertRaises(ValueError):
+            parse_range_header('bytes=5-2', 1000)
+
+
+class PrecompressionTests(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def write(self, name, data):
+        path = os.path.join(self.root, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_accept_encoding(self):
+        self.assertEqual(parse_accept_encoding('gzip;q=0.5, br'), {'gzip', 'br'})
+        self.assertEqual(parse_accept_encoding('br;q=0, GZIP'), {'gzip'})
+        self.assertEqual(parse_accept_encoding('gzip, identity;q=0'), {'gzip'})
+        self.assertEqual(parse_accept_encoding('*, gzip;q=0'), {'*', 'br'})
+        self.assertEqual(parse_accept_encoding('gzip;q=x'), set())
+        self.assertEqual(parse_accept_encoding(None), set())
+
+    def test_keeps_only_smaller_variants(self):
+        text = self.write('index.js', b'var a = 1;\n' * 200)
+        noise = self.write('noise.txt', os.urandom(2048))
+        small = self.write('small.css', b'a{}')
+        image = self.write('image.png', b'\0' * 2048)
+        self.assertEqual(precompress_package(self.root), 1)
+        self.assertTrue(os.path.isfile(text + '.gz'))
+        for path in (noise, small, image):
+            self.assertFalse(os.path.exists(path + '.gz'))
+        self.assertFalse(any(name.endswith('.tmp') for name in os.listdir(self.root)))
+
+
+class PackageAssetResponseTests(SimpleTestCase):
+    body = b'0123456789' * 300
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        archive_path = os.path.join(self.root, 'package.zip')
+        with zipfile.ZipFile(archive_path, 'w') as zip_ref:
+            zip_ref.writestr('sco/stored.txt', self.body, compress_type=zipfile.ZIP_STORED)
+            zip_ref.writestr('sco/deflated.txt', self.body, compress_type=zipfile.ZIP_DEFLATED)
+        extract_path = os.path.join(self.root, 'extracted')
+        os.makedirs(os.path.join(extract_path, 'sco'))
+        with open(os.path.join(extract_path, 'sco', 'index.txt'), 'wb') as f:
+            f.write(self.body)
+        self.archive_target = {'package_id': 1, 'is_extracted': False, 'archive_path': archive_path}
+        self.extracted_target = {'package_id': 1, 'is_extracted': True, 'extract_path': extract_path}
+
+    def get(self, target, path, **headers):
+        request = RequestFactory().get('/', headers=headers)
+        return views._serve_package_asset(request, target, path)
+
+    def content(self, response):
+        if getattr(response, 'streaming', False):
+            return b''.join(response.streaming_content)
+        return response.content
+
+    def test_range_from_archive(self):
+        for path in ('sco/stored.txt', 'sco/deflated.txt'):
+            response = self.get(self.archive_target, path, Range='bytes=1495-1504')
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(response['Content-Range'], f'bytes 1495-1504/{len(self.body)}')
+            self.assertEqual(self.content(response), self.body[1495:1505])
+
+    def test_range_from_extraction(self):
+        response = self.get(self.extracted_target, 'sco/index.txt', Range='bytes=-10')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(self.content(response), self.body[-10:])
+        response = self.get(self.extracted_target, 'sco/index.txt')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(self.content(response), self.body)
+
+    def test_unsatisfiable_range(self):
+        response = self.get(self.archive_target, 'sco/stored.txt', Range=f'bytes={len(self.body)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.body)}')
+
+    def test_conditional_get(self):
+        for target, path in ((self.archive_target, 'sco/deflated.txt'), (self.extracted_target, 'sco/index.txt')):
+            etag = self.get(target, path)['ETag']
+            response = self.get(target, path, If_None_Match=f'"other", {etag}')
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response['ETag'], etag)
+            self.assertTrue(response['Cache-Control'].startswith('private,'))
+
+    def test_precompressed_variant(self):
+        index_path = os.path.join(self.root, 'extracted', 'sco', 'index.txt')
+        for suffix, data in (('.gz', b'gzip body'), ('.br', b'br body')):
+            with open(index_path + suffix, 'wb') as f:
+                f.write(data)
+        identity_etag = self.get(self.extracted_target, 'sco/index.txt')['ETag']
+        with mock.patch.object(views, 'get_supported_encodings', return_value=['br', 'gzip']):
+            response = self.get(self.extracted_target, 'sco/index.txt', Accept_Encoding='gzip, br')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Encoding'], 'br')
+            self.assertEqual(response['Vary'], 'Accept-Encoding')
+            self.assertEqual(self.content(response), b'br body')
+            self.assertNotEqual(response['ETag'], identity_etag)
+            not_modified = self.get(self.extracted_target, 'sco/index.txt', Accept_Encoding='gzip, br',
+                                    If_None_Match=response['ETag'])
+            self.assertEqual(not_modified.status_code, 304)
+            self.assertEqual(not_modified['Vary'], 'Accept-Encoding')
+            # The identity variant is not revalidated by the br ETag
+            response = self.get(self.extracted_target, 'sco/index.txt', If_None_Match=response['ETag'])
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('Content-Encoding', response)
+            response = self.get(self.extracted_target, 'sco/index.txt', Accept_Encoding='gzip')
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            self.assertEqual(self.content(response), b'gzip body')
+
+    def test_offload_hands_over_identity_file(self):
+        with open(os.path.join(self.root, 'extracted', 'sco', 'index.txt.gz'), 'wb') as f:
+            f.write(b'compressed')
+        with override_settings(SCORM_ASSET_DELIVERY='x-accel-redirect', SCORM_ASSET_ACCEL_ROOT=self.root,
+                               SCORM_ASSET_ACCEL_PREFIX='/protected-media/'):
+            response = self.get(self.extracted_target, 'sco/index.txt', Accept_Encoding='gzip')
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/extracted/sco/index.txt')
+        self.assertNotIn('Content-Encoding', response)
+        self.assertTrue(response['Cache-Control'].startswith('private,'))
+
+
+SCORM_12_MANIFEST = b"""<?xml version="1.0"?>
+<manifest identifier="M" xmlns="http://www.imsproject.org/xsd/imscp_rootv1p1p2"
+          xmlns:adlcp="http://www.adlnet.org/xsd/adlcp_rootv1p2">
+  <metadata><schema>ADL SCORM</schema><schemaversion>1.2</schemaversion></metadata>
+  <organizations default="ORG-2">
+    <organization identifier="ORG-1"><title>First</title>
+      <item identifier="I-1" identifierref="RES-1"><title>Other</title></item>
+    </organization>
+    <organization identifier="ORG-2"><title>Course</title>
+      <item identifier="I-2"><title>Module</title>
+        <item identifier="I-3" identifierref="RES-2" parameters="?page=1" isvisible="false"><title>Lesson</title></item>
+      </item>
+    </organization>
+  </organizations>
+  <resources xml:base="content/">
+    <resource identifier="RES-1" type="webcontent" adlcp:scormtype="sco" href="other.html"/>
+    <resource identifier="RES-2" type="webcontent" adlcp:scormtype="sco" href="index.html?lang=en">
+      <file href="index.html"/><dependency identifierref="RES-1"/>
+    </resource>
+  </resources>
+</manifest>
+"""
+
+
+class ManifestParserTests(SimpleTestCase):
+    def test_parses_organizations_and_resources(self):
+        manifest = parse_manifest(io.BytesIO(SCORM_12_MANIFEST))
+        self.assertEqual(manifest['scorm_version'], '1.2')
+        self.assertEqual(manifest['default_organization'], 'ORG-2')
+        self.assertEqual(manifest['organizations'][1], {
+            'identifier': 'ORG-2', 'title': 'Course', 'items': [
+                {'identifier': 'I-2', 'title': 'Module', 'children': [
+                    {'identifier': 'I-3', 'identifierref': 'RES-2', 'parameters': '?page=1', 'is_visible': False,
+                     'title': 'Lesson'},
+                ]},
+            ],
+        })
+        self.assertEqual(manifest['resources']['RES-2'],
+                         {'href': 'index.html?lang=en', 'scorm_type': 'sco', 'dependencies': ['RES-1']})
+
+    def test_launch_href_uses_default_organization(self):
+        manifest = parse_manifest(io.BytesIO(SCORM_12_MANIFEST))
+        self.assertEqual(get_launch_href(manifest), 'content/index.html?lang=en&page=1')
+
+    def test_scorm_2004_version_from_namespace(self):
+        manifest = parse_manifest(io.BytesIO(
+            b'<manifest xmlns="http://www.imsglobal.org/xsd/imscp_v1p1" xmlns:adlcp="http://www.adlnet.org/xsd/adlcp_v1p3">'
+            b'<metadata><adlcp:location>meta.xml</adlcp:location></metadata><organizations/>'
+            b'<resources><resource identifier="R" adlcp:scormType="SCO" href="a.html"/></resources>'
+            b'</manifest>'
+        ))
+        self.assertEqual(manifest['scorm_version'], '2004')
+        self.assertEqual(manifest['resources']['R']['scorm_type'], 'sco')
+        with self.assertRaises(ValueError):
+            get_launch_href(manifest)
+
+
+class ArchiveLimitTests(SimpleTestCase):
+    def make_archive(self, members, compression=zipfile.ZIP_DEFLATED):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', compression) as zip_ref:
+            for name, data in members.items():
+                zip_ref.writestr(name, data)
+        return zipfile.ZipFile(buffer)
+
+    def test_returns_total_size(self):
+        zip_ref = self.make_archive({'index.html': b'x' * 10, 'empty.txt': b''})
+        self.assertEqual(check_archive_limits(zip_ref), 10)
+
+    @override_settings(SCORM_EXTRACT_MAX_MEMBERS=2)
+    def test_member_count(self):
+        with self.assertRaises(PackageLimitError):
+            check_archive_limits(self.make_archive({f'{i}.txt': b'x' for i in range(3)}))
+
+    @override_settings(SCORM_EXTRACT_MAX_TOTAL_SIZE=100)
+    def test_total_size(self):
+        with self.assertRaises(PackageLimitError):
+            check_archive_limits(self.make_archive({'a.txt': b'x' * 60, 'b.txt': b'x' * 60}, zipfile.ZIP_STORED))
+
+    def test_compression_ratio(self):
+        zip_ref = self.make_archive({'bomb.bin': b'\0' * (8 * 1024 * 1024)})
+        with self.assertRaises(PackageLimitError):
+            check_archive_limits(zip_ref)
+        # Highly compressible members under 1 MiB are let through
+        self.assertEqual(check_archive_limits(self.make_archive({'blank.bin': b'\0' * 1024})), 1024)
+
+
+class RuntimeTokenTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.attempt = make_attempt()
+        self.client = APIClient()
+        patcher = mock.patch.object(views, 'append_entries_to_log')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def batch(self, token, attempt_id=None):
+        return self.client.post('/api/scorm-api/batch/', {
+            'attempt_id': attempt_id or self.attempt.id,
+            'operations': [{'op': 'set', 'element_id': 'cmi.core.lesson_location', 'value': '1'}],
+        }, format='json', HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_token_carries_learner_and_attempt(self):
+        user = decode_runtime_token(create_runtime_token(self.attempt))
+        self.assertEqual((user.id, user.attempt_id), (self.attempt.user_id, self.attempt.id))
+        self.assertEqual(self.batch(create_runtime_token(self.attempt)).status_code, 200)
+
+    def test_expired_token_is_rejected(self):
+        with override_settings(SCORM_RUNTIME_TOKEN_MAX_AGE=-1):
+            token = create_runtime_token(self.attempt)
+        with self.assertRaises(jwt.ExpiredSignatureError):
+            decode_runtime_token(token)
+        self.assertEqual(self.batch(token).status_code, 401)
+
+    def test_forged_token_is_rejected(self):
+        with override_settings(SECRET_KEY='another-secret'):
+            token = create_runtime_token(self.attempt)
+        self.assertEqual(self.batch(token).status_code, 401)
+
+    def test_token_is_scoped_to_its_attempt(self):
+        other = SCORMAttempt.objects.create(user=self.attempt.user, scorm_package=self.attempt.scorm_package)
+        self.assertEqual(self.batch(create_runtime_token(self.attempt), attempt_id=other.id).status_code, 404)
+
+    def test_refresh_token(self):
+        response = self.client.post('/api/scorm-api/refresh_token/', {}, format='json',
+                                    HTTP_AUTHORIZATION=f'Bearer {create_runtime_token(self.attempt)}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(decode_runtime_token(response.data['token']).attempt_id, self.attempt.id)
+
+    def test_refresh_is_refused_to_inactive_learner(self):
+        token = create_runtime_token(self.attempt)
+        User.objects.filter(id=self.attempt.user_id).update(is_active=False)
+        response = self.client.post('/api/scorm-api/refresh_token/', {}, format='json', HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, 403)
@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import UserViewSet, CourseViewSet, ScormPackageViewSet, UserCourseRegistrationViewSet, SCORMAttemptViewSet, SCORMElementViewSet, SCORMAPIViewSet, ReportingViewSet, launch_scorm, test_connection, landing_page
+from .views import UserViewSet, CourseViewSet, ScormPackageViewSet, UserCourseRegistrationViewSet, SCORMAttemptViewSet, SCORMElementViewSet, SCORMAPIViewSet, ReportingViewSet, launch_scorm, package_asset, package_content, test_connection, landing_page
 from rest_framework.authtoken.views import obtain_auth_token
 
 router = DefaultRouter()
@@ -22,4 +22,6 @@ urlpatterns = [
 
     path('launch/<int:attempt_id>/', launch_scorm, name='launch_scorm'),
     path('launch/', launch_scorm, name='launch_scorm_external'),
+    path('content/<int:package_id>/<path:path>', package_content, name='package_content'),
+    path('assets/<str:grant>/<path:path>', package_asset, name='package_asset'),
 ]
\ No newline at end of file
@@ -8,26 +8,53 @@ from rest_framework.authtoken.models import Token
 from django.shortcuts import get_object_or_404, render
 from django.contrib.auth import login, logout
 from django.contrib.auth.models import User
-from django.http import HttpResponseBadRequest
+from django.http import FileResponse, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseNotModified, Http404, StreamingHttpResponse
+from django.core.files import File
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.http import http_date
 from celery.result import AsyncResult
 from django.db import transaction
-from .models import Course, ScormPackage, UserCourseRegistration, SCORMAttempt, SCORMElement, TaskResult
+from .models import Course, ScormPackage, PackageUpload, UserCourseRegistration, SCORMAttempt, SCORMElement, TaskResult
 from .serializers import (
     CourseSerializer, ScormPackageSerializer, UserCourseRegistrationSerializer,
     SCORMAttemptSerializer, SCORMElementSerializer, UserSerializer
 )
 from rest_framework.authentication import TokenAuthentication
 from rest_framework.exceptions import AuthenticationFailed, ValidationError
-from .tasks import process_scorm_package
+from .tasks import flush_pending_writes, process_scorm_package, warm_runtime_cache
 from celery.states import PENDING, SUCCESS, FAILURE, REVOKED
 import jwt
 from django.conf import settings
 from datetime import datetime
 import os
+import json
+import time
+import zlib
+import hashlib
+import mimetypes
+import calendar
 from django.urls import reverse
 from django.shortcuts import redirect
 from django.views.decorators.clickjacking import xframe_options_exempt
-from .utils import append_to_log, read_log
+from .utils import append_entries_to_log, read_snapshot
+from .package_files import (
+    PRECOMPRESSED_SUFFIXES, get_archive_index, get_supported_encodings, iter_file_range,
+    parse_accept_encoding, parse_range_header,
+)
+from .auth_cache import TokenUser, cache_user_id, get_cached_user_id
+from .runtime_cache import (
+    get_attempt_state, get_runtime_state, get_runtime_values, is_runtime_state_loaded, load_runtime_state,
+    read_pending_values, set_runtime_values,
+)
+from .write_behind import is_write_behind, queue_writes, should_flush_on_write
+from .runtime_tokens import RuntimeUser, create_runtime_token, decode_runtime_token, looks_like_runtime_token
+from .task_events import subscribe_task_events
+from .asset_grants import create_asset_grant, get_asset_target, resolve_asset_grant
+from .package_storage import (
+    HashingUploadHandler, acquire_package_content, copy_processed_package, find_processed_package,
+    hash_file, release_package_content,
+)
 from django.core.cache import cache
 
 logger = logging.getLogger(__name__)
@@ -56,7 +83,35 @@ class CustomTokenAuthentication(TokenAuthentication):
             raise AuthenticationFailed(msg)
 
         return self.authenticate_credentials(token)
-    
+
+    def authenticate_credentials(self, key):
+        # Served from the local LRU or Redis; see auth_cache.py for invalidation
+        user_id = get_cached_user_id(key)
+        if user_id is None:
+            user, token = super().authenticate_credentials(key)
+            cache_user_id(key, user.id)
+            return (user, token)
+        return (TokenUser(user_id), Token(key=key, user_id=user_id))
+
+class RuntimeTokenAuthentication(TokenAuthentication):
+    """Authenticate the player's attempt-scoped runtime token from its signature alone.
+
+    Anything that is not a runtime token is left to CustomTokenAuthentication.
+    """
+    keyword = 'Bearer'
+
+    def authenticate(self, request):
+        auth = request.headers.get('Authorization', '').split()
+        if len(auth) != 2 or auth[0].lower() not in ['token', 'bearer'] or not looks_like_runtime_token(auth[1]):
+            return None
+        try:
+            user = decode_runtime_token(auth[1])
+        except jwt.ExpiredSignatureError:
+            raise AuthenticationFailed('Runtime token has expired.')
+        except jwt.InvalidTokenError:
+            raise AuthenticationFailed('Invalid runtime token.')
+        return (user, auth[1])
+
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def test_connection(request):
@@ -188,9 +243,49 @@ class ScormPackageViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
     authentication_classes = [CustomTokenAuthentication]
 
+    def _create_package(self, course, file, user):
+        """Store an uploaded archive and start processing it, returning (package, task_id)."""
+        digest = hash_file(file)
+        with transaction.atomic():
+            content = acquire_package_content(file, digest)
+            package = ScormPackage.objects.create(
+                course=course,
+                file=content.file.name,
+                content=content,
+                status='uploaded',
+                created_by=user
+            )
+            
+            # Generate a task ID
+            task_id = uuid.uuid4().hex
+            
+            # A known archive reuses the results of an earlier upload
+            source = find_processed_package(content, exclude_id=package.id)
+            if source:
+                copy_processed_package(source, package)
+                TaskResult.objects.create(
+                    task_id=task_id,
+                    status='SUCCESS',
+                    result={'package_id': package.id},
+                    date_done=timezone.now()
+                )
+                logger.info(f"SCORM package {package.id} reuses processed content {digest} from package {source.id}")
+            else:
+                # Create TaskResult entry
+                TaskResult.objects.create(
+                    task_id=task_id,
+                    status='PENDING'
+                )
+                
+                # Trigger the processing task with the task_id once the package is committed
+                transaction.on_commit(lambda: process_scorm_package.apply_async(args=[package.id, task_id], task_id=task_id))
+        return package, task_id
+
     @action(detail=False, methods=['post'])
     def upload_package(self, request):
         logger.info("Attempting to upload a SCORM package")
+        # Hash the archive while it is spooled to disk, before request.data is parsed
+        request.upload_handlers.insert(0, HashingUploadHandler(request))
         try:
             course_id = request.data.get('course_id')
             file = request.FILES.get('file')
@@ -205,26 +300,7 @@ class ScormPackageViewSet(viewsets.ModelViewSet):
                 logger.error(f"Course with id {course_id} not found")
                 return Response({'error': 'Course not found.'}, status=status.HTTP_404_NOT_FOUND)
             
-            with transaction.atomic():
-                package = ScormPackage.objects.create(
-                    course=course,
-                    file=file,
-                    status='uploaded',
-                    created_by=request.user
-                )
-                
-                # Generate a task ID
-                task_id = uuid.uuid4().hex
-                
-                # Create TaskResult entry
-                TaskResult.objects.create(
-                    task_id=task_id,
-                    status='PENDING'
-                )
-                
-                # Trigger the processing task with the task_id
-                process_scorm_package.apply_async(args=[package.id, task_id], task_id=task_id)
-            
+            package, task_id = self._create_package(course, file, request.user)
             serializer = self.get_serializer(package)
             logger.info(f"SCORM package uploaded successfully for course: {course_id}")
             return Response({
@@ -237,39 +313,185 @@ class ScormPackageViewSet(viewsets.ModelViewSet):
             return Response({'error': 'An unexpected error occurred while uploading the package.'}, 
                             status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    def _get_upload(self, request, upload_id):
+        return get_object_or_404(PackageUpload, upload_id=upload_id, created_by=request.user)
+
+    def _upload_state(self, upload):
+        return {
+            'upload_id': str(upload.upload_id),
+            'size': upload.size,
+            'offset': upload.offset,
+            'crc32': upload.crc32,
+        }
+
+    @action(detail=False, methods=['post'], url_path='uploads')
+    def init_upload(self, request):
+        """Start a resumable upload; chunks are then sent with PUT to uploads/{upload_id}/."""
+        course_id = request.data.get('course_id')
+        filename = request.data.get('filename') or 'package.zip'
+        try:
+            size = int(request.data.get('size'))
+        except (TypeError, ValueError):
+            size = -1
+        if not course_id or size <= 0:
+            return Response({'error': 'course_id and a positive size are required.'}, status=status.HTTP_400_BAD_REQUEST)
+        if size > settings.SCORM_UPLOAD_MAX_SIZE:
+            return Response({'error': f'Packages may not exceed {settings.SCORM_UPLOAD_MAX_SIZE} bytes.'},
+                            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        try:
+            course = Course.objects.get(id=course_id)
+        except Course.DoesNotExist:
+            logger.error(f"Course with id {course_id} not found")
+            return Response({'error': 'Course not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+        upload = PackageUpload.objects.create(course=course, created_by=request.user, filename=os.path.basename(filename)[:255], size=size)
+        os.makedirs(settings.SCORM_UPLOAD_TEMP_DIR, exist_ok=True)
+        open(upload.get_temp_path(), 'wb').close()
+        logger.info(f"Started upload {upload.upload_id} of {size} bytes for course {course_id}")
+        state = self._upload_state(upload)
+        state['max_chunk_size'] = settings.SCORM_UPLOAD_MAX_CHUNK_SIZE
+        return Response(state, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['get', 'put'], url_path=r'uploads/(?P<upload_id>[0-9a-f-]+)')
+    def upload_chunk(self, request, upload_id=None):
+        """GET returns the offset to resume from; PUT appends the raw request body at ?offset=."""
+        if request.method == 'GET':
+            return Response(self._upload_state(self._get_upload(request, upload_id)))
+
+        try:
+            offset = int(request.query_params.get('offset'))
+            length = int(request.headers.get('Content-Length') or 0)
+        except (TypeError, ValueError):
+            return Response({'error': 'An integer offset query parameter is required.'}, status=status.HTTP_400_BAD_REQUEST)
+        if length <= 0 or length > settings.SCORM_UPLOAD_MAX_CHUNK_SIZE:
+            return Response({'error': f'Chunks must be between 1 and {settings.SCORM_UPLOAD_MAX_CHUNK_SIZE} bytes.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            upload = get_object_or_404(PackageUpload.objects.select_for_update(), upload_id=upload_id, created_by=request.user)
+            if upload.status != 'uploading':
+                return Response(dict(self._upload_state(upload), error='Upload is being finalized.'), status=status.HTTP_409_CONFLICT)
+            if offset != upload.offset:
+                # The client resumes from the returned offset
+                return Response(dict(self._upload_state(upload), error='Offset does not match the bytes received.'),
+                                status=status.HTTP_409_CONFLICT)
+            if offset + length > upload.size:
+                return Response({'error': 'Chunk extends past the declared size.'}, status=status.HTTP_400_BAD_REQUEST)
+
+            crc = upload.crc32
+            received = 0
+            with open(upload.get_temp_path(), 'r+b') as f:
+                f.seek(offset)
+                while received < length:
+                    data = request.stream.read(min(64 * 1024, length - received))
+                    if not data:
+                        break
+                    f.write(data)
+                    crc = zlib.crc32(data, crc)
+                    received += len(data)
+                # Drop anything left behind by an interrupted earlier attempt
+                f.truncate()
+            if received != length:
+                return Response(dict(self._upload_state(upload), error='Incomplete chunk.'), status=status.HTTP_400_BAD_REQUEST)
+            upload.offset += received
+            upload.crc32 = crc
+            upload.save(update_fields=['offset', 'crc32', 'updated_at'])
+        return Response(self._upload_state(upload))
+
+    @action(detail=False, methods=['post'], url_path=r'uploads/(?P<upload_id>[0-9a-f-]+)/finalize')
+    def finalize_upload(self, request, upload_id=None):
+        """Verify a complete upload and hand it off to process_scorm_package."""
+        upload = self._get_upload(request, upload_id)
+        if upload.offset != upload.size:
+            return Response(dict(self._upload_state(upload), error='Upload is incomplete.'), status=status.HTTP_409_CONFLICT)
+        expected_crc = request.data.get('crc32')
+        if expected_crc is not None and str(expected_crc) != str(upload.crc32):
+            return Response(dict(self._upload_state(upload), error='Checksum mismatch.'), status=status.HTTP_400_BAD_REQUEST)
+
+        # Only one of several concurrent finalize requests gets to assemble the package
+        claimed = PackageUpload.objects.filter(pk=upload.pk, status='uploading', offset=upload.size).update(status='finalizing')
+        if not claimed:
+            return Response(dict(self._upload_state(upload), error='Upload is already being finalized.'), status=status.HTTP_409_CONFLICT)
+
+        try:
+            temp_path = upload.get_temp_path()
+            with open(temp_path, 'rb') as f:
+                package, task_id = self._create_package(upload.course, File(f, name=upload.filename), request.user)
+            upload.delete()
+            os.remove(temp_path)
+        except Exception as e:
+            logger.exception(f"Error finalizing upload {upload_id}: {str(e)}")
+            # The client may finalize again
+            PackageUpload.objects.filter(pk=upload.pk).update(status='uploading')
+            return Response({'error': 'An unexpected error occurred while uploading the package.'},
+                            status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        logger.info(f"Upload {upload_id} finalized as SCORM package {package.id}")
+        return Response({
+            'package': self.get_serializer(package).data,
+            'task_id': task_id
+        }, status=status.HTTP_202_ACCEPTED)
+
+    def _task_status(self, task_result):
+        """Return the check_status payload and HTTP status for a TaskResult."""
+        task_id = task_result.task_id
+        if task_result.status == 'PENDING':
+            data = {'status': 'processing'}
+            if task_result.result:
+                data['progress'] = task_result.result
+            return data, status.HTTP_202_ACCEPTED
+        
+        elif task_result.status == 'SUCCESS':
+            package_id = task_result.result.get('package_id')
+            if package_id:
+                try:
+                    package = ScormPackage.objects.get(id=package_id)
+                    serializer = self.get_serializer(package)
+                    return serializer.data, status.HTTP_200_OK
+                except ScormPackage.DoesNotExist:
+                    logger.error(f"ScormPackage with id {package_id} not found for completed task {task_id}")
+                    return {'error': 'Package not found'}, status.HTTP_404_NOT_FOUND
+            else:
+                logger.error(f"Package ID not found in task result for task {task_id}")
+                return {'error': 'Invalid task result'}, status.HTTP_500_INTERNAL_SERVER_ERROR
+        
+        elif task_result.status in ['FAILURE', 'REVOKED']:
+            logger.error(f"Task {task_id} failed or was revoked. Status: {task_result.status}")
+            return {'error': f'Task {task_result.status.lower()}'}, status.HTTP_500_INTERNAL_SERVER_ERROR
+        
+        else:
+            logger.warning(f"Unexpected task state for task {task_id}: {task_result.status}")
+            return {'status': 'unknown'}, status.HTTP_500_INTERNAL_SERVER_ERROR
+
     @action(detail=False, methods=['get'])
     def check_status(self, request):
+        """Return the processing status of a task.
+
+        With ?wait=N, a pending task holds the request for up to N seconds
+        (capped by SCORM_STATUS_WAIT_MAX) until the task reports a change.
+        """
         task_id = request.query_params.get('task_id')
         if not task_id:
             return Response({'error': 'task_id is required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            wait = min(float(request.query_params.get('wait', 0)), settings.SCORM_STATUS_WAIT_MAX)
+        except ValueError:
+            return Response({'error': 'wait must be a number of seconds'}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
             task_result = TaskResult.objects.get(task_id=task_id)
-            
-            if task_result.status == 'PENDING':
-                return Response({'status': 'processing'}, status=status.HTTP_202_ACCEPTED)
-            
-            elif task_result.status == 'SUCCESS':
-                package_id = task_result.result.get('package_id')
-                if package_id:
-                    try:
-                        package = ScormPackage.objects.get(id=package_id)
-                        serializer = self.get_serializer(package)
-                        return Response(serializer.data)
-                    except ScormPackage.DoesNotExist:
-                        logger.error(f"ScormPackage with id {package_id} not found for completed task {task_id}")
-                        return Response({'error': 'Package not found'}, status=status.HTTP_404_NOT_FOUND)
-                else:
-                    logger.error(f"Package ID not found in task result for task {task_id}")
-                    return Response({'error': 'Invalid task result'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-            
-            elif task_result.status in ['FAILURE', 'REVOKED']:
-                logger.error(f"Task {task_id} failed or was revoked. Status: {task_result.status}")
-                return Response({'error': f'Task {task_result.status.lower()}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-            
-            else:
-                logger.warning(f"Unexpected task state for task {task_id}: {task_result.status}")
-                return Response({'status': 'unknown'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            if wait > 0 and task_result.status == 'PENDING':
+                try:
+                    with subscribe_task_events(task_id) as next_event:
+                        # Re-read after subscribing so a change in between is not missed
+                        task_result.refresh_from_db()
+                        if task_result.status == 'PENDING':
+                            next_event(wait)
+                            task_result.refresh_from_db()
+                except Exception as e:
+                    logger.error(f"Error waiting for task {task_id} events: {str(e)}")
+            data, http_status = self._task_status(task_result)
+            return Response(data, status=http_status)
 
         except TaskResult.DoesNotExist:
             logger.error(f"TaskResult not found for task_id: {task_id}")
@@ -277,14 +499,59 @@ class ScormPackageViewSet(viewsets.ModelViewSet):
         except Exception as e:
             logger.exception(f"Unexpected error checking status for task {task_id}")
             return Response({'error': 'An unexpected error occurred'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    def _status_events(self, task_result):
+        deadline = time.monotonic() + settings.SCORM_STATUS_STREAM_TIMEOUT
+        with subscribe_task_events(task_result.task_id) as next_event:
+            task_result.refresh_from_db()
+            while True:
+                data, _ = self._task_status(task_result)
+                yield f"event: status\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+                if task_result.status != 'PENDING':
+                    return
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return
+                    event = next_event(min(remaining, 15))
+                    if event is None:
+                        yield ": keep-alive\n\n"
+                    elif event.get('status') == 'PENDING':
+                        # Progress events carry the new result; no need to read TaskResult
+                        progress = {key: value for key, value in event.items() if key != 'status'}
+                        yield f"event: status\ndata: {json.dumps({'status': 'processing', 'progress': progress})}\n\n"
+                    else:
+                        task_result.refresh_from_db()
+                        break
+
+    @action(detail=False, methods=['get'], url_path='check_status/stream')
+    def status_stream(self, request):
+        """Stream status changes of a task as server-sent events until it finishes."""
+        task_id = request.query_params.get('task_id')
+        if not task_id:
+            return Response({'error': 'task_id is required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            task_result = TaskResult.objects.get(task_id=task_id)
+        except TaskResult.DoesNotExist:
+            logger.error(f"TaskResult not found for task_id: {task_id}")
+            return Response({'error': 'Invalid task_id'}, status=status.HTTP_404_NOT_FOUND)
+
+        response = StreamingHttpResponse(self._status_events(task_result), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Keep nginx from buffering the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
     
     def destroy(self, request, *args, **kwargs):
         try:
             instance = self.get_object()
             package_id = instance.id
             
-            # Delete the associated file
-            if instance.file:
+            # Delete the associated file once no other package shares it
+            if instance.content_id:
+                if release_package_content(instance.content):
+                    logger.info(f"Content associated with SCORM package {package_id} deleted")
+            elif instance.file:
                 if os.path.isfile(instance.file.path):
                     os.remove(instance.file.path)
                     logger.info(f"File associated with SCORM package {package_id} deleted")
@@ -329,6 +596,74 @@ class UserCourseRegistrationViewSet(viewsets.ModelViewSet):
             logger.error(f"Error registering user for course: {str(e)}")
             return Response({'error': 'An error occurred while registering for the course.'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+def owns_attempt(user, attempt_id):
+    """Whether user may use attempt_id; a runtime token's attempt claim proves it without a query."""
+    if isinstance(user, RuntimeUser):
+        return str(user.attempt_id) == str(attempt_id)
+    try:
+        return SCORMAttempt.objects.filter(id=attempt_id, user_id=user.id).exists()
+    except (TypeError, ValueError):
+        return False
+
+def record_runtime_values(user_id, attempt_id, values, commit=False):
+    """Store runtime writes in the progress log and the runtime cache, or queue them in write-behind mode.
+
+    Returns False when SCORM_RUNTIME_WRITE_DURABILITY required the queued
+    values to be persisted and that could not happen in time.
+    """
+    if not is_write_behind():
+        append_entries_to_log(user_id, attempt_id, [
+            {'element_id': element_id, 'value': value} for element_id, value in values.items()
+        ])
+        set_runtime_values(user_id, attempt_id, values)
+        return True
+    queue_writes(user_id, attempt_id, values)
+    if should_flush_on_write(commit):
+        return persist_pending_writes(attempt_id)
+    return True
+
+def persist_pending_writes(attempt_id):
+    """Flush an attempt's write-behind queue now, waiting briefly for a flush already running."""
+    attempt = SCORMAttempt.objects.get(id=attempt_id)
+    return flush_pending_writes(attempt, wait=settings.SCORM_WRITE_BEHIND_COMMIT_WAIT) is not None
+
+def schedule_runtime_warmup(attempt):
+    """Preload the attempt's state into the runtime cache in the background, unless it is there already."""
+    if not is_runtime_state_loaded(attempt.user_id, attempt.id):
+        transaction.on_commit(lambda: warm_runtime_cache.delay(attempt.id))
+
+def bootstrap_attempt(attempt, initialize=True):
+    """Apply the default CMI initialization for a launch and return the full data model.
+
+    Replaces the sequence of get/set round trips the player used to make
+    before the SCO could start. With initialize=False the defaults are only
+    merged into the payload; nothing is cached or written to the progress log.
+    """
+    user = attempt.user
+    # A resumed attempt whose state is already cached needs no database or log read
+    cached = get_runtime_state(user.id, attempt.id)
+    cmi = cached if cached is not None else get_attempt_state(attempt)
+    if cached is None and initialize:
+        load_runtime_state(user.id, attempt.id, cmi)
+    defaults = {
+        'cmi.core.lesson_mode': 'normal',
+        'cmi.core.lesson_status': cmi.get('cmi.core.lesson_status') or 'not attempted',
+        'cmi.core.exit': '',
+        'cmi.suspend_data': cmi.get('cmi.suspend_data') or '',
+        'cmi.core.student_name': user.get_full_name(),
+        'cmi.core.student_id': str(user.id),
+        'cmi.core.credit': 'credit',
+        'cmi.core.entry': cmi.get('cmi.core.entry') or 'ab-initio',
+        'cmi.core.total_time': cmi.get('cmi.core.total_time') or '00:00:00',
+    }
+    # Only non-empty values are written, matching what the player used to send
+    initialized = {element_id: value for element_id, value in defaults.items()
+                   if value != '' and cmi.get(element_id) != value}
+    if initialized and initialize:
+        record_runtime_values(user.id, attempt.id, initialized)
+    cmi.update(defaults)
+    return {'attempt_id': attempt.id, 'cmi': cmi}
+
 class SCORMAttemptViewSet(viewsets.ModelViewSet):
     queryset = SCORMAttempt.objects.all()
     serializer_class = SCORMAttemptSerializer
@@ -351,6 +686,8 @@ class SCORMAttemptViewSet(viewsets.ModelViewSet):
         try:
             with transaction.atomic():
                 attempt = SCORMAttempt.objects.create(user=user, scorm_package=package)
+            # A new attempt has no state yet, so its runtime cache starts out complete
+            load_runtime_state(user.id, attempt.id, {})
             serializer = self.get_serializer(attempt)
             logger.info(f"SCORM attempt started for user {user_id} on package {package_id}")
             return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -372,22 +709,45 @@ class SCORMAttemptViewSet(viewsets.ModelViewSet):
             logger.error(f"Error updating SCORM attempt progress: {str(e)}")
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-    @action(detail=True, methods=['post'])
+    def _is_owner(self, request, attempt):
+        # A runtime token only covers the attempt it was minted for
+        if isinstance(request.user, RuntimeUser) and request.user.attempt_id != attempt.id:
+            return False
+        return attempt.user_id == request.user.id
+
+    @action(detail=True, methods=['post'], authentication_classes=[RuntimeTokenAuthentication, CustomTokenAuthentication])
     def start_session(self, request, pk=None):
         logger.info(f"Starting session for SCORM attempt {pk}")
         attempt = self.get_object()
-        if attempt.user != request.user:
+        if not self._is_owner(request, attempt):
             logger.warning(f"Unauthorized access attempt for SCORM attempt {pk}")
             return Response({"error": "Unauthorized"}, status=status.HTTP_403_FORBIDDEN)
         login(request, attempt.user)
+        # Resumed attempts get their state cached before the SCO starts reading it
+        schedule_runtime_warmup(attempt)
         logger.info(f"Session started for SCORM attempt {pk}")
         return Response({"message": "Session started"})
 
-    @action(detail=True, methods=['post'])
+    @action(detail=True, methods=['post'], authentication_classes=[RuntimeTokenAuthentication, CustomTokenAuthentication])
+    def bootstrap(self, request, pk=None):
+        logger.info(f"Bootstrapping SCORM attempt {pk}")
+        attempt = self.get_object()
+        if not self._is_owner(request, attempt):
+            logger.warning(f"Unauthorized access attempt for SCORM attempt {pk}")
+            return Response({"error": "Unauthorized"}, status=status.HTTP_403_FORBIDDEN)
+        try:
+            payload = bootstrap_attempt(attempt)
+            logger.info(f"SCORM attempt {pk} bootstrapped")
+            return Response(payload)
+        except Exception as e:
+            logger.exception(f"Error bootstrapping SCORM attempt {pk}: {str(e)}")
+            return Response({'error': 'An error occurred while bootstrapping the attempt.'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    @action(detail=True, methods=['post'], authentication_classes=[RuntimeTokenAuthentication, CustomTokenAuthentication])
     def end_session(self, request, pk=None):
         logger.info(f"Ending session for SCORM attempt {pk}")
         attempt = self.get_object()
-        if attempt.user != request.user:
+        if not self._is_owner(request, attempt):
             logger.warning(f"Unauthorized access attempt for SCORM attempt {pk}")
             return Response({"error": "Unauthorized"}, status=status.HTTP_403_FORBIDDEN)
         logout(request)
@@ -428,10 +788,24 @@ class SCORMElementViewSet(viewsets.ModelViewSet):
 
 class SCORMAPIViewSet(viewsets.ViewSet):
     permission_classes = [IsAuthenticated]
-    authentication_classes = [CustomTokenAuthentication]
+    # The player authenticates with its runtime token; API clients may still use their DRF token
+    authentication_classes = [RuntimeTokenAuthentication, CustomTokenAuthentication]
+
+    def _lookup_value(self, user_id, attempt_id, element_id):
+        """Resolve an element missing from the cache: snapshot first, then SCORMElement."""
+        return self._lookup_values(user_id, attempt_id, [element_id])[element_id]
 
-    def _get_cache_key(self, user_id, attempt_id, element_id):
-        return f"scorm:{user_id}:{attempt_id}:{element_id}"
+    def _lookup_values(self, user_id, attempt_id, element_ids):
+        snapshot = dict(read_snapshot(user_id, attempt_id))
+        snapshot.update(read_pending_values(user_id, attempt_id))
+        values = {element_id: snapshot[element_id] for element_id in element_ids if element_id in snapshot}
+        missing = [element_id for element_id in element_ids if element_id not in values]
+        if missing:
+            values.update(
+                SCORMElement.objects.filter(scorm_attempt_id=attempt_id, element_id__in=missing)
+                .values_list('element_id', 'value')
+            )
+        return {element_id: values.get(element_id, "") for element_id in element_ids}
 
     @action(detail=False, methods=['post'])
     def set_value(self, request):
@@ -445,21 +819,17 @@ class SCORMAPIViewSet(viewsets.ViewSet):
         if not all([attempt_id, element_id, value]):
             logger.error("Missing required data for setting SCORM API value")
             return Response({'error': 'attempt_id, element_id, and value are required.'}, status=status.HTTP_400_BAD_REQUEST)
-        
+
+        if not owns_attempt(request.user, attempt_id):
+            logger.warning(f"SCORM attempt {attempt_id} not found for user {request.user.id}")
+            return Response({'error': 'SCORM attempt not found.'}, status=status.HTTP_404_NOT_FOUND)
+
         try:
-            attempt = get_object_or_404(SCORMAttempt, id=attempt_id, user=request.user)
-            logger.debug(f"Found SCORMAttempt: {attempt}")
-
-            # Append to the log file
-            append_to_log(request.user.id, attempt_id, {
-                'element_id': element_id,
-                'value': value
-            })
-            
-            # Update the cache
-            cache_key = self._get_cache_key(request.user.id, attempt_id, element_id)
-            cache.set(cache_key, value, timeout=None)  # No expiration
-            
+            # Append to the log file and update the cache (or queue the write, in write-behind mode)
+            if not record_runtime_values(request.user.id, attempt_id, {element_id: value}):
+                logger.error(f"SCORM API value for attempt {attempt_id} queued but not persisted in time")
+                return Response({'error': 'The value was queued but could not be persisted yet.'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
             logger.info(f"SCORM API value set and cached: {element_id}")
             return Response({"success": True})
         except Exception as e:
@@ -477,35 +847,134 @@ class SCORMAPIViewSet(viewsets.ViewSet):
         if not all([attempt_id, element_id]):
             logger.error("Missing required data for getting SCORM API value")
             return Response({'error': 'attempt_id and element_id are required.'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        try:
-            attempt = get_object_or_404(SCORMAttempt, id=attempt_id, user=request.user)
-            logger.debug(f"Found SCORMAttempt: {attempt}")
 
-            # Try to get the value from cache first
-            cache_key = self._get_cache_key(request.user.id, attempt_id, element_id)
-            cached_value = cache.get(cache_key)
-            
-            if cached_value is not None:
+        if not owns_attempt(request.user, attempt_id):
+            logger.warning(f"SCORM attempt {attempt_id} not found for user {request.user.id}")
+            return Response({'error': 'SCORM attempt not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            # Try to get the value from cache first; a fully loaded attempt has no misses
+            cached, loaded = get_runtime_values(request.user.id, attempt_id, [element_id])
+            if element_id in cached or loaded:
                 logger.info(f"SCORM API value retrieved from cache: {element_id}")
-                return Response({"value": cached_value})
-            
-            # If not in cache, read from the log file
-            log_data = read_log(request.user.id, attempt_id)
-            
-            # Find the latest value for the given element_id
-            latest_value = next((entry['data']['value'] for entry in reversed(log_data) 
-                                 if entry['data']['element_id'] == element_id), "")
+                return Response({"value": cached.get(element_id, "")})
+
+            # If not in cache, fall back to the attempt snapshot, then the database
+            latest_value = self._lookup_value(request.user.id, attempt_id, element_id)
 
             # Cache the value for future requests
-            cache.set(cache_key, latest_value, timeout=None)  # No expiration
+            set_runtime_values(request.user.id, attempt_id, {element_id: latest_value})
 
-            logger.info(f"SCORM API value retrieved from log and cached: {element_id}")
+            logger.info(f"SCORM API value retrieved from snapshot and cached: {element_id}")
             return Response({"value": latest_value})
         except Exception as e:
             logger.exception(f"Error getting SCORM API value: {str(e)}")
             return Response({'error': 'An error occurred while getting the SCORM API value.'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        logger.info("SCORMAPIViewSet.batch called")
+        attempt_id = request.data.get('attempt_id')
+        operations = request.data.get('operations')
+        client_session = request.data.get('client_session')
+        sequence = request.data.get('sequence')
+        # Sent by LMSCommit/LMSFinish; see SCORM_RUNTIME_WRITE_DURABILITY
+        commit = bool(request.data.get('commit'))
+
+        if not attempt_id or not isinstance(operations, list) or not operations:
+            logger.error("Missing required data for SCORM API batch")
+            return Response({'error': 'attempt_id and a non-empty operations list are required.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if len(operations) > settings.SCORM_API_BATCH_MAX_OPERATIONS:
+            logger.error(f"SCORM API batch too large: {len(operations)} operations")
+            return Response({'error': f'A batch may contain at most {settings.SCORM_API_BATCH_MAX_OPERATIONS} operations.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if sequence is not None and (not client_session or not isinstance(sequence, int)):
+            logger.error("Invalid client sequence for SCORM API batch")
+            return Response({'error': 'sequence must be an integer sent together with client_session.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        for operation in operations:
+            if not isinstance(operation, dict) or operation.get('op') not in ('set', 'get') or not operation.get('element_id'):
+                logger.error(f"Invalid SCORM API batch operation: {operation}")
+                return Response({'error': 'Each operation needs an op of "set" or "get" and an element_id.'}, status=status.HTTP_400_BAD_REQUEST)
+            if operation['op'] == 'set' and operation.get('value') is None:
+                logger.error(f"Missing value for SCORM API batch set: {operation['element_id']}")
+                return Response({'error': 'Set operations require a value.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not owns_attempt(request.user, attempt_id):
+            logger.warning(f"SCORM attempt {attempt_id} not found for user {request.user.id}")
+            return Response({'error': 'SCORM attempt not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            # A retried flush carries a sequence number the server has already applied;
+            # its sets are acknowledged again without being written twice
+            sequence_key = f"scorm:seq:{attempt_id}:{client_session}"
+            duplicate = sequence is not None and sequence <= (cache.get(sequence_key) or 0)
+            if duplicate:
+                logger.info(f"Skipping already applied SCORM API batch {sequence} for attempt {attempt_id}")
+
+            # Operations apply in order: a get sees sets made earlier in the same batch
+            written = {}
+            entries = []
+            results = []
+            pending_gets = []
+            for operation in operations:
+                element_id = operation['element_id']
+                if operation['op'] == 'set':
+                    value = str(operation['value'])
+                    written[element_id] = value
+                    entries.append({'element_id': element_id, 'value': value})
+                    results.append({'element_id': element_id, 'success': True})
+                elif element_id in written:
+                    results.append({'element_id': element_id, 'value': written[element_id]})
+                else:
+                    result = {'element_id': element_id, 'value': ""}
+                    pending_gets.append(result)
+                    results.append(result)
+
+            if pending_gets:
+                unresolved = {result['element_id'] for result in pending_gets}
+                current, loaded = get_runtime_values(request.user.id, attempt_id, unresolved)
+                missing = [element_id for element_id in unresolved if element_id not in current]
+                if missing and not loaded:
+                    looked_up = self._lookup_values(request.user.id, attempt_id, missing)
+                    current.update(looked_up)
+                    set_runtime_values(request.user.id, attempt_id, looked_up)
+                for result in pending_gets:
+                    result['value'] = current.get(result['element_id'], "")
+
+            persisted = True
+            if entries and not duplicate:
+                persisted = record_runtime_values(request.user.id, attempt_id, written, commit=commit)
+            elif duplicate and is_write_behind() and should_flush_on_write(commit):
+                # The first delivery may have been queued without being persisted
+                persisted = persist_pending_writes(attempt_id)
+            if sequence is not None and not duplicate:
+                cache.set(sequence_key, sequence, timeout=settings.SCORM_API_BATCH_SEQUENCE_TIMEOUT)
+            if not persisted:
+                logger.error(f"SCORM API batch for attempt {attempt_id} queued but not persisted in time")
+                return Response({'error': 'The values were queued but could not be persisted yet.'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+            logger.info(f"SCORM API batch applied: {len(entries)} sets, {len(operations) - len(entries)} gets")
+            response_data = {"results": results}
+            if sequence is not None:
+                response_data.update({"sequence": sequence, "duplicate": duplicate})
+            return Response(response_data)
+        except Exception as e:
+            logger.exception(f"Error applying SCORM API batch: {str(e)}")
+            return Response({'error': 'An error occurred while applying the SCORM API batch.'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    @action(detail=False, methods=['post'], authentication_classes=[RuntimeTokenAuthentication])
+    def refresh_token(self, request):
+        """Renew a still valid runtime token, checking once that the learner and attempt remain."""
+        attempt = SCORMAttempt.objects.filter(
+            id=request.user.attempt_id, user_id=request.user.id, user__is_active=True,
+        ).first()
+        if attempt is None:
+            logger.warning(f"Refused runtime token refresh for attempt {request.user.attempt_id}")
+            return Response({'error': 'Unauthorized'}, status=status.HTTP_403_FORBIDDEN)
+        return Response({'token': create_runtime_token(attempt), 'expires_in': settings.SCORM_RUNTIME_TOKEN_MAX_AGE})
+
 
 class ReportingViewSet(viewsets.ViewSet):
     permission_classes = [IsAuthenticated]
@@ -543,15 +1012,20 @@ class ReportingViewSet(viewsets.ViewSet):
 @xframe_options_exempt
 def launch_scorm(request, attempt_id):
     logger.info(f"Launching SCORM for attempt {attempt_id}")
+    # Nothing is minted for anyone but the learner of the attempt
+    if not request.user.is_authenticated:
+        logger.warning(f"Anonymous launch of SCORM attempt {attempt_id} refused")
+        return render(request, 'scorm_app/error.html', {'error': 'Log in to launch this SCORM package.'}, status=403)
+    if not owns_attempt(request.user, attempt_id):
+        logger.warning(f"Unauthorized launch of SCORM attempt {attempt_id} by user {request.user.id}")
+        return render(request, 'scorm_app/error.html', {'error': 'SCORM attempt not found.'}, status=404)
     try:
         attempt = get_object_or_404(SCORMAttempt, id=attempt_id)
         package = attempt.scorm_package
-        user = attempt.user
-        
-        # Generate or get the token for the user
-        token, _ = Token.objects.get_or_create(user=user)
-        
-        launch_url = package.get_launch_url()
+
+        # Assets of this launch are served through a grant checked once, here; it is
+        # the same for every launch of the package by the learner within a window
+        launch_url = package.get_launch_url(grant=create_asset_grant(attempt))
         if not launch_url:
             logger.error(f"Launch URL not found for SCORM package {package.id}")
             return render(request, 'scorm_app/error.html', {'error': 'Launch URL not found for this SCORM package.'})
@@ -561,7 +1035,11 @@ def launch_scorm(request, attempt_id):
             'package': package,
             'launch_url': launch_url,
             'attempt_id': attempt_id,
-            'auth_token': token.key,  # Add this line
+            # The player calls the runtime API with a short-lived token scoped to this attempt
+            'auth_token': create_runtime_token(attempt),
+            'auth_token_max_age': settings.SCORM_RUNTIME_TOKEN_MAX_AGE,
+            # Read-only: the defaults are written by the player's authenticated bootstrap call
+            'scorm_bootstrap': bootstrap_attempt(attempt, initialize=False),
         }
         logger.info(f"SCORM launched successfully for attempt {attempt_id}")
         return render(request, 'scorm_app/player.html', context)
@@ -572,6 +1050,148 @@ def launch_scorm(request, attempt_id):
         logger.error(f"Error launching SCORM for attempt {attempt_id}: {str(e)}")
         return render(request, 'scorm_app/error.html', {'error': 'An error occurred while launching the SCORM package.'})
         
+def _set_asset_cache_headers(response, etag=None):
+    # Package assets never change under a package id, so browsers may keep them;
+    # they are only for the learner of the grant, not for shared caches
+    response['Cache-Control'] = f'private, max-age={settings.SCORM_ASSET_MAX_AGE}, immutable'
+    # Offloaded responses get their validators and Vary from the proxy
+    if etag:
+        response['ETag'] = etag
+        response['Vary'] = 'Accept-Encoding'
+    return response
+
+def _is_not_modified(request, etag):
+    return etag in [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]
+
+def _ranged_response(request, content_type, size, iter_range, full_response=None):
+    """Build a 200, 206 or 416 response; iter_range(start, end) yields the requested bytes."""
+    try:
+        byte_range = parse_range_header(request.headers.get('Range'), size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    if byte_range:
+        start, end = byte_range
+        response = StreamingHttpResponse(iter_range(start, end), status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = end - start + 1
+    elif full_response is not None:
+        response = full_response()
+    else:
+        response = StreamingHttpResponse(iter_range(0, size - 1), content_type=content_type)
+        response['Content-Length'] = size
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+def _serve_archive_asset(request, target, path):
+    archive_path = target['archive_path']
+    if not archive_path or not os.path.isfile(archive_path):
+        raise Http404("Package archive not found")
+
+    index = get_archive_index(archive_path)
+    member = index.get(path)
+    if member is None:
+        raise Http404(f"{path} not found in package {target['package_id']}")
+
+    etag = f'"{member.crc:08x}-{member.file_size:x}"'
+    if _is_not_modified(request, etag):
+        return _set_asset_cache_headers(HttpResponseNotModified(), etag)
+
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    response = _ranged_response(request, content_type, member.file_size,
+                                lambda start, end: index.iter_member(member, start, end))
+    response['Last-Modified'] = http_date(calendar.timegm(member.date_time + (0, 0, -1)))
+    return _set_asset_cache_headers(response, etag)
+
+def _offload_file(file_path, content_type):
+    """Hand a file over to the front proxy according to SCORM_ASSET_DELIVERY, or return None."""
+    mode = settings.SCORM_ASSET_DELIVERY
+    if mode == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = file_path
+        return response
+    if mode == 'x-accel-redirect':
+        root = os.path.realpath(settings.SCORM_ASSET_ACCEL_ROOT)
+        if not file_path.startswith(root + os.sep):
+            logger.warning(f"{file_path} is outside SCORM_ASSET_ACCEL_ROOT; serving it from Django")
+            return None
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = settings.SCORM_ASSET_ACCEL_PREFIX.rstrip('/') + '/' + os.path.relpath(file_path, root).replace(os.sep, '/')
+        return response
+    return None
+
+def _serve_extracted_asset(request, target, path):
+    root = os.path.realpath(target['extract_path'])
+    file_path = os.path.realpath(os.path.join(root, path))
+    if not file_path.startswith(root + os.sep) or not os.path.isfile(file_path):
+        raise Http404(f"{path} not found in package {target['package_id']}")
+
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    # The proxy only forwards a few headers of an offloaded response, Content-Encoding
+    # not among them: it gets the identity file and picks the precompressed sibling
+    # itself (nginx gzip_static / brotli_static)
+    response = _offload_file(file_path, content_type)
+    if response is not None:
+        return _set_asset_cache_headers(response)
+
+    encoding = None
+    # Range requests always address the identity encoding
+    if 'Range' not in request.headers:
+        accepted = parse_accept_encoding(request.headers.get('Accept-Encoding'))
+        for coding in get_supported_encodings():
+            if coding in accepted and os.path.isfile(file_path + PRECOMPRESSED_SUFFIXES[coding]):
+                encoding = coding
+                file_path += PRECOMPRESSED_SUFFIXES[coding]
+                break
+
+    stat = os.stat(file_path)
+    etag = '"{}"'.format(hashlib.sha1(
+        f"{target['package_id']}:{os.path.relpath(file_path, root)}:{stat.st_size}:{stat.st_mtime_ns}".encode()
+    ).hexdigest())
+    if _is_not_modified(request, etag):
+        return _set_asset_cache_headers(HttpResponseNotModified(), etag)
+
+    if encoding:
+        response = FileResponse(open(file_path, 'rb'), content_type=content_type)
+        response['Content-Encoding'] = encoding
+    else:
+        # FileResponse lets the WSGI server use sendfile() for whole-file responses
+        response = _ranged_response(
+            request, content_type, stat.st_size,
+            lambda start, end: iter_file_range(file_path, start, end),
+            full_response=lambda: FileResponse(open(file_path, 'rb'), content_type=content_type),
+        )
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    return _set_asset_cache_headers(response, etag)
+
+def _serve_package_asset(request, target, path):
+    if target['is_extracted']:
+        return _serve_extracted_asset(request, target, path)
+    return _serve_archive_asset(request, target, path)
+
+@xframe_options_exempt
+def package_content(request, package_id, path):
+    """Serve a SCO asset of a package to staff, from its extraction or straight from the archive.
+
+    Learners load assets through the grant of their launch (package_asset).
+    Extracted assets are sent precompressed when the client accepts it; both
+    sources support Range requests and conditional GETs.
+    """
+    if not request.user.is_authenticated or not request.user.is_staff:
+        return HttpResponseForbidden("Package content is only available to staff")
+    package = get_object_or_404(ScormPackage, id=package_id)
+    return _serve_package_asset(request, get_asset_target(package), path)
+
+@xframe_options_exempt
+def package_asset(request, grant, path):
+    """Serve a SCO asset to the learner of a launch, authorized by the grant minted in launch_scorm."""
+    target = resolve_asset_grant(grant)
+    if target is None:
+        return HttpResponseForbidden("Invalid or expired asset grant")
+    return _serve_package_asset(request, target, path)
+
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def test_validate_user(request):
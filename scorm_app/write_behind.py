@@ -0,0 +1,120 @@
+import logging
+from django.conf import settings
+from django_redis import get_redis_connection
+from .dirty_attempts import queue_dirty_marker
+from .runtime_cache import flushing_key, pending_key, queue_runtime_values
+
+logger = logging.getLogger(__name__)
+
+# Write-behind runtime store (SCORM_RUNTIME_WRITE_MODE = 'write-behind').
+#
+# A runtime write is one Redis transaction: the values go into the attempt's
+# runtime hash and its pending hash, and the attempt is marked dirty. Nothing
+# touches the progress log or the database on the request thread. Repeated
+# writes to an element coalesce in the pending hash.
+#
+# drain_dirty_attempts flushes the pending hash to SCORMElement in bulk, under
+# the attempt's lock (tasks.acquire_attempt_lock): claim_pending_writes moves
+# it under a :flushing key, the values are applied, and
+# acknowledge_pending_writes drops them. A flush that fails
+# leaves its values under :flushing, where the next one picks them up again.
+#
+# Every attempt with queued values is also a member of PENDING_INDEX_KEY until
+# nothing is left to flush, so the periodic process_scorm_logs reconciliation
+# finds values, including a stale :flushing hash, whose dirty marker was lost.
+#
+# SCORM_RUNTIME_WRITE_DURABILITY decides when a request waits for the flush:
+# 'async' never, 'commit' on batches sent by LMSCommit/LMSFinish, 'always' on
+# every write. Until then the values are as durable as Redis is configured
+# to be (enable appendonly to survive a restart).
+
+WRITE_BEHIND = 'write-behind'
+DURABILITY_LEVELS = ('async', 'commit', 'always')
+PENDING_INDEX_KEY = 'scorm:pending-attempts'
+
+# Moves the pending values over those left by an earlier failed flush, which
+# are older, and returns everything to persist.
+CLAIM_PENDING_SCRIPT = """
+local pending = redis.call('HGETALL', KEYS[1])
+for i = 1, #pending, 2 do
+    redis.call('HSET', KEYS[2], pending[i], pending[i + 1])
+end
+redis.call('DEL', KEYS[1])
+return redis.call('HGETALL', KEYS[2])
+"""
+
+# Drops the claimed values; the attempt leaves the index unless more were queued since.
+ACKNOWLEDGE_PENDING_SCRIPT = """
+redis.call('DEL', KEYS[2])
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    redis.call('SREM', KEYS[3], ARGV[1])
+end
+"""
+
+# Counts the pending and :flushing hashes; an attempt with neither leaves the index.
+CHECK_PENDING_SCRIPT = """
+local count = redis.call('EXISTS', KEYS[1], KEYS[2])
+if count == 0 then
+    redis.call('SREM', KEYS[3], ARGV[1])
+end
+return count
+"""
+
+def is_write_behind():
+    return settings.SCORM_RUNTIME_WRITE_MODE == WRITE_BEHIND
+
+def should_flush_on_write(commit=False):
+    """Whether a runtime write must be persisted to SCORMElement before it is acknowledged."""
+    durability = settings.SCORM_RUNTIME_WRITE_DURABILITY
+    return durability == 'always' or (durability == 'commit' and commit)
+
+def queue_writes(user_id, attempt_id, values):
+    """Queue runtime values for an attempt in a single Redis transaction.
+
+    Unlike runtime cache writes, failures are raised: the values would be lost.
+    """
+    if not values:
+        return
+    values = {element_id: str(value) for element_id, value in values.items()}
+    pipe = get_redis_connection('default').pipeline(transaction=True)
+    pipe.hset(pending_key(user_id, attempt_id), mapping=values)
+    queue_runtime_values(pipe, user_id, attempt_id, values)
+    queue_dirty_marker(pipe, user_id, attempt_id, values.keys())
+    pipe.sadd(PENDING_INDEX_KEY, _index_member(user_id, attempt_id))
+    pipe.execute()
+
+def _index_member(user_id, attempt_id):
+    return f'{user_id}:{attempt_id}'
+
+def list_pending_attempts():
+    """Yield (user_id, attempt_id) for every attempt in the pending index."""
+    for member in get_redis_connection('default').sscan_iter(PENDING_INDEX_KEY):
+        user_id, attempt_id = member.decode().split(':')
+        yield user_id, attempt_id
+
+def has_pending_writes(user_id, attempt_id):
+    """Whether an attempt has values to flush; one without any is dropped from the pending index."""
+    return bool(get_redis_connection('default').eval(
+        CHECK_PENDING_SCRIPT, 3, pending_key(user_id, attempt_id), flushing_key(user_id, attempt_id),
+        PENDING_INDEX_KEY, _index_member(user_id, attempt_id),
+    ))
+
+def claim_pending_writes(user_id, attempt_id):
+    """Move an attempt's pending values under its :flushing key and return them."""
+    values = get_redis_connection('default').eval(
+        CLAIM_PENDING_SCRIPT, 2, pending_key(user_id, attempt_id), flushing_key(user_id, attempt_id),
+    )
+    return {values[i].decode(): values[i + 1].decode() for i in range(0, len(values), 2)}
+
+def acknowledge_pending_writes(user_id, attempt_id):
+    get_redis_connection('default').eval(
+        ACKNOWLEDGE_PENDING_SCRIPT, 3, pending_key(user_id, attempt_id), flushing_key(user_id, attempt_id),
+        PENDING_INDEX_KEY, _index_member(user_id, attempt_id),
+    )
+
+def discard_pending_writes(user_id, attempt_id):
+    """Drop the queued values of an attempt that no longer exists."""
+    pipe = get_redis_connection('default').pipeline(transaction=True)
+    pipe.delete(pending_key(user_id, attempt_id), flushing_key(user_id, attempt_id))
+    pipe.srem(PENDING_INDEX_KEY, _index_member(user_id, attempt_id))
+    pipe.execute()
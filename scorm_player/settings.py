@@ -188,7 +188,7 @@ REST_FRAMEWORK = {
 
 # Celery settings
 CELERY_BROKER_URL = 'amqp://localhost'  # RabbitMQ broker URL
-CELERY_RESULT_BACKEND = 'rpc://'
+CELERY_RESULT_BACKEND = 'redis://127.0.0.1:6379/2'  # Chords need a backend that supports them
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
@@ -229,9 +229,119 @@ CACHES = {
 SESSION_ENGINE = "django.contrib.sessions.backends.cache"
 SESSION_CACHE_ALIAS = "default"
 
+# Attempts written to by the runtime API are queued in Redis and drained continuously.
+# An attempt under constant writes is processed at most once per debounce window;
+# status and score changes skip the window.
+SCORM_DIRTY_DEBOUNCE_SECONDS = 30
+SCORM_DIRTY_DRAIN_BATCH_SIZE = 100
+SCORM_DIRTY_DRAIN_INTERVAL = 5.0
+
 CELERY_BEAT_SCHEDULE = {
+    'drain-dirty-scorm-attempts': {
+        'task': 'scorm_app.tasks.drain_dirty_attempts',
+        'schedule': SCORM_DIRTY_DRAIN_INTERVAL,
+    },
+    # Full directory scan, kept as a reconciliation fallback for lost markers
     'process-scorm-logs': {
         'task': 'scorm_app.tasks.process_scorm_logs',
-        'schedule': crontab(minute='*/5'),  
+        'schedule': crontab(minute='*/30'),  
     },
-}
\ No newline at end of file
+    'cleanup-stale-uploads': {
+        'task': 'scorm_app.tasks.cleanup_stale_uploads',
+        'schedule': crontab(minute=15),
+    },
+}
+# Progress log segments are rotated once they reach this size (in bytes)
+SCORM_LOG_SEGMENT_MAX_BYTES = 1024 * 1024
+
+# Upper bound on the number of operations accepted by /api/scorm-api/batch/
+SCORM_API_BATCH_MAX_OPERATIONS = 500
+
+# How long (in seconds) the last applied client batch sequence is remembered
+SCORM_API_BATCH_SEQUENCE_TIMEOUT = 60 * 60 * 24
+
+# Rows per INSERT when upserting SCORMElement values from processed logs
+SCORM_ELEMENT_BULK_BATCH_SIZE = 1000
+
+# process_scorm_logs fans attempts out to this many shard tasks, grouped by user id hash
+SCORM_LOG_PROCESSING_SHARDS = 16
+# Upper bound (in seconds) on how long one processing run may hold its lock
+SCORM_LOG_PROCESSING_LOCK_TIMEOUT = 30 * 60
+# Upper bound (in seconds) on how long processing, archiving or flushing one attempt may hold its lock
+SCORM_ATTEMPT_LOCK_TIMEOUT = 5 * 60
+
+# Where progress logs are written. The filesystem backend needs SCORM_LOGS_DIR to be
+# shared by the web nodes and the workers; with several web nodes use
+# 'scorm_app.log_backends.RedisStreamProgressLogBackend'.
+SCORM_PROGRESS_LOG_BACKEND = 'scorm_app.log_backends.FileSystemProgressLogBackend'
+SCORM_PROGRESS_LOG_BACKEND_OPTIONS = {}
+
+# When False, uploaded packages are not extracted: only the manifest is read and
+# assets are streamed from the archive by the package_content view.
+SCORM_EXTRACT_PACKAGES = True
+# Number of archive central-directory indexes kept open per process
+SCORM_ARCHIVE_INDEX_CACHE_SIZE = 32
+
+# Resumable uploads (/api/scorm-packages/uploads/) are assembled here before processing
+SCORM_UPLOAD_TEMP_DIR = os.path.join(BASE_DIR, 'scorm_uploads')
+# Largest chunk accepted by a single PUT, in bytes
+SCORM_UPLOAD_MAX_CHUNK_SIZE = 8 * 1024 * 1024
+# Largest package size a resumable upload may declare, in bytes
+SCORM_UPLOAD_MAX_SIZE = 2 * 1024 * 1024 * 1024
+# Uploads without a chunk for this long (in seconds) are deleted by cleanup_stale_uploads
+SCORM_UPLOAD_EXPIRY = 60 * 60 * 24
+
+# Write gzip (and brotli, if the brotli module is installed) siblings of text assets at ingest time
+SCORM_PRECOMPRESS_ASSETS = True
+SCORM_PRECOMPRESS_WORKERS = os.cpu_count() or 4
+# Cache lifetime (in seconds) of assets served by the package_content view
+SCORM_ASSET_MAX_AGE = 60 * 60 * 24 * 365
+
+# Maximum lifetime (in seconds) of the signed asset grant minted for a launch. Grants are
+# reused for half of it, so assets cached by the browser survive later launches.
+SCORM_ASSET_GRANT_MAX_AGE = 60 * 60 * 12
+# How extracted assets are delivered: 'django' streams them itself (development),
+# 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache, lighttpd) hand the file to the proxy.
+# With nginx, SCORM_ASSET_ACCEL_PREFIX must be an internal location aliased to SCORM_ASSET_ACCEL_ROOT.
+SCORM_ASSET_DELIVERY = 'django'
+SCORM_ASSET_ACCEL_ROOT = MEDIA_ROOT
+SCORM_ASSET_ACCEL_PREFIX = '/protected-media/'
+
+# Extraction limits checked from the zip central directory before anything is written
+SCORM_EXTRACT_MAX_MEMBERS = 20000
+SCORM_EXTRACT_MAX_TOTAL_SIZE = 8 * 1024 * 1024 * 1024
+SCORM_EXTRACT_MAX_COMPRESSION_RATIO = 100
+# Threads used to extract the members of one package
+SCORM_EXTRACT_WORKERS = os.cpu_count() or 4
+
+# Bytes read from the head of launch/index files to detect the authoring tool
+SCORM_SNIFF_MAX_BYTES = 64 * 1024
+
+# Longest time (in seconds) check_status?wait=N holds a request for a pending task
+SCORM_STATUS_WAIT_MAX = 30
+# Longest time (in seconds) check_status/stream keeps a server-sent events stream open
+SCORM_STATUS_STREAM_TIMEOUT = 300
+
+# Token authentication cache: entries live this long (in seconds) in Redis and are
+# invalidated when tokens or users are saved; each process also keeps a small LRU whose
+# entries expire after SCORM_AUTH_LOCAL_CACHE_TTL seconds. Changes that skip model
+# signals (QuerySet.update(), raw SQL) only take effect once the entries expire.
+SCORM_AUTH_CACHE_TTL = 60
+SCORM_AUTH_LOCAL_CACHE_TTL = 10
+SCORM_AUTH_LOCAL_CACHE_SIZE = 10000
+
+# Lifetime (in seconds) of the attempt-scoped runtime token given to the player;
+# the player renews it through /api/scorm-api/refresh_token/ before it expires
+SCORM_RUNTIME_TOKEN_MAX_AGE = 15 * 60
+
+# Idle lifetime (in seconds) of an attempt's runtime cache hash; every read or write refreshes it
+SCORM_RUNTIME_CACHE_TTL = 60 * 60 * 24
+
+# 'log' appends runtime writes to the progress log on the request thread; 'write-behind'
+# only writes them to Redis and drain_dirty_attempts persists them to SCORMElement in bulk.
+SCORM_RUNTIME_WRITE_MODE = 'log'
+# In write-behind mode, when a request waits for its values to reach the database:
+# 'async' never, 'commit' for batches sent by LMSCommit/LMSFinish, 'always' for every write
+SCORM_RUNTIME_WRITE_DURABILITY = 'commit'
+# Longest time (in seconds) a committing request waits for a flush already running on its attempt
+SCORM_WRITE_BEHIND_COMMIT_WAIT = 5
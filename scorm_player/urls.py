@@ -23,5 +23,7 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('scorm_app.urls')),
     path('users/', include('users.urls')),
-] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT) + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+# MEDIA_ROOT holds uploaded and extracted packages, which are only served by the
+# package views after checking a launch grant or a staff login
+] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
 
@@ -1,15 +1,68 @@
 class SCORMAPI {
-    constructor() {
-        this.data = {};
+    // With an attemptId and authToken (the runtime token minted by launch_scorm),
+    // values are buffered in memory and sent to /api/scorm-api/batch/ on
+    // LMSCommit, LMSFinish, a timer or page hide. Repeated writes to an element
+    // are coalesced. The token is renewed at 80% of its lifetime
+    // (authTokenMaxAge, in seconds) and once more on a 401.
+    // LMSInitialize starts the attempt's session and records the CMI defaults;
+    // LMSFinish saves the session time, ends the session and calls onClose.
+    // Without them the API only keeps values in memory.
+    constructor(options = {}) {
+        this.data = Object.assign({}, options.initialData);
+        this.attemptId = options.attemptId || null;
+        this.authToken = options.authToken || null;
+        this.authTokenMaxAge = options.authTokenMaxAge || null;
+        this.apiBaseUrl = options.apiBaseUrl || "/api/";
+        this.flushInterval = options.flushInterval || 10000;
+        this.onClose = options.onClose || null;
+        this.clientSession = (window.crypto && crypto.randomUUID) ? crypto.randomUUID() : `${Date.now()}-${Math.random().toString(16).slice(2)}`;
+        this.pending = new Map();
+        this.inFlight = null;
+        this.sequence = 0;
+        this.flushTimer = null;
+        this.flushPromise = null;
+        this.refreshPromise = null;
+        this.sessionStartTime = null;
+
+        if (this.attemptId && this.authTokenMaxAge) {
+            this.scheduleTokenRefresh(this.authTokenMaxAge);
+        }
+        if (this.attemptId) {
+            document.addEventListener("visibilitychange", () => {
+                if (document.visibilityState === "hidden") {
+                    this.flush(true);
+                }
+            });
+            // keepalive requests outlive the page and, unlike sendBeacon, can carry the auth header.
+            // The page may be frozen before any promise settles, so both are sent right away.
+            window.addEventListener("pagehide", () => {
+                const ending = Boolean(this.sessionStartTime);
+                if (ending) {
+                    this.recordSessionEnd();
+                }
+                this.flushOnHide(ending);
+                if (ending) {
+                    this.post(`attempts/${this.attemptId}/end_session/`, {}, true);
+                }
+            });
+        }
     }
 
     LMSInitialize(str) {
         console.log("LMSInitialize called with: " + str);
+        if (this.attemptId && !this.sessionStartTime) {
+            this.startSession();
+        }
         return "true";
     }
 
     LMSFinish(str) {
         console.log("LMSFinish called with: " + str);
+        if (this.attemptId && this.sessionStartTime) {
+            this.close();
+        } else {
+            this.flush(false, true);
+        }
         return "true";
     }
 
@@ -21,11 +74,13 @@ class SCORMAPI {
     LMSSetValue(element, value) {
         console.log("LMSSetValue called with: " + element + " = " + value);
         this.data[element] = value;
+        this.queue(element, value);
         return "true";
     }
 
     LMSCommit(str) {
         console.log("LMSCommit called with: " + str);
+        this.flush(false, true);
         return "true";
     }
 
@@ -40,4 +95,215 @@ class SCORMAPI {
     LMSGetDiagnostic(errorCode) {
         return "No diagnostic information";
     }
-}
\ No newline at end of file
+
+    queue(element, value) {
+        if (!this.attemptId || value === null || value === undefined) {
+            return;
+        }
+        // Coalesce repeated writes, keeping the order of the last write
+        this.pending.delete(element);
+        this.pending.set(element, String(value));
+        if (!this.flushTimer) {
+            this.flushTimer = setTimeout(() => {
+                this.flushTimer = null;
+                this.flush();
+            }, this.flushInterval);
+        }
+    }
+
+    async startSession() {
+        this.sessionStartTime = new Date();
+        try {
+            await this.call(`attempts/${this.attemptId}/start_session/`, {});
+            // The defaults are recorded server-side; the embedded payload only let reads start earlier
+            const bootstrap = await this.call(`attempts/${this.attemptId}/bootstrap/`, {});
+            this.data = Object.assign({}, bootstrap.cmi, this.data);
+        } catch (error) {
+            console.error("Error starting session: " + error.message);
+        }
+    }
+
+    sessionTime() {
+        const duration = new Date() - this.sessionStartTime;
+        const hours = Math.floor(duration / 3600000).toString().padStart(2, "0");
+        const minutes = Math.floor((duration % 3600000) / 60000).toString().padStart(2, "0");
+        const seconds = Math.floor((duration % 60000) / 1000).toString().padStart(2, "0");
+        return `${hours}:${minutes}:${seconds}`;
+    }
+
+    recordSessionEnd() {
+        this.queue("cmi.core.session_time", this.sessionTime());
+        this.queue("cmi.core.exit", "suspend");
+    }
+
+    async close() {
+        if (!this.sessionStartTime) {
+            return;
+        }
+        this.recordSessionEnd();
+        this.sessionStartTime = null;
+        let closed = false;
+        try {
+            if (!await this.flush(false, true)) {
+                throw new Error("Buffered values could not be saved");
+            }
+            await this.call(`attempts/${this.attemptId}/end_session/`, {});
+            closed = true;
+        } catch (error) {
+            console.error("Error closing SCORM session: " + error.message);
+        }
+        if (this.onClose) {
+            this.onClose(closed);
+        }
+    }
+
+    scheduleTokenRefresh(expiresIn) {
+        setTimeout(() => this.refreshToken(), expiresIn * 800);
+    }
+
+    // Concurrent callers share one refresh; resolves to whether a new token was obtained
+    refreshToken() {
+        if (!this.refreshPromise) {
+            this.refreshPromise = fetch(this.apiBaseUrl + "scorm-api/refresh_token/", {
+                method: "POST",
+                headers: {
+                    "Authorization": `Bearer ${this.authToken}`,
+                    "Content-Type": "application/json",
+                },
+                body: "{}",
+            })
+                .then((response) => {
+                    if (!response.ok) {
+                        throw new Error(`HTTP error! status: ${response.status}`);
+                    }
+                    return response.json();
+                })
+                .then((data) => {
+                    this.authToken = data.token;
+                    this.scheduleTokenRefresh(data.expires_in);
+                    return true;
+                })
+                .catch((error) => {
+                    console.error("Error refreshing runtime token: " + error.message);
+                    this.scheduleTokenRefresh(30);
+                    return false;
+                })
+                .finally(() => {
+                    this.refreshPromise = null;
+                });
+        }
+        return this.refreshPromise;
+    }
+
+    async post(endpoint, body, keepalive = false, retry = true) {
+        const response = await fetch(this.apiBaseUrl + endpoint, {
+            method: "POST",
+            keepalive: keepalive,
+            headers: {
+                "Authorization": `Bearer ${this.authToken}`,
+                "Content-Type": "application/json",
+            },
+            body: JSON.stringify(body),
+        });
+        // A token that expired while the page was in the background is renewed once
+        if (response.status === 401 && retry && await this.refreshToken()) {
+            return this.post(endpoint, body, keepalive, false);
+        }
+        return response;
+    }
+
+    async call(endpoint, body) {
+        const response = await this.post(endpoint, body);
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        return response.json();
+    }
+
+    takeBatch() {
+        // A failed batch is resent unchanged so the server can detect duplicates by sequence
+        if (!this.inFlight && this.pending.size > 0) {
+            this.inFlight = {
+                attempt_id: this.attemptId,
+                client_session: this.clientSession,
+                sequence: ++this.sequence,
+                operations: Array.from(this.pending, ([element, value]) => ({ op: "set", element_id: element, value: value }))
+            };
+            this.pending = new Map();
+        }
+        return this.inFlight;
+    }
+
+    // A commit asks the server to persist the batch before answering
+    async flush(keepalive = false, commit = false) {
+        if (!this.attemptId) {
+            return true;
+        }
+        while (this.flushPromise) {
+            await this.flushPromise;
+        }
+        const batch = this.takeBatch();
+        if (!batch) {
+            return true;
+        }
+        if (commit) {
+            batch.commit = true;
+        }
+        const flushed = await this.sendBatch(batch, keepalive);
+        if (flushed && this.pending.size > 0) {
+            return this.flush(keepalive, commit);
+        }
+        return flushed;
+    }
+
+    // Send everything buffered without waiting for a batch still in flight: its
+    // values are folded into a new batch, whose higher sequence makes the server
+    // skip the older one if that arrives last
+    flushOnHide(commit) {
+        if (!this.attemptId) {
+            return;
+        }
+        if (this.inFlight) {
+            const values = new Map(this.inFlight.operations.map((operation) => [operation.element_id, operation.value]));
+            this.pending.forEach((value, element) => {
+                values.delete(element);
+                values.set(element, value);
+            });
+            this.pending = values;
+            this.inFlight = null;
+        }
+        const batch = this.takeBatch();
+        if (!batch) {
+            return;
+        }
+        if (commit) {
+            batch.commit = true;
+        }
+        this.sendBatch(batch, true);
+    }
+
+    sendBatch(batch, keepalive) {
+        const promise = this.post("scorm-api/batch/", batch, keepalive)
+            .then((response) => {
+                if (!response.ok) {
+                    throw new Error(`HTTP error! status: ${response.status}`);
+                }
+                // A batch sent on page hide may have replaced this one
+                if (this.inFlight === batch) {
+                    this.inFlight = null;
+                }
+                return true;
+            })
+            .catch((error) => {
+                console.error("Error flushing buffered values: " + error.message);
+                return false;
+            })
+            .finally(() => {
+                if (this.flushPromise === promise) {
+                    this.flushPromise = null;
+                }
+            });
+        this.flushPromise = promise;
+        return promise;
+    }
+}